@@ -4,7 +4,7 @@ from django_components import Component, register
 from pydantic import BaseModel
 
 from base.main import TAB_VAR, ObjectList
-from base.pagination import PAGE_VAR, Pagination
+from base.pagination import PAGE_VAR, KeysetPagination, Pagination
 from base.templatetags.base_templatetags import querystring
 
 
@@ -58,6 +58,14 @@ class PaginationComponent(Component):
 
     def get_template_data(self, args, kwargs, slots, context):
         pagination = kwargs.pagination_obj
+        if isinstance(pagination, KeysetPagination):
+            # cursors only know their neighbours, so there are no page numbers
+            return {
+                "pagination": pagination,
+                "previous_page_link": pagination.previous_link,
+                "next_page_link": pagination.next_link,
+                "page_elements": [],
+            }
         page_elements = [
             self.pagination_number(pagination, page_num) for page_num in pagination.page_range
         ]
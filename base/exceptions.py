@@ -2,3 +2,9 @@ class IncorrectLookupParameterError(Exception):
     """
     Raised when a query parameter contains an incorrect value.
     """
+
+
+class QueryBudgetExceededError(Exception):
+    """
+    Raised when a view runs more queries than its budget allows.
+    """
@@ -0,0 +1,318 @@
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import connections
+from django.template.base import Template
+from django.utils.cache import patch_vary_headers
+
+from .exceptions import QueryBudgetExceededError
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE_PREFIX = "base:instrumentation"
+STATS_PROCESSES_KEY = f"{STATS_CACHE_PREFIX}:processes"
+STATS_TIMEOUT = 60 * 60 * 24 * 7
+
+# upper bounds of the histogram buckets, the last one catches the rest
+DURATION_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+QUERY_BUCKETS = [1, 2, 5, 10, 20, 50, 100]
+
+_current = ContextVar("request_metrics", default=None)
+_missing = object()
+
+
+class RequestMetrics:
+    """
+    What a single request spent on the database, templates and the cache.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total_time = None
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.started
+
+    def server_timing(self):
+        return ", ".join(
+            [
+                f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"',
+                f"tpl;dur={self.template_time * 1000:.1f}",
+                f'cache;desc="{self.cache_hits} hits, {self.cache_misses} misses"',
+                f"total;dur={self.total_time * 1000:.1f}",
+            ],
+        )
+
+
+def _instrumented_render(render):
+    def instrumented_render(self, context):
+        metrics = _current.get()
+        if metrics is None:
+            return render(self, context)
+        # included templates are rendered within their parent
+        metrics.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - start
+
+    instrumented_render.instrumented = True
+    return instrumented_render
+
+
+def instrument_templates():
+    if not getattr(Template._render, "instrumented", False):
+        Template._render = _instrumented_render(Template._render)
+
+
+def instrument_cache(backend):
+    """
+    Counts the hits and misses of ``backend.get()``. Cache backends are
+    instantiated per thread, so this is done on first use in every thread.
+    """
+    if getattr(backend, "_instrumented", False):
+        return
+    get = backend.get
+
+    def instrumented_get(key, default=None, *args, **kwargs):
+        value = get(key, _missing, *args, **kwargs)
+        metrics = _current.get()
+        if metrics is not None:
+            if value is _missing:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return default if value is _missing else value
+
+    backend.get = instrumented_get
+    backend._instrumented = True
+
+
+class ViewStats:
+    """
+    Accumulates the metrics of the requests to a view into totals and
+    histograms, which can be merged across processes.
+    """
+
+    fields = [
+        "requests",
+        "queries",
+        "max_queries",
+        "sql_ms",
+        "template_ms",
+        "total_ms",
+        "cache_hits",
+        "cache_misses",
+    ]
+
+    def __init__(self, data=None):
+        data = data or {}
+        for field in self.fields:
+            setattr(self, field, data.get(field, 0))
+        self.duration_histogram = list(
+            data.get("duration_histogram", [0] * (len(DURATION_BUCKETS_MS) + 1)),
+        )
+        self.query_histogram = list(data.get("query_histogram", [0] * (len(QUERY_BUCKETS) + 1)))
+
+    def add(self, metrics):
+        total_ms = metrics.total_time * 1000
+        self.requests += 1
+        self.queries += metrics.queries
+        self.max_queries = max(self.max_queries, metrics.queries)
+        self.sql_ms += metrics.sql_time * 1000
+        self.template_ms += metrics.template_time * 1000
+        self.total_ms += total_ms
+        self.cache_hits += metrics.cache_hits
+        self.cache_misses += metrics.cache_misses
+        self.duration_histogram[bisect.bisect_left(DURATION_BUCKETS_MS, total_ms)] += 1
+        self.query_histogram[bisect.bisect_left(QUERY_BUCKETS, metrics.queries)] += 1
+
+    def merge(self, other):
+        for field in self.fields:
+            if field == "max_queries":
+                self.max_queries = max(self.max_queries, other.max_queries)
+            else:
+                setattr(self, field, getattr(self, field) + getattr(other, field))
+        for histogram, other_histogram in [
+            (self.duration_histogram, other.duration_histogram),
+            (self.query_histogram, other.query_histogram),
+        ]:
+            for i, count in enumerate(other_histogram):
+                histogram[i] += count
+
+    def percentile_ms(self, percentile):
+        """
+        Returns the upper bound of the duration bucket the given percentile
+        of requests falls in, or None if it's in the open-ended last one.
+        """
+        threshold = self.requests * percentile / 100
+        seen = 0
+        for bound, count in zip(DURATION_BUCKETS_MS, self.duration_histogram, strict=False):
+            seen += count
+            if seen >= threshold:
+                return bound
+        return None
+
+    def as_dict(self):
+        data = {field: getattr(self, field) for field in self.fields}
+        data["duration_histogram"] = list(self.duration_histogram)
+        data["query_histogram"] = list(self.query_histogram)
+        return data
+
+
+class StatsCollector:
+    """
+    The stats of this process, per URL name. They are stored in the cache
+    under a key of their own every ``INSTRUMENTATION_FLUSH_INTERVAL``
+    seconds, for ``collected_stats()`` to merge with those of the other
+    processes. That takes a cache shared between the processes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.last_flush = time.monotonic()
+
+    @property
+    def cache_key(self):
+        # workers forked after the import each get their own
+        return f"{STATS_CACHE_PREFIX}:{socket.gethostname()}:{os.getpid()}"
+
+    def add(self, view_name, metrics):
+        with self.lock:
+            self.views.setdefault(view_name, ViewStats()).add(metrics)
+            interval = getattr(settings, "INSTRUMENTATION_FLUSH_INTERVAL", 60)
+            if time.monotonic() - self.last_flush < interval:
+                return
+            self.last_flush = time.monotonic()
+            snapshot = {name: stats.as_dict() for name, stats in self.views.items()}
+        self.flush(snapshot)
+
+    def flush(self, snapshot):
+        cache.set(self.cache_key, snapshot, STATS_TIMEOUT)
+        processes = cache.get(STATS_PROCESSES_KEY) or []
+        if self.cache_key not in processes:
+            cache.set(STATS_PROCESSES_KEY, [*processes, self.cache_key], STATS_TIMEOUT)
+
+
+collector = StatsCollector()
+
+
+def collected_stats():
+    """
+    Returns the stats flushed by every process, merged per URL name.
+    """
+    merged = {}
+    for snapshot in cache.get_many(cache.get(STATS_PROCESSES_KEY) or []).values():
+        for name, data in snapshot.items():
+            merged.setdefault(name, ViewStats()).merge(ViewStats(data))
+    return merged
+
+
+def reset_stats():
+    keys = cache.get(STATS_PROCESSES_KEY) or []
+    cache.delete_many([*keys, STATS_PROCESSES_KEY])
+
+
+def check_query_budget(view_name, metrics):
+    """
+    Logs, or with ``QUERY_BUDGET_ACTION = "raise"`` raises, when a view ran
+    more queries than its entry in ``QUERY_BUDGETS`` allows.
+    """
+    budget = getattr(settings, "QUERY_BUDGETS", {}).get(view_name)
+    if budget is None or metrics.queries <= budget:
+        return
+    message = f"{view_name} ran {metrics.queries} queries, its budget is {budget}."
+    if getattr(settings, "QUERY_BUDGET_ACTION", "log") == "raise":
+        raise QueryBudgetExceededError(message)
+    logger.warning(message)
+
+
+def server_timing_for_everyone():
+    return getattr(settings, "SERVER_TIMING", settings.DEBUG)
+
+
+def show_server_timing(request, response):
+    """
+    Whether the response may reveal its timings, which is the case with
+    ``SERVER_TIMING = True``, by default only under DEBUG, and for staff
+    unless shared caches may store the response and serve it to others.
+    """
+    if server_timing_for_everyone():
+        return True
+    user = getattr(request, "user", None)
+    if user is None or not user.is_staff:
+        return False
+    cache_control = {
+        directive.split("=")[0].strip().lower()
+        for directive in response.get("Cache-Control", "").split(",")
+    }
+    return "public" not in cache_control
+
+
+class InstrumentationMiddleware:
+    """
+    Measures the queries, SQL time, template rendering time and cache hits
+    and misses of every request, reports them in a ``Server-Timing`` header
+    to those ``show_server_timing()`` allows and collects them per URL name.
+    Keep it first, so it sees everything. Streaming responses are measured
+    up to the start of their content.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        for alias in settings.CACHES:
+            instrument_cache(caches[alias])
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for alias in settings.DATABASES:
+                    stack.enter_context(connections[alias].execute_wrapper(metrics.execute))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        metrics.finish()
+
+        if show_server_timing(request, response):
+            server_timing = metrics.server_timing()
+            if response.has_header("Server-Timing"):
+                server_timing = f"{response['Server-Timing']}, {server_timing}"
+            response["Server-Timing"] = server_timing
+            if not server_timing_for_everyone():
+                # only staff get it, so caches have to tell them apart
+                patch_vary_headers(response, ["Cookie"])
+
+        match = getattr(request, "resolver_match", None)
+        view_name = match.view_name if match is not None else "<unresolved>"
+        collector.add(view_name, metrics)
+        check_query_budget(view_name, metrics)
+        return response
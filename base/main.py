@@ -1,4 +1,4 @@
-from .pagination import PAGE_VAR, Pagination
+from .pagination import CURSOR_VAR, PAGE_VAR, Pagination
 
 TAB_VAR = "tab"
 
@@ -7,6 +7,8 @@ class ObjectList:
     pagination_class = Pagination
     base_ordering = ()
     sorting_tabs = {}
+    list_select_related = ()
+    list_prefetch_related = ()
 
     def __init__(self, request, model, queryset, list_per_page):
         self.model = model
@@ -17,8 +19,8 @@ class ObjectList:
         self.current_tab = self.params.get(TAB_VAR, None)
         if self.opts.ordering:
             self.base_ordering = list(self.opts.ordering)
-        if PAGE_VAR in self.params:
-            del self.params[PAGE_VAR]
+        for var in (PAGE_VAR, CURSOR_VAR):
+            self.params.pop(var, None)
         self.result_objects = self.get_objects(request, queryset)
 
     def __iter__(self):
@@ -28,7 +30,8 @@ class ObjectList:
         result_queryset = queryset
         if self.current_tab:
             sort_value = self.sorting_tabs[self.current_tab]
-            result_queryset = result_queryset.order_by(*sort_value, *self.base_ordering)
+            ordering = dict.fromkeys([*sort_value, *self.base_ordering])
+            result_queryset = result_queryset.order_by(*ordering)
         else:
             for tab_name, tab_order in self.sorting_tabs.items():
                 if list(tab_order) == self.base_ordering:
@@ -47,6 +50,17 @@ class ObjectList:
         self.pagination = pagination
         return pagination.get_objects()
 
+    def apply_related(self, queryset):
+        """
+        Fetches the relations the list renders along with each page, so
+        the query count doesn't grow with the page size.
+        """
+        if self.list_select_related:
+            queryset = queryset.select_related(*self.list_select_related)
+        if self.list_prefetch_related:
+            queryset = queryset.prefetch_related(*self.list_prefetch_related)
+        return queryset
+
     def get_objects(self, request, queryset):
         tab_result = self.tab_sort(queryset)
-        return self.paginate(request, tab_result)
+        return self.paginate(request, self.apply_related(tab_result))
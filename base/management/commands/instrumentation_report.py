@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from base.instrumentation import collected_stats, reset_stats
+
+SORT_KEYS = {
+    "requests": lambda stats: stats.requests,
+    "queries": lambda stats: stats.queries / stats.requests,
+    "time": lambda stats: stats.total_ms / stats.requests,
+    "sql": lambda stats: stats.sql_ms / stats.requests,
+}
+
+
+class Command(BaseCommand):
+    help = "Show the query counts and timings per view collected by InstrumentationMiddleware."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sort",
+            choices=sorted(SORT_KEYS),
+            default="time",
+            help="Order of the views, highest first (default: time).",
+        )
+        parser.add_argument(
+            "--json",
+            action="store_true",
+            help="Dump the raw totals and histograms as JSON.",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Forget the collected stats after showing them.",
+        )
+
+    def handle(self, *args, **options):
+        stats = collected_stats()
+        if options["json"]:
+            data = {name: view_stats.as_dict() for name, view_stats in stats.items()}
+            self.stdout.write(json.dumps(data, indent=2, sort_keys=True))
+        else:
+            self.stdout.write(
+                f"{'view':<32} {'requests':>8} {'queries':>8} {'max':>5} {'sql ms':>8} "
+                f"{'tpl ms':>8} {'avg ms':>8} {'p95 ms':>7} {'cache hits':>10}",
+            )
+            ordered = sorted(stats.items(), key=lambda item: SORT_KEYS[options["sort"]](item[1]))
+            for name, view_stats in reversed(ordered):
+                requests = view_stats.requests
+                lookups = view_stats.cache_hits + view_stats.cache_misses
+                p95 = view_stats.percentile_ms(95)
+                self.stdout.write(
+                    f"{name:<32} {requests:>8} {view_stats.queries / requests:>8.1f} "
+                    f"{view_stats.max_queries:>5} {view_stats.sql_ms / requests:>8.1f} "
+                    f"{view_stats.template_ms / requests:>8.1f} "
+                    f"{view_stats.total_ms / requests:>8.1f} "
+                    f"{p95 if p95 is not None else '>2500':>7} "
+                    f"{view_stats.cache_hits / lookups if lookups else 0:>10.0%}",
+                )
+        if options["reset"]:
+            reset_stats()
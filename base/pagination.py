@@ -1,8 +1,32 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.core.paginator import InvalidPage, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.utils.functional import cached_property
 
 from .exceptions import IncorrectLookupParameterError
+from .templatetags.base_templatetags import querystring
 
 PAGE_VAR = "page"
+CURSOR_VAR = "cursor"
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    Keeps the microseconds DjangoJSONEncoder cuts off, cursors have to hold
+    the exact values of the row they seek from.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime | datetime.time):
+            return o.isoformat()
+        return super().default(o)
 
 
 class Pagination:
@@ -52,3 +76,170 @@ class Pagination:
             except InvalidPage as err:
                 raise IncorrectLookupParameterError from err
         return result_list
+
+
+class KeysetPagination(Pagination):
+    """
+    Paginates by seeking past the last row of the previous page instead of
+    counting and skipping rows with ``OFFSET``, so deep pages cost as much as
+    the first one.
+
+    The queryset's ordering, completed with the primary key, is the cursor.
+    Only plain local fields can be ordered on. Pages are addressed by an
+    opaque token in the ``cursor`` query parameter.
+    """
+
+    # Below this many rows the planner's estimate isn't worth its inaccuracy.
+    approximate_count_threshold = 10000
+
+    def __init__(self, request, model, queryset, list_per_page):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        super().__init__(request, model, queryset, list_per_page)
+
+    @property
+    def page_range(self):
+        return []
+
+    def get_ordering(self):
+        ordering = list(self.queryset.query.order_by or self.opts.ordering)
+        pk_names = {"pk", self.opts.pk.name}
+        if not any(name.lstrip("-") in pk_names for name in ordering if isinstance(name, str)):
+            descending = bool(ordering) and str(ordering[-1]).startswith("-")
+            ordering.append("-pk" if descending else "pk")
+        for name in ordering:
+            if not isinstance(name, str) or LOOKUP_SEP in name or name.startswith("?"):
+                msg = f"{self.__class__.__name__} can't order by {name!r}."
+                raise ImproperlyConfigured(msg)
+        return ordering
+
+    def get_field(self, name):
+        name = name.lstrip("-")
+        if name == "pk":
+            return self.opts.pk
+        return self.opts.get_field(name)
+
+    def encode_cursor(self, obj, direction):
+        values = [getattr(obj, self.get_field(name).attname) for name in self.ordering]
+        payload = json.dumps(
+            {"o": self.ordering, "d": direction, "v": values},
+            cls=CursorEncoder,
+            separators=(",", ":"),
+        )
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        """
+        Returns the ``(direction, values)`` a cursor points at, or None for
+        a missing or unusable cursor, which means the first page.
+        """
+        if not cursor:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+            if payload["o"] != self.ordering or payload["d"] not in ("next", "prev"):
+                return None
+            values = [
+                self.get_field(name).to_python(value)
+                for name, value in zip(self.ordering, payload["v"], strict=True)
+            ]
+        except (ValueError, TypeError, KeyError, ValidationError):
+            return None
+        if not all(map(self.in_range, self.ordering, values)):
+            return None
+        return payload["d"], values
+
+    def in_range(self, name, value):
+        """
+        Whether the database can compare ``value`` with the integer column
+        of ``name``, rather than failing the query with a DataError.
+        """
+        ops = connections[self.queryset.db].ops
+        internal_type = self.get_field(name).get_internal_type()
+        if value is None or internal_type not in ops.integer_field_ranges:
+            return True
+        low, high = ops.integer_field_range(internal_type)
+        return (low is None or value >= low) and (high is None or value <= high)
+
+    def seek_filter(self, values, backwards=False):
+        """
+        Matches the rows after ``values`` in the ordering (or before them when
+        going ``backwards``).
+        """
+        names = [name.lstrip("-") for name in self.ordering]
+        seek = Q()
+        for i, name in enumerate(self.ordering):
+            descending = name.startswith("-") != backwards
+            condition = Q(**{f"{names[i]}__{'lt' if descending else 'gt'}": values[i]})
+            for prev_name, prev_value in zip(names[:i], values[:i], strict=True):
+                condition &= Q(**{prev_name: prev_value})
+            seek |= condition
+        # a plain bound on the leading column lets an index range scan start there
+        descending = self.ordering[0].startswith("-") != backwards
+        return Q(**{f"{names[0]}__{'lte' if descending else 'gte'}": values[0]}) & seek
+
+    def setup(self):
+        self.ordering = self.get_ordering()
+        position = self.decode_cursor(self.cursor)
+        backwards = position is not None and position[0] == "prev"
+
+        queryset = self.queryset.order_by(*self.ordering)
+        if backwards:
+            reverse_ordering = [
+                name[1:] if name.startswith("-") else f"-{name}" for name in self.ordering
+            ]
+            queryset = queryset.filter(self.seek_filter(position[1], backwards=True))
+            queryset = queryset.order_by(*reverse_ordering)
+        elif position is not None:
+            queryset = queryset.filter(self.seek_filter(position[1]))
+
+        # one extra row tells whether there is anything beyond this page
+        rows = list(queryset[: self.list_per_page + 1])
+        has_more = len(rows) > self.list_per_page
+        rows = rows[: self.list_per_page]
+        if backwards:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = position is not None, has_more
+
+        self.object_list = rows
+        self.multi_page = self.has_previous or self.has_next
+
+    def get_link(self, obj, direction):
+        params = {**self.params, CURSOR_VAR: self.encode_cursor(obj, direction), PAGE_VAR: None}
+        return querystring(None, params)
+
+    @property
+    def previous_link(self):
+        if not self.has_previous or not self.object_list:
+            return ""
+        return self.get_link(self.object_list[0], "prev")
+
+    @property
+    def next_link(self):
+        if not self.has_next or not self.object_list:
+            return ""
+        return self.get_link(self.object_list[-1], "next")
+
+    def approximate_count(self):
+        """
+        Returns the planner's row estimate for the queryset, filters
+        included, on PostgreSQL, or None when it doesn't apply.
+        """
+        if connections[self.queryset.db].vendor != "postgresql":
+            return None
+        plan = json.loads(self.queryset.order_by().explain(format="json"))
+        rows = plan["Plan"]["Plan Rows"]
+        if rows < self.approximate_count_threshold:
+            return None
+        return int(rows)
+
+    @cached_property
+    def result_count(self):
+        estimate = self.approximate_count()
+        if estimate is not None:
+            return estimate
+        return self.queryset.count()
+
+    def get_objects(self):
+        return self.object_list
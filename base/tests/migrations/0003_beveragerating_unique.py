@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("tests", "0002_fish"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="beveragerating",
+            name="hashed",
+        ),
+        migrations.AddConstraint(
+            model_name="beveragerating",
+            constraint=models.UniqueConstraint(
+                fields=("user", "content_object"),
+                name="unique_beverage_rating",
+            ),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("tests", "0003_beveragerating_unique"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fish",
+            name="caught",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -6,6 +6,7 @@ from ratings.models import RatedItemBase, Ratings
 class Fish(models.Model):
     name = models.CharField(max_length=255)
     price = models.IntegerField()
+    caught = models.DateTimeField(null=True)
 
     class Meta:
         ordering = ("name",)
@@ -23,6 +24,14 @@ class Food(models.Model):
 class BeverageRating(RatedItemBase):
     content_object = models.ForeignKey("Beverage", on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "content_object"],
+                name="unique_beverage_rating",
+            ),
+        ]
+
 
 class Beverage(models.Model):
     name = models.CharField(max_length=50)
@@ -1,7 +1,22 @@
+import base64
+import datetime
+import json
+from io import StringIO
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.template import Context, Template
 from django.test import RequestFactory, TestCase
+from django.urls import ResolverMatch
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
 
+from base.exceptions import QueryBudgetExceededError
+from base.instrumentation import InstrumentationMiddleware, collector, reset_stats
 from base.main import ObjectList
-from base.pagination import Pagination
+from base.pagination import CURSOR_VAR, KeysetPagination, Pagination
 
 from .models import Fish
 
@@ -125,3 +140,181 @@ class PaginationTestCase(TestCase):
             objects = pagination.get_objects()
             object_names = list(objects.values_list("name", flat=True))
             self.assertEqual(object_names, expect_object_names)
+
+
+class KeysetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # every price appears twice, so the primary key has to break ties
+        # and they are caught microseconds apart, also in pairs
+        caught = timezone.now().replace(microsecond=0)
+        fishs = [
+            Fish(
+                name=f"fish-{i:02}",
+                price=(i // 2) * 100,
+                caught=caught + datetime.timedelta(microseconds=i // 2),
+            )
+            for i in range(25)
+        ]
+        Fish.objects.bulk_create(fishs)
+        cls.factory = RequestFactory()
+
+    def walk(self, queryset, list_per_page):
+        names = []
+        request = self.factory.get("/fake-url/")
+        while True:
+            pagination = KeysetPagination(request, Fish, queryset, list_per_page)
+            names.append([fish.name for fish in pagination.get_objects()])
+            if not pagination.next_link:
+                return names
+            request = self.factory.get(f"/fake-url/{pagination.next_link}")
+
+    def test_keyset_pagination_pages(self):
+        for ordering in [("name",), ("-price",), ("price", "-name"), ("caught",), ("-caught",)]:
+            with self.subTest(ordering=ordering):
+                queryset = Fish.objects.order_by(*ordering)
+                tiebreak = "-pk" if ordering[-1].startswith("-") else "pk"
+                expected = list(
+                    queryset.order_by(*ordering, tiebreak).values_list("name", flat=True),
+                )
+                pages = self.walk(queryset, 4)
+                self.assertEqual([len(page) for page in pages], [4, 4, 4, 4, 4, 4, 1])
+                self.assertEqual([name for page in pages for name in page], expected)
+
+    def test_keyset_pagination_previous_pages(self):
+        for ordering in ["-price", "-caught"]:
+            with self.subTest(ordering=ordering):
+                queryset = Fish.objects.order_by(ordering)
+                request = self.factory.get("/fake-url/")
+                pagination = KeysetPagination(request, Fish, queryset, 10)
+                forward = []
+                while pagination.has_next:
+                    forward.append([fish.name for fish in pagination.get_objects()])
+                    request = self.factory.get(f"/fake-url/{pagination.next_link}")
+                    pagination = KeysetPagination(request, Fish, queryset, 10)
+                forward.append([fish.name for fish in pagination.get_objects()])
+
+                backward = [[fish.name for fish in pagination.get_objects()]]
+                while pagination.has_previous:
+                    request = self.factory.get(f"/fake-url/{pagination.previous_link}")
+                    pagination = KeysetPagination(request, Fish, queryset, 10)
+                    backward.insert(0, [fish.name for fish in pagination.get_objects()])
+                self.assertEqual(backward, forward)
+                self.assertEqual(len(forward), 3)
+
+    def test_keyset_pagination_attributes(self):
+        request = self.factory.get("/fake-url/")
+        pagination = KeysetPagination(request, Fish, Fish.objects.all(), 10)
+        self.assertEqual(pagination.result_count, 25)
+        self.assertTrue(pagination.multi_page)
+        self.assertFalse(pagination.has_previous)
+        self.assertEqual(pagination.previous_link, "")
+        self.assertIn(f"{CURSOR_VAR}=", pagination.next_link)
+        pagination = KeysetPagination(request, Fish, Fish.objects.all(), 30)
+        self.assertFalse(pagination.multi_page)
+        self.assertEqual(pagination.next_link, "")
+
+        # filtered lists are estimated too, once they are big enough
+        pagination = KeysetPagination(request, Fish, Fish.objects.filter(price__gt=0), 10)
+        pagination.approximate_count_threshold = 0
+        self.assertIsInstance(pagination.approximate_count(), int)
+
+    def test_keyset_pagination_invalid_cursor(self):
+        queryset = Fish.objects.order_by("name")
+        request = self.factory.get("/fake-url/")
+        first_page = KeysetPagination(request, Fish, queryset, 5).get_objects()
+        for cursor in ["garbage", "e30", ""]:
+            with self.subTest(cursor=cursor):
+                request = self.factory.get("/fake-url/", {CURSOR_VAR: cursor})
+                pagination = KeysetPagination(request, Fish, queryset, 5)
+                self.assertEqual(pagination.get_objects(), first_page)
+
+        # so does one with values the column can't hold
+        payload = json.dumps({"o": ["name", "pk"], "d": "next", "v": ["fish-05", 2**70]})
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        request = self.factory.get("/fake-url/", {CURSOR_VAR: cursor})
+        pagination = KeysetPagination(request, Fish, queryset, 5)
+        self.assertEqual(pagination.get_objects(), first_page)
+
+        # a cursor for another ordering starts over instead of seeking wrongly
+        request = self.factory.get("/fake-url/")
+        next_link = KeysetPagination(request, Fish, queryset, 5).next_link
+        request = self.factory.get(f"/fake-url/{next_link}")
+        pagination = KeysetPagination(request, Fish, Fish.objects.order_by("-price"), 5)
+        self.assertEqual(pagination.get_objects(), list(Fish.objects.order_by("-price", "-pk")[:5]))
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        collector.views.clear()
+        self.addCleanup(collector.views.clear)
+        self.factory = RequestFactory()
+
+    def fish_list(self, request):
+        fish = list(Fish.objects.all())
+        cache.get("missing")
+        cache.set("present", True)
+        cache.get("present")
+        return HttpResponse(Template("{{ fish|length }}").render(Context({"fish": fish})))
+
+    def get(self, user=None):
+        request = self.factory.get("/fish/")
+        if user is not None:
+            request.user = user
+        request.resolver_match = ResolverMatch(self.fish_list, (), {}, url_name="fish_list")
+        return InstrumentationMiddleware(self.fish_list)(request)
+
+    def test_server_timing(self):
+        with self.settings(SERVER_TIMING=True):
+            response = self.get()
+        self.assertIn('desc="1 queries"', response["Server-Timing"])
+        self.assertIn('cache;desc="1 hits, 1 misses"', response["Server-Timing"])
+        self.assertIn("tpl;dur=", response["Server-Timing"])
+        self.assertEqual(collector.views["fish_list"].requests, 1)
+        self.assertEqual(collector.views["fish_list"].query_histogram[0], 1)
+
+        # the timings are still collected, only not revealed
+        with self.settings(DEBUG=False):
+            self.assertFalse(self.get().has_header("Server-Timing"))
+            self.assertFalse(self.get(AnonymousUser()).has_header("Server-Timing"))
+            response = self.get(User(is_staff=True))
+            self.assertTrue(response.has_header("Server-Timing"))
+            self.assertEqual(response["Vary"], "Cookie")
+            # shared caches could hand a public response to anyone
+            self.fish_list = cache_control(public=True)(self.fish_list)
+            self.assertFalse(self.get(User(is_staff=True)).has_header("Server-Timing"))
+        self.assertEqual(collector.views["fish_list"].requests, 5)
+
+    def test_query_budget(self):
+        with self.settings(QUERY_BUDGETS={"fish_list": 1}):
+            self.get()
+        with (
+            self.settings(QUERY_BUDGETS={"fish_list": 0}, QUERY_BUDGET_ACTION="log"),
+            self.assertLogs("base.instrumentation", "WARNING") as logs,
+        ):
+            self.get()
+        self.assertIn("fish_list ran 1 queries, its budget is 0.", logs.output[0])
+        with (
+            self.settings(QUERY_BUDGETS={"fish_list": 0}, QUERY_BUDGET_ACTION="raise"),
+            self.assertRaises(QueryBudgetExceededError),
+        ):
+            self.get()
+
+    def test_instrumentation_report(self):
+        self.addCleanup(reset_stats)
+        with self.settings(INSTRUMENTATION_FLUSH_INTERVAL=0):
+            self.get()
+            self.get()
+        out = StringIO()
+        call_command("instrumentation_report", json=True, stdout=out)
+        stats = json.loads(out.getvalue())
+        self.assertEqual(stats["fish_list"]["requests"], 2)
+        self.assertEqual(stats["fish_list"]["queries"], 2)
+
+        out = StringIO()
+        call_command("instrumentation_report", reset=True, stdout=out)
+        self.assertIn("fish_list", out.getvalue())
+        out = StringIO()
+        call_command("instrumentation_report", json=True, stdout=out)
+        self.assertEqual(json.loads(out.getvalue()), {})
@@ -1,5 +1,10 @@
 from django.contrib import admin
+from django.http import Http404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
 
+from .jobs import get_job, start_job
 from .models import Language, Snippet, SnippetFlag
 
 
@@ -21,15 +26,13 @@ class SnippetAdmin(admin.ModelAdmin):
     actions = ["mark_as_inappropiate", "mark_as_spam"]
 
     def mark_as_inappropiate(self, request, queryset):
-        for obj in queryset:
-            obj.mark_as_inappropiate()
+        SnippetFlag.objects.flag_snippets(queryset, SnippetFlag.FLAG_INAPPROPRIATE)
         self.message_user(request, "Snippets marked as inappropiate successfully")
 
     mark_as_inappropiate.short_description = "Mark snippets as inappropiate"
 
     def mark_as_spam(self, request, queryset):
-        for obj in queryset:
-            obj.mark_as_spam()
+        SnippetFlag.objects.flag_snippets(queryset, SnippetFlag.FLAG_SPAM)
         self.message_user(request, "Snippets marked as spam successfully")
 
     mark_as_spam.short_description = "Mark snippets as spam"
@@ -44,10 +47,52 @@ class SnippetFlagAdmin(admin.ModelAdmin):
         "user",
     )
 
+    # selections with more snippets than this are removed in the background
+    background_threshold = 500
+
+    def get_urls(self):
+        return [
+            path(
+                "jobs/<str:job_id>/",
+                self.admin_site.admin_view(self.job_view),
+                name="cab_snippetflag_job",
+            ),
+            *super().get_urls(),
+        ]
+
+    def job_view(self, request, job_id):
+        job = get_job(job_id)
+        if job is None:
+            raise Http404
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": job["description"],
+            "job": job,
+        }
+        return TemplateResponse(request, "admin/cab/snippetflag/job.html", context)
+
     def remove_and_ban(self, request, queryset):
-        for obj in queryset:
-            obj.remove_and_ban()
-        self.message_user(request, "Snippets removed successfully")
+        snippet_ids = set(queryset.values_list("snippet_id", flat=True))
+        if len(snippet_ids) <= self.background_threshold:
+            Snippet.objects.remove_and_ban(snippet_ids)
+            self.message_user(request, "Snippets removed successfully")
+            return
+
+        job_id = start_job(
+            f"Removing {len(snippet_ids)} snippets and banning their authors",
+            Snippet.objects.remove_and_ban,
+            snippet_ids,
+            total=len(snippet_ids),
+        )
+        self.message_user(
+            request,
+            format_html(
+                'Removing {} snippets in the background, <a href="{}">follow the progress</a>.',
+                len(snippet_ids),
+                reverse("admin:cab_snippetflag_job", args=[job_id]),
+            ),
+        )
 
     remove_and_ban.short_description = "Remove snippet and ban user"
 
@@ -1,13 +1,24 @@
 from django.urls import path
 from rest_framework.urlpatterns import format_suffix_patterns
 
-from .views import SnippetDetail, SnippetList
+from .views import SnippetDetail, SnippetExport, SnippetList, SnippetRecommendations
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
 urlpatterns = [
     path("snippets/", SnippetList.as_view(), name="api_snippet_list"),
     path("snippets/<int:pk>/", SnippetDetail.as_view(), name="api_snippet_detail"),
+    path(
+        "snippets/recommended/",
+        SnippetRecommendations.as_view(),
+        name="api_snippet_recommended",
+    ),
+    path("snippets/export/", SnippetExport.as_view(), name="api_snippet_export"),
+    path(
+        "snippets/export/archive/",
+        SnippetExport.as_view(export_format="tar.gz"),
+        name="api_snippet_export_archive",
+    ),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
@@ -1,15 +1,59 @@
+from django.http import StreamingHttpResponse
 from rest_framework import generics
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
 
+from cab.export import EXPORT_FORMATS, exported_snippets, parse_since
 from cab.models import Snippet
 
 from .serializers import SnippetSerializer
 
 
 class SnippetList(generics.ListCreateAPIView):
-    queryset = Snippet.objects.active_snippet()
+    queryset = Snippet.objects.active_snippet().select_related("author", "language")
     serializer_class = SnippetSerializer
 
 
 class SnippetDetail(generics.RetrieveUpdateAPIView):
-    queryset = Snippet.objects.active_snippet()
+    queryset = Snippet.objects.active_snippet().select_related("author", "language")
+    serializer_class = SnippetSerializer
+
+
+class SnippetRecommendations(generics.ListAPIView):
+    """
+    The snippets recommended to the current user by the ratings of the
+    users who rate like them.
+    """
+
     serializer_class = SnippetSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Snippet.objects.recommended_for(self.request.user)
+
+
+class SnippetExport(APIView):
+    """
+    Streams every active snippet, or with ``?since=<date or datetime>`` the
+    ones updated after it, as NDJSON or as a tarball of their code. See
+    ``exported_snippets()`` for what an incremental export leaves out.
+    """
+
+    queryset = Snippet.objects.active_snippet()
+    export_format = "ndjson"
+
+    def get(self, request, format=None):  # noqa: A002
+        since = request.query_params.get("since")
+        if since:
+            try:
+                since = parse_since(since)
+            except ValueError as e:
+                raise ValidationError({"since": str(e)}) from e
+        export, content_type, filename = EXPORT_FORMATS[self.export_format]
+        response = StreamingHttpResponse(
+            export(exported_snippets(since or None)),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
@@ -0,0 +1,260 @@
+import datetime
+import random
+import statistics
+import time
+import tracemalloc
+
+import django_comments
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from taggit.models import Tag
+
+from ratings.models import RatedItem
+from ratings.utils import calculate_similar_items
+
+from .importer import SnippetImporter, synthetic_records
+from .main import SnippetList
+from .models import Bookmark, Snippet
+
+# how much of everything else a dataset of a given number of snippets gets
+DATASET_RATIOS = {
+    "users": 0.1,
+    "ratings": 5,
+    "bookmarks": 1,
+    "comments": 2,
+}
+
+
+def _bulk_create(model, objects, batch_size=5000):
+    # inserts in batches and ignores the odd duplicate random pick
+    for start in range(0, len(objects), batch_size):
+        model.objects.bulk_create(
+            objects[start : start + batch_size],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+
+def seed_dataset(snippets, seed=0, batch_size=1000, executor=None):
+    """
+    Fills the database with ``snippets`` synthetic snippets, and users,
+    ratings, bookmarks and comments in the proportions of
+    ``DATASET_RATIOS``, and keeps the denormalized counters in line.
+    """
+    rng = random.Random(seed)
+    authors = max(1, int(snippets * DATASET_RATIOS["users"]))
+    importer = SnippetImporter(batch_size, executor)
+    importer.import_records(synthetic_records(snippets, seed, authors=authors))
+    importer.finish()
+
+    snippet_ids = list(Snippet.objects.values_list("pk", flat=True))
+    user_ids = list(
+        Snippet.objects.order_by().values_list("author_id", flat=True).distinct(),
+    )
+    ctype = ContentType.objects.get_for_model(Snippet)
+
+    def picks(kind):
+        count = int(snippets * DATASET_RATIOS[kind])
+        # popular snippets draw most of the activity
+        return zip(
+            rng.choices(snippet_ids, [1 / (i + 1) for i in range(len(snippet_ids))], k=count),
+            rng.choices(user_ids, k=count),
+            strict=True,
+        )
+
+    _bulk_create(
+        RatedItem,
+        [
+            RatedItem(
+                content_type=ctype,
+                object_id=snippet_id,
+                user_id=user_id,
+                score=rng.choice([-1, 1, 1, 1]),
+            )
+            for snippet_id, user_id in picks("ratings")
+        ],
+    )
+    _bulk_create(
+        Bookmark,
+        [
+            Bookmark(snippet_id=snippet_id, user_id=user_id)
+            for snippet_id, user_id in picks("bookmarks")
+        ],
+    )
+    now = timezone.now()
+    _bulk_create(
+        django_comments.get_model(),
+        [
+            django_comments.get_model()(
+                content_type=ctype,
+                object_pk=str(snippet_id),
+                site_id=settings.SITE_ID,
+                user_id=user_id,
+                comment=f"Comment {i} on snippet {snippet_id}.",
+                submit_date=now - datetime.timedelta(minutes=i),
+                is_public=True,
+            )
+            for i, (snippet_id, user_id) in enumerate(picks("comments"))
+        ],
+    )
+
+    ratings = RatedItem.objects.filter(content_type=ctype, object_id=OuterRef("pk")).order_by()
+    Snippet.objects.update(
+        rating_score=Coalesce(
+            Subquery(ratings.values("object_id").annotate(total=Sum("score")).values("total")),
+            0,
+        ),
+        rating_count=Coalesce(
+            Subquery(ratings.values("object_id").annotate(count=Count("pk")).values("count")),
+            0,
+        ),
+        bookmark_count=Coalesce(
+            Subquery(
+                Bookmark.objects.filter(snippet=OuterRef("pk"))
+                .order_by()
+                .values("snippet")
+                .annotate(count=Count("pk"))
+                .values("count"),
+            ),
+            0,
+        ),
+    )
+    return dataset_summary()
+
+
+def dataset_summary():
+    return {
+        "snippets": Snippet.objects.count(),
+        "authors": Snippet.objects.values("author").distinct().count(),
+        "tags": Tag.objects.count(),
+        "ratings": RatedItem.objects.count(),
+        "bookmarks": Bookmark.objects.count(),
+        "comments": django_comments.get_model().objects.count(),
+    }
+
+
+def benchmark_cases():
+    """
+    Returns the hot paths as ``{name: callable}``. Pages are picked from the
+    busiest parts of the dataset, where they are slowest.
+    """
+    client = Client()
+    snippet = Snippet.objects.active_snippet().order_by("-rating_count", "pk").first()
+    author = (
+        Snippet.objects.values("author__username")
+        .annotate(count=Count("pk"))
+        .order_by("-count")
+        .first()
+    )
+    tag = Tag.objects.annotate(count=Count("taggit_taggeditem_items")).order_by("-count").first()
+    rater = RatedItem.objects.values("user").annotate(count=Count("pk")).order_by("-count").first()
+    word = snippet.title.split()[0] if snippet else "django"
+
+    def get(url):
+        return lambda: client.get(url).content
+
+    cases = {
+        f"snippet_list:{tab}": get(f"{reverse('cab_snippet_list')}?tab={tab}")
+        for tab in SnippetList.sorting_tabs
+    }
+    cases.update(
+        {
+            "search": get(f"{reverse('cab_search')}?q={word}"),
+            "autocomplete": get(f"{reverse('snippet_autocomplete')}?q={word}"),
+            "top_authors": get(reverse("cab_top_authors")),
+            "top_tags": get(reverse("cab_top_tags")),
+            "top_languages": get(reverse("cab_top_languages")),
+            "feed:latest": get(reverse("cab_feed_latest")),
+            "api:snippet_list": get(reverse("api_snippet_list")),
+            "calculate_similar_items": lambda: calculate_similar_items(RatedItem.objects.all()),
+        },
+    )
+    if snippet is not None:
+        cases["snippet_detail"] = get(reverse("cab_snippet_detail", args=[snippet.pk]))
+        cases["api:snippet_detail"] = get(reverse("api_snippet_detail", args=[snippet.pk]))
+    if author is not None:
+        cases["feed:author"] = get(reverse("cab_feed_author", args=[author["author__username"]]))
+    if tag is not None:
+        cases["feed:tag"] = get(reverse("cab_feed_tag", args=[tag.slug]))
+    if rater is not None:
+        user = User.objects.get(pk=rater["user"])
+        cases["recommended_for"] = lambda: Snippet.objects.recommended_for(user)
+    return cases
+
+
+def measure(func, repeat=5):
+    """
+    Runs ``func`` once on an empty cache and ``repeat`` times on a warm one.
+    Reports its latencies in milliseconds, the queries of the cold and of
+    the last warm run and the peak memory of a cold run in kilobytes.
+    """
+    cache.clear()
+    with CaptureQueriesContext(connection) as cold_queries:
+        start = time.perf_counter()
+        func()
+        cold = time.perf_counter() - start
+    # counted right away, the next request_started resets the captured queries
+    cold_count = len(cold_queries)
+
+    # measured separately, tracing slows everything down
+    cache.clear()
+    tracemalloc.start()
+    try:
+        func()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as warm_queries:
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        warm_count = len(warm_queries)
+    return {
+        "cold_ms": round(cold * 1000, 2),
+        "median_ms": round(statistics.median(timings) * 1000, 2),
+        "max_ms": round(max(timings) * 1000, 2),
+        "cold_queries": cold_count,
+        "queries": warm_count,
+        "peak_memory_kb": round(peak_memory / 1024),
+    }
+
+
+def run_benchmarks(cases, repeat=5, progress=None):
+    results = {}
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+        for name, func in cases.items():
+            results[name] = measure(func, repeat)
+            if progress is not None:
+                progress(name, results[name])
+    return results
+
+
+def compare_results(results, baseline, threshold=0.2):
+    """
+    Returns a description of every case whose median latency grew by more
+    than ``threshold`` or which runs more queries than in ``baseline``.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result["median_ms"] > before["median_ms"] * (1 + threshold):
+            regressions.append(
+                f"{name}: median {before['median_ms']} ms -> {result['median_ms']} ms",
+            )
+        if result["queries"] > before["queries"]:
+            regressions.append(f"{name}: {before['queries']} -> {result['queries']} queries")
+    return regressions
@@ -33,7 +33,7 @@ class LatestSnippetsFeed(Feed):
         return item.author.username
 
     def items(self):
-        return Snippet.objects.all()[:15]
+        return Snippet.objects.select_related("author")[:15]
 
     def item_link(self, item):
         return item.get_absolute_url()
@@ -59,7 +59,7 @@ class SnippetsByAuthorFeed(Feed):
         return get_object_or_404(User, username__exact=username)
 
     def items(self, obj):
-        return Snippet.objects.filter(author=obj)[:15]
+        return Snippet.objects.filter(author=obj).select_related("author")[:15]
 
     def link(self, obj):
         return f"/users/{obj.username}/"
@@ -93,7 +93,7 @@ class SnippetsByLanguageFeed(Feed):
         return get_object_or_404(Language, slug__exact=slug)
 
     def items(self, obj):
-        return Snippet.objects.filter(language=obj)[:15]
+        return Snippet.objects.filter(language=obj).select_related("author")[:15]
 
     def link(self, obj):
         return obj.get_absolute_url()
@@ -128,7 +128,7 @@ class SnippetsByTagFeed(Feed):
         return get_object_or_404(Tag, slug__exact=slug)
 
     def items(self, obj):
-        return Snippet.objects.matches_tag(obj)[:15]
+        return Snippet.objects.matches_tag(obj).select_related("author")[:15]
 
     def link(self, obj):
         return reverse("cab_snippet_matches_tag", args=[obj.slug])
@@ -1,5 +1,6 @@
 from django import forms
 from django.contrib import admin
+from django.contrib.postgres.search import SearchQuery
 
 from .models import VERSIONS, Language, Snippet, SnippetFlag
 
@@ -27,6 +28,7 @@ class SnippetForm(forms.ModelForm):
             "author",
             "bookmark_count",
             "rating_score",
+            "rating_count",
         )
 
 
@@ -51,7 +53,7 @@ class AdvancedSearchForm(forms.Form):
     def search(self, sqs):
         # First, store the SearchQuerySet received from other processing.
         if self.cleaned_data["q"]:
-            sqs = sqs.filter(search=self.cleaned_data["q"])
+            sqs = sqs.filter(search_vector=SearchQuery(self.cleaned_data["q"]))
 
         if self.cleaned_data["language"]:
             sqs = sqs.filter(language__name=self.cleaned_data["language"].name)
@@ -0,0 +1,310 @@
+import datetime
+import itertools
+import json
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag, TaggedItem
+
+from .models import (
+    AuthorLeaderboard,
+    Language,
+    LanguageLeaderboard,
+    Snippet,
+    TagLeaderboard,
+    snippet_search_vector,
+)
+from .utils import render_snippet
+
+# what separates the records of NDJSON input and the entries of a JSON array
+RECORD_SEPARATORS = " \t\r\n,[]"
+
+SNIPPET_FIELDS = ["title", "description", "code", "version", "rating_score", "bookmark_count"]
+
+SYNTHETIC_WORDS = [
+    "admin",
+    "auth",
+    "cache",
+    "context",
+    "decorator",
+    "field",
+    "filter",
+    "form",
+    "json",
+    "list",
+    "manager",
+    "middleware",
+    "model",
+    "paginator",
+    "query",
+    "request",
+    "response",
+    "serializer",
+    "session",
+    "signal",
+    "slug",
+    "tag",
+    "template",
+    "test",
+    "url",
+    "user",
+    "validator",
+    "view",
+    "widget",
+]
+
+
+def read_records(stream, chunk_size=64 * 1024):
+    """
+    Yields the records of NDJSON input, or the entries of a JSON array like
+    a fixture, without reading all of the input into memory first.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    while True:
+        buffer = buffer.lstrip(RECORD_SEPARATORS)
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                if buffer:
+                    raise
+                return
+            buffer += chunk
+            continue
+        yield record
+        buffer = buffer[end:]
+
+
+def synthetic_records(count, seed=None, authors=100, tags=200):
+    """
+    Yields ``count`` made up snippet records for load testing, by a pool of
+    ``authors`` users and in the existing languages. Tags are picked from a
+    pool of ``tags`` names, a few of which are a lot more popular than the
+    rest like on the real site.
+    """
+    rng = random.Random(seed)
+    languages = list(Language.objects.values_list("slug", flat=True))
+    if not languages:
+        msg = "Synthetic snippets need at least one language, e.g. from fixtures/cab.json."
+        raise ValueError(msg)
+    usernames = [f"loadtest{i}" for i in range(authors)]
+    tag_names = [f"{rng.choice(SYNTHETIC_WORDS)}-{i}" for i in range(tags)]
+    tag_weights = [1 / (rank + 1) for rank in range(tags)]
+    now = timezone.now()
+
+    for _ in range(count):
+        words = rng.choices(SYNTHETIC_WORDS, k=rng.randint(2, 8))
+        pub_date = now - datetime.timedelta(seconds=rng.randrange(10 * 365 * 24 * 60 * 60))
+        code = "\n".join(
+            f"def {rng.choice(SYNTHETIC_WORDS)}_{i}({name}):\n"
+            f"    return {name}.{rng.choice(SYNTHETIC_WORDS)}()\n"
+            for i, name in enumerate(rng.choices(SYNTHETIC_WORDS, k=rng.randint(1, 20)))
+        )
+        yield {
+            "title": " ".join(words).capitalize(),
+            "author": rng.choice(usernames),
+            "language": rng.choice(languages),
+            "tags": sorted(set(rng.choices(tag_names, tag_weights, k=rng.randint(0, 5)))),
+            "description": "\n\n".join(
+                " ".join(rng.choices(SYNTHETIC_WORDS, k=rng.randint(5, 40))).capitalize() + "."
+                for _ in range(rng.randint(1, 3))
+            ),
+            "code": code,
+            "pub_date": pub_date,
+            "updated_date": pub_date + datetime.timedelta(days=rng.randint(0, 30)),
+            "rating_score": rng.randint(-5, 20),
+            "bookmark_count": rng.randint(0, 10),
+        }
+
+
+def render_row(row):
+    # a module level function, so it can be sent to worker processes
+    return render_snippet(*row)
+
+
+def parse_record_date(value):
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+class SnippetImporter:
+    """
+    Creates snippets from records in bulk, a batch at a time: the snippets,
+    new tags and the tags' through rows go in with a bulk insert each and the
+    HTML is rendered beforehand, optionally by the processes of
+    ``executor``. Signals aren't sent, so the leaderboards are rebuilt by
+    ``finish()``.
+
+    Records are either entries of a fixture like fixtures/cab.json, whose
+    languages are created on the way, or records of export_snippets. Their
+    author is a user id or a username, for which missing users are
+    created, and their language a language id or slug.
+    """
+
+    def __init__(self, batch_size=1000, executor=None):
+        self.batch_size = batch_size
+        self.executor = executor
+        self.content_type = ContentType.objects.get_for_model(Snippet)
+        self.languages = {}
+        for language in Language.objects.all():
+            self.add_language(language)
+        self.authors = {}
+        self.tags = {}
+        self.imported = 0
+        self.explicit_ids = False
+
+    def add_language(self, language):
+        self.languages[language.pk] = self.languages[language.slug] = language
+
+    def snippet_record(self, record):
+        """
+        Returns the snippet fields of a record, or None for fixture entries
+        of other models.
+        """
+        if "model" not in record:
+            return record
+        if record["model"] == "cab.language":
+            language, _ = Language.objects.update_or_create(
+                pk=record["pk"],
+                defaults=record["fields"],
+            )
+            self.add_language(language)
+            return None
+        if record["model"] == "cab.snippet":
+            return dict(record["fields"], id=record.get("pk"))
+        return None
+
+    def import_records(self, records, progress=None):
+        snippet_records = filter(None, map(self.snippet_record, records))
+        for batch in itertools.batched(snippet_records, self.batch_size):
+            self.import_batch(batch)
+            if progress is not None:
+                progress(self.imported)
+        return self.imported
+
+    def get_language(self, value):
+        try:
+            return self.languages[value]
+        except KeyError:
+            msg = f"Unknown language {value!r}."
+            raise ValueError(msg) from None
+
+    def get_author_ids(self, records):
+        usernames = {r["author"] for r in records if isinstance(r["author"], str)}
+        missing = usernames - self.authors.keys()
+        if missing:
+            self.authors.update(
+                User.objects.filter(username__in=missing).values_list("username", "pk"),
+            )
+            missing -= self.authors.keys()
+        if missing:
+            users = User.objects.bulk_create(
+                [User(username=username, password=make_password(None)) for username in missing],
+            )
+            self.authors.update((user.username, user.pk) for user in users)
+        return [self.authors.get(r["author"], r["author"]) for r in records]
+
+    def get_tag_ids(self, names):
+        missing = set(names) - self.tags.keys()
+        if missing:
+            self.tags.update(Tag.objects.filter(name__in=missing).values_list("name", "pk"))
+            missing -= self.tags.keys()
+        if missing:
+            Tag.objects.bulk_create(
+                [Tag(name=name, slug=Tag().slugify(name)) for name in missing],
+                ignore_conflicts=True,
+            )
+            self.tags.update(Tag.objects.filter(name__in=missing).values_list("name", "pk"))
+            # the rest clashed with the slug of another tag, which Tag.save()
+            # works around
+            for name in missing - self.tags.keys():
+                self.tags[name] = Tag.objects.create(name=name).pk
+        return [self.tags[name] for name in names]
+
+    def import_batch(self, records):
+        languages = [self.get_language(r["language"]) for r in records]
+        rows = [
+            (r["description"], r["code"], language.language_code)
+            for r, language in zip(records, languages, strict=True)
+        ]
+        if self.executor is None:
+            rendered = map(render_row, rows)
+        else:
+            rendered = self.executor.map(render_row, rows, chunksize=max(1, len(rows) // 32))
+
+        now = timezone.now()
+        snippets = []
+        dates = []
+        for record, language, author_id, (description_html, highlighted_code) in zip(
+            records,
+            languages,
+            self.get_author_ids(records),
+            rendered,
+            strict=True,
+        ):
+            fields = {name: record[name] for name in SNIPPET_FIELDS if name in record}
+            snippets.append(
+                Snippet(
+                    id=record.get("id"),
+                    language=language,
+                    author_id=author_id,
+                    description_html=description_html,
+                    highlighted_code=highlighted_code,
+                    **fields,
+                ),
+            )
+            pub_date = parse_record_date(record.get("pub_date")) or now
+            dates.append((pub_date, parse_record_date(record.get("updated_date")) or pub_date))
+            self.explicit_ids = self.explicit_ids or record.get("id") is not None
+
+        with transaction.atomic():
+            snippets = Snippet.objects.bulk_create(snippets)
+            # bulk_create() stamps the dates with the current time
+            for snippet, (pub_date, updated_date) in zip(snippets, dates, strict=True):
+                snippet.pub_date = pub_date
+                snippet.updated_date = updated_date
+            Snippet.objects.bulk_update(snippets, ["pub_date", "updated_date"])
+            snippet_ids = [snippet.pk for snippet in snippets]
+            Snippet.objects.filter(pk__in=snippet_ids).update(
+                search_vector=snippet_search_vector(),
+            )
+            tags = [self.tags_of(record) for record in records]
+            tag_ids = iter(self.get_tag_ids([name for names in tags for name in names]))
+            TaggedItem.objects.bulk_create(
+                [
+                    TaggedItem(content_type=self.content_type, object_id=pk, tag_id=next(tag_ids))
+                    for pk, names in zip(snippet_ids, tags, strict=True)
+                    for _ in names
+                ],
+                ignore_conflicts=True,
+            )
+        self.imported += len(snippets)
+
+    def tags_of(self, record):
+        tags = record.get("tags") or []
+        if isinstance(tags, str):
+            tags = tags.split(",")
+        return list(dict.fromkeys(name.strip() for name in tags if name.strip()))
+
+    def finish(self):
+        """
+        Moves the id sequence past imported ids and rebuilds the leaderboards.
+        """
+        if self.explicit_ids:
+            connection = connections[Snippet.objects.db]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Snippet]):
+                    cursor.execute(sql)
+        for model in (AuthorLeaderboard, LanguageLeaderboard, TagLeaderboard):
+            model.objects.refresh()
@@ -0,0 +1,61 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from uuid import uuid4
+
+from django.core.cache import cache as django_cache
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+JOB_CACHE_PREFIX = "cab:job"
+# How long the state of a job is kept around for its progress page.
+JOB_TIMEOUT = 60 * 60 * 24
+
+
+@cache
+def get_executor():
+    # one at a time, moderation jobs are heavy on the database
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="cab-jobs")
+
+
+def job_cache_key(job_id):
+    return f"{JOB_CACHE_PREFIX}:{job_id}"
+
+
+def get_job(job_id):
+    return django_cache.get(job_cache_key(job_id))
+
+
+def _update_job(job_id, **state):
+    job = get_job(job_id) or {}
+    job.update(state)
+    django_cache.set(job_cache_key(job_id), job, JOB_TIMEOUT)
+
+
+def _run_job(job_id, func, args):
+    def progress(done, total):
+        _update_job(job_id, done=done, total=total)
+
+    try:
+        func(*args, progress=progress)
+    except Exception:
+        logger.exception("Job %s failed", job_id)
+        _update_job(job_id, finished=True, failed=True)
+    else:
+        _update_job(job_id, finished=True)
+    finally:
+        connections.close_all()
+
+
+def start_job(description, func, *args, total=None):
+    """
+    Runs ``func(*args, progress=...)`` in a background thread once the
+    current transaction is committed, and returns an id to look up its
+    progress with ``get_job()``. ``func`` reports its progress by calling
+    ``progress(done, total)``.
+    """
+    job_id = uuid4().hex
+    _update_job(job_id, description=description, done=0, total=total, finished=False, failed=False)
+    transaction.on_commit(lambda: get_executor().submit(_run_job, job_id, func, args))
+    return job_id
@@ -1,11 +1,186 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import django_comments
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
 from django.db.models import signals
+from taggit.models import TaggedItem
 
 from ratings.models import RatedItem
+from ratings.recommendations import mark_rating_matrix_stale
+from ratings.signals import rating_changed
+
+from .utils import bump_snippet_cache_version
+
+# snippet fields the author and language leaderboards are counted by
+LEADERBOARD_FIELDS = frozenset(["author", "author_id", "language", "language_id"])
+# snippet fields related snippets are scored by
+RELATED_FIELDS = frozenset(["title", "description", "language", "language_id"])
+
+
+def _rated_manager(instance):
+    model_class = ContentType.objects.get_for_id(instance.content_type_id).model_class()
+    manager = getattr(model_class, "_default_manager", None)
+    if hasattr(manager, "change_rating"):
+        return manager
+    return None
+
+
+def update_rating_score(sender, instance, created=False, *args, **kwargs):
+    manager = _rated_manager(instance)
+    if manager is None:
+        return
+
+    if created:
+        manager.change_rating(instance.object_id, instance.score, 1)
+        return
+
+    score_change = instance.get_score_change()
+    if score_change is None:
+        # we can't tell what the score was before, so count from scratch
+        if instance.content_object:
+            instance.content_object.update_rating()
+    elif score_change:
+        manager.change_rating(instance.object_id, score_change)
+
+
+def remove_rating_score(sender, instance, *args, **kwargs):
+    manager = _rated_manager(instance)
+    if manager is not None:
+        manager.change_rating(instance.object_id, -instance.score, -1)
+
+
+def apply_rating_change(sender, rating, score_delta, count_delta, *args, **kwargs):
+    manager = _rated_manager(rating)
+    if manager is not None and (score_delta or count_delta):
+        manager.change_rating(rating.object_id, score_delta, count_delta)
+    bump_snippet_cache(sender, rating)
+
+
+def mark_rating_matrix(sender, instance=None, rating=None, *args, using=None, **kwargs):
+    mark_rating_matrix_stale((rating or instance).content_type_id, using=using)
+
+
+_deferred = threading.local()
+
+
+def _refresh_leaderboard(model_name, *keys):
+    keys = {key for key in keys if key is not None}
+    pending = getattr(_deferred, "pending", None)
+    if pending is not None:
+        pending[model_name].update(keys)
+    elif keys:
+        apps.get_model("cab", model_name).objects.refresh(keys)
+
+
+@contextmanager
+def deferred_leaderboards():
+    """
+    Collects the leaderboard refreshes of a bulk change and runs them once
+    per key when it is done, rather than once per changed row.
+    """
+    if getattr(_deferred, "pending", None) is not None:
+        yield
+        return
+    _deferred.pending = pending = defaultdict(set)
+    try:
+        yield
+    finally:
+        del _deferred.pending
+        for model_name, keys in pending.items():
+            _refresh_leaderboard(model_name, *keys)
+
+
+def update_snippet_leaderboards(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is not None and not LEADERBOARD_FIELDS & set(update_fields):
+        return
+    # still the values from before this save, see Snippet.save()
+    loaded_values = {} if created else getattr(instance, "_loaded_values", None) or {}
+    old_author_id = loaded_values.get("author_id")
+    if old_author_id != instance.author_id:
+        _refresh_leaderboard("AuthorLeaderboard", old_author_id, instance.author_id)
+    old_language_id = loaded_values.get("language_id")
+    if old_language_id != instance.language_id:
+        _refresh_leaderboard("LanguageLeaderboard", old_language_id, instance.language_id)
+
+
+def remove_snippet_leaderboards(sender, instance, *args, **kwargs):
+    _refresh_leaderboard("AuthorLeaderboard", instance.author_id)
+    _refresh_leaderboard("LanguageLeaderboard", instance.language_id)
+
+
+def update_tag_leaderboard(sender, instance, created=True, *args, **kwargs):
+    if not created:
+        return
+    model_class = ContentType.objects.get_for_id(instance.content_type_id).model_class()
+    if model_class is apps.get_model("cab", "Snippet"):
+        _refresh_leaderboard("TagLeaderboard", instance.tag_id)
+
+
+def _refresh_related(snippet):
+    pending = getattr(_deferred, "related", None)
+    if pending is not None:
+        pending[snippet.pk] = snippet
+    else:
+        apps.get_model("cab", "RelatedSnippet").objects.refresh(snippet)
+
+
+@contextmanager
+def deferred_related_snippets():
+    """
+    Collects the related snippet refreshes of a change that saves a snippet
+    and then its tags, and runs them once per snippet when it is done rather
+    than once per signal.
+    """
+    if getattr(_deferred, "related", None) is not None:
+        yield
+        return
+    _deferred.related = pending = {}
+    try:
+        yield
+    finally:
+        del _deferred.related
+        for snippet in pending.values():
+            _refresh_related(snippet)
+
+
+def update_related_snippets(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is not None and not RELATED_FIELDS & set(update_fields):
+        return
+    loaded_values = getattr(instance, "_loaded_values", None) or {}
+    changed = any(
+        loaded_values.get(name) != getattr(instance, name)
+        for name in ("title", "description", "language_id")
+    )
+    if created or changed:
+        _refresh_related(instance)
+
+
+def update_tagged_related_snippets(sender, instance, action, *args, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear") and isinstance(
+        instance,
+        apps.get_model("cab", "Snippet"),
+    ):
+        _refresh_related(instance)
+
+
+def update_spam_status(sender, instance, *args, **kwargs):
+    apps.get_model("cab", "Snippet").objects.update_spam_status([instance.snippet_id])
 
 
-def update_rating_score(sender, instance, *args, **kwargs):
-    if instance.content_object and hasattr(instance.content_object, "update_rating"):
-        instance.content_object.update_rating()
+def _snippet_content_type_id():
+    return ContentType.objects.get_for_model(apps.get_model("cab", "Snippet")).pk
+
+
+def bump_snippet_cache(sender, instance, *args, using=None, **kwargs):
+    if isinstance(instance, apps.get_model("cab", "Snippet")):
+        bump_snippet_cache_version(instance.pk, using=using)
+    elif instance.content_type_id == _snippet_content_type_id():
+        # ratings, tags and comments point at their snippet generically
+        object_id = getattr(instance, "object_id", None) or getattr(instance, "object_pk", None)
+        bump_snippet_cache_version(object_id, using=using)
 
 
 def start_listening():
@@ -15,7 +190,78 @@ def start_listening():
         dispatch_uid="cab.snippets.save_rating_score",
     )
     signals.post_delete.connect(
-        update_rating_score,
+        remove_rating_score,
         sender=RatedItem,
         dispatch_uid="cab.snippets.delete_rating_score",
     )
+    rating_changed.connect(
+        apply_rating_change,
+        sender=RatedItem,
+        dispatch_uid="cab.snippets.change_rating_score",
+    )
+    signals.post_save.connect(
+        mark_rating_matrix,
+        sender=RatedItem,
+        dispatch_uid="cab.snippets.save_rating_matrix",
+    )
+    signals.post_delete.connect(
+        mark_rating_matrix,
+        sender=RatedItem,
+        dispatch_uid="cab.snippets.delete_rating_matrix",
+    )
+    rating_changed.connect(
+        mark_rating_matrix,
+        sender=RatedItem,
+        dispatch_uid="cab.snippets.change_rating_matrix",
+    )
+    signals.post_save.connect(
+        update_snippet_leaderboards,
+        sender="cab.Snippet",
+        dispatch_uid="cab.snippets.save_leaderboards",
+    )
+    signals.post_delete.connect(
+        remove_snippet_leaderboards,
+        sender="cab.Snippet",
+        dispatch_uid="cab.snippets.delete_leaderboards",
+    )
+    signals.post_save.connect(
+        update_tag_leaderboard,
+        sender=TaggedItem,
+        dispatch_uid="cab.snippets.save_tag_leaderboard",
+    )
+    signals.post_delete.connect(
+        update_tag_leaderboard,
+        sender=TaggedItem,
+        dispatch_uid="cab.snippets.delete_tag_leaderboard",
+    )
+    signals.post_save.connect(
+        update_related_snippets,
+        sender="cab.Snippet",
+        dispatch_uid="cab.snippets.save_related_snippets",
+    )
+    signals.m2m_changed.connect(
+        update_tagged_related_snippets,
+        sender=TaggedItem,
+        dispatch_uid="cab.snippets.tag_related_snippets",
+    )
+    signals.post_save.connect(
+        update_spam_status,
+        sender="cab.SnippetFlag",
+        dispatch_uid="cab.snippets.save_spam_status",
+    )
+    signals.post_delete.connect(
+        update_spam_status,
+        sender="cab.SnippetFlag",
+        dispatch_uid="cab.snippets.delete_spam_status",
+    )
+    for sender in ("cab.Snippet", RatedItem, TaggedItem, django_comments.get_model()):
+        signals.post_save.connect(
+            bump_snippet_cache,
+            sender=sender,
+            dispatch_uid="cab.snippets.save_cache_version",
+        )
+        signals.post_delete.connect(
+            bump_snippet_cache,
+            sender=sender,
+            dispatch_uid="cab.snippets.delete_cache_version",
+        )
@@ -1,10 +1,28 @@
 from base.main import ObjectList
+from base.pagination import KeysetPagination
 
 
 class SnippetList(ObjectList):
+    pagination_class = KeysetPagination
+    list_select_related = ("author", "language")
+    list_prefetch_related = ("tags",)
     sorting_tabs = {
         "newest": ("-pub_date",),
         "latest_updated": ("-updated_date",),
         "highest_rated": ("-rating_score",),
         "most_bookmarked": ("-bookmark_count",),
     }
+
+    def get_objects(self, request, queryset):
+        # cab.models imports this module through cab.utils
+        from cab.models import load_viewer_state
+
+        objects = super().get_objects(request, queryset)
+        # The state is kept on request.user rather than the request, since the
+        # is_bookmarked, rating_score and has_flagged filters are only given
+        # the user. It's the same object for the whole request and lives as
+        # long as it does.
+        user = getattr(request, "user", None)
+        if user is not None:
+            load_viewer_state(user, objects)
+        return objects
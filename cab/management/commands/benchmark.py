@@ -0,0 +1,159 @@
+import json
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from cab.benchmark import (
+    benchmark_cases,
+    compare_results,
+    dataset_summary,
+    run_benchmarks,
+    seed_dataset,
+)
+from cab.models import Snippet
+
+
+def current_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with synthetic data and measure the latency, "
+        "query count and peak memory of the hot views."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--snippets",
+            type=int,
+            default=10000,
+            help="Number of snippets to seed, everything else scales along (default: 10000).",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed of the synthetic data (default: 0).",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of warm runs per case (default: 5).",
+        )
+        parser.add_argument(
+            "--case",
+            action="append",
+            dest="cases",
+            metavar="PREFIX",
+            help="Only run the cases starting with this. Can be given multiple times.",
+        )
+        parser.add_argument(
+            "--output",
+            "-o",
+            help="File to store the results in (default: benchmark-<date>.json).",
+        )
+        parser.add_argument(
+            "--compare",
+            metavar="FILE",
+            help="Results of an earlier run to flag regressions against.",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Median latency growth counted as a regression (default: 0.2 for 20%%).",
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Keep the test database and its data for the next run.",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=None,
+            help="Number of processes rendering the seeded snippets (default: one per CPU).",
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            baseline = json.loads(Path(options["compare"]).read_text())["results"]
+
+        verbosity = options["verbosity"]
+        old_name = connection.creation.create_test_db(
+            verbosity=verbosity,
+            autoclobber=True,
+            serialize=False,
+            keepdb=options["keepdb"],
+        )
+        try:
+            report = self.benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity, keepdb=options["keepdb"])
+
+        output = Path(
+            options["output"] or f"benchmark-{timezone.now():%Y%m%d-%H%M%S}.json",
+        )
+        output.write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Stored the results in {output}."))
+
+        if baseline is not None:
+            regressions = compare_results(report["results"], baseline, options["threshold"])
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            if regressions:
+                msg = f"{len(regressions)} regressions against {options['compare']}."
+                raise CommandError(msg)
+
+    def benchmark(self, options):
+        if Snippet.objects.count() < options["snippets"]:
+            self.stdout.write(f"Seeding {options['snippets']} snippets...")
+            executor = None
+            if options["processes"] != 1:
+                executor = ProcessPoolExecutor(options["processes"])
+            try:
+                dataset = seed_dataset(options["snippets"], options["seed"], executor=executor)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+        else:
+            dataset = dataset_summary()
+        self.stdout.write(", ".join(f"{count} {kind}" for kind, count in dataset.items()))
+
+        cases = benchmark_cases()
+        if options["cases"]:
+            cases = {
+                name: func
+                for name, func in cases.items()
+                if name.startswith(tuple(options["cases"]))
+            }
+
+        def progress(name, result):
+            self.stdout.write(
+                f"{name:<28} {result['median_ms']:>9.2f} ms {result['cold_ms']:>9.2f} ms cold "
+                f"{result['queries']:>4} queries {result['peak_memory_kb']:>8} KB",
+            )
+
+        return {
+            "date": timezone.now().isoformat(),
+            "commit": current_commit(),
+            "dataset": dataset,
+            "repeat": options["repeat"],
+            "results": run_benchmarks(cases, options["repeat"], progress),
+        }
@@ -0,0 +1,48 @@
+import sys
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cab.export import EXPORT_FORMATS, exported_snippets, parse_since
+
+
+class Command(BaseCommand):
+    help = "Export the active snippets as NDJSON or as a tarball of their code."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            choices=sorted(EXPORT_FORMATS),
+            default="ndjson",
+            help="Export format (default: ndjson).",
+        )
+        parser.add_argument(
+            "--since",
+            help="Only export snippets updated after this date or date and time.",
+        )
+        parser.add_argument(
+            "--output",
+            "-o",
+            default="-",
+            help="File to write the export to (default: standard output).",
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            try:
+                since = parse_since(options["since"])
+            except ValueError as e:
+                raise CommandError(e) from e
+        export = EXPORT_FORMATS[options["format"]][0]
+        chunks = export(exported_snippets(since))
+        if options["output"] == "-":
+            self.write_chunks(chunks, sys.stdout.buffer)
+        else:
+            with Path(options["output"]).open("wb") as output:
+                self.write_chunks(chunks, output)
+
+    def write_chunks(self, chunks, output):
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
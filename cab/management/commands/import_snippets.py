@@ -0,0 +1,82 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cab.importer import SnippetImporter, read_records, synthetic_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import snippets from a fixture like fixtures/cab.json or the NDJSON of "
+        "export_snippets, or generate synthetic snippets for load testing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "input",
+            nargs="?",
+            help="JSON or NDJSON file to import, or - for standard input.",
+        )
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            metavar="COUNT",
+            help="Generate this many synthetic snippets instead of reading input.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=None,
+            help="Seed of the synthetic snippets, to generate the same ones again.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of snippets inserted per batch (default: 1000).",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=None,
+            help="Number of rendering processes (default: one per CPU).",
+        )
+
+    def handle(self, *args, **options):
+        if (options["input"] is None) == (options["synthetic"] is None):
+            msg = "Give either a file to import or --synthetic."
+            raise CommandError(msg)
+
+        executor = None
+        if options["processes"] != 1:
+            executor = ProcessPoolExecutor(options["processes"])
+        try:
+            importer = SnippetImporter(options["batch_size"], executor)
+            if options["synthetic"] is not None:
+                self.run(importer, synthetic_records(options["synthetic"], options["seed"]))
+            elif options["input"] == "-":
+                self.run(importer, read_records(sys.stdin))
+            else:
+                with Path(options["input"]).open(encoding="utf-8") as stream:
+                    self.run(importer, read_records(stream))
+        except ValueError as e:
+            raise CommandError(e) from e
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {importer.imported} snippets. Run update_related_snippets to "
+                f"relate them to each other.",
+            ),
+        )
+
+    def run(self, importer, records):
+        importer.import_records(
+            records,
+            progress=lambda imported: self.stdout.write(f"Imported {imported} snippets"),
+        )
+        importer.finish()
@@ -0,0 +1,133 @@
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from cab.models import Snippet
+from cab.utils import bump_snippet_cache_version, render_snippet
+
+
+def render(row):
+    """
+    Renders one ``(pk, description, code, language_code)`` row in a worker
+    process.
+    """
+    pk, description, code, language_code = row
+    return pk, *render_snippet(description, code, language_code)
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-render the stored description HTML and highlighted code of snippets, e.g. "
+        "after upgrading Pygments or changing the Markdown sanitizer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--language",
+            action="append",
+            dest="languages",
+            metavar="SLUG",
+            help="Only re-render snippets in this language. Can be given multiple times.",
+        )
+        parser.add_argument(
+            "--since",
+            type=datetime.date.fromisoformat,
+            help="Only re-render snippets published on or after this date (YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--until",
+            type=datetime.date.fromisoformat,
+            help="Only re-render snippets published before this date (YYYY-MM-DD).",
+        )
+        parser.add_argument(
+            "--start-after",
+            type=int,
+            default=0,
+            metavar="ID",
+            help="Resume after the snippet with this id, as reported by a previous run.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of snippets read and written per batch (default: 500).",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=None,
+            help="Number of rendering processes (default: one per CPU).",
+        )
+
+    def get_queryset(self, options):
+        queryset = Snippet.objects.order_by("pk")
+        if options["languages"]:
+            queryset = queryset.filter(language__slug__in=options["languages"])
+        if options["since"]:
+            queryset = queryset.filter(pub_date__date__gte=options["since"])
+        if options["until"]:
+            queryset = queryset.filter(pub_date__date__lt=options["until"])
+        return queryset
+
+    def rerender(self, batch, executor):
+        """
+        Renders a batch of rows and writes back the snippets whose output
+        changed, whose cached fragments then go stale. Returns how many were
+        written.
+        """
+        # each row is the (pk, description, code, language_code) to render
+        # followed by the (description_html, highlighted_code) stored now
+        current = {row[0]: row[4:] for row in batch}
+        sources = [row[:4] for row in batch]
+        if executor is None:
+            rendered = map(render, sources)
+        else:
+            rendered = executor.map(render, sources, chunksize=max(1, len(sources) // 32))
+        snippets = [
+            Snippet(pk=pk, description_html=html, highlighted_code=code)
+            for pk, html, code in rendered
+            if current[pk] != (html, code)
+        ]
+        Snippet.objects.bulk_update(snippets, ["description_html", "highlighted_code"])
+        for snippet in snippets:
+            bump_snippet_cache_version(snippet.pk)
+        return len(snippets)
+
+    def handle(self, *args, **options):
+        queryset = self.get_queryset(options)
+        rows = queryset.values_list(
+            "pk",
+            "description",
+            "code",
+            "language__language_code",
+            "description_html",
+            "highlighted_code",
+        )
+        last_pk = options["start_after"]
+        total = queryset.filter(pk__gt=last_pk).count()
+        processed = changed = 0
+
+        executor = None
+        if options["processes"] != 1:
+            executor = ProcessPoolExecutor(options["processes"])
+        try:
+            while True:
+                # batches are read by id rather than through one long-lived
+                # cursor so every batch commits and a run can be resumed
+                batch = list(rows.filter(pk__gt=last_pk)[: options["batch_size"]])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+                changed += self.rerender(batch, executor)
+                processed += len(batch)
+                self.stdout.write(
+                    f"Rendered {processed}/{total} snippets, {changed} changed (last id {last_pk})",
+                )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Re-rendered {processed} snippets, {changed} changed."),
+        )
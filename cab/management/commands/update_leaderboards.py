@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from cab.models import AuthorLeaderboard, LanguageLeaderboard, TagLeaderboard
+
+
+class Command(BaseCommand):
+    help = "Rebuild the author, language and tag leaderboards from scratch."
+
+    def handle(self, *args, **options):
+        for model in (AuthorLeaderboard, LanguageLeaderboard, TagLeaderboard):
+            model.objects.refresh()
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Rebuilt {model._meta.verbose_name} ({model.objects.count()})")
+        self.stdout.write(self.style.SUCCESS("Rebuilt the leaderboards."))
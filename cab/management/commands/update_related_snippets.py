@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from cab.models import RelatedSnippet, Snippet
+
+
+class Command(BaseCommand):
+    help = "Recompute the related snippets of every snippet, e.g. after update_similar_items."
+
+    def handle(self, *args, **options):
+        snippets = Snippet.objects.only("title", "description", "language_id").order_by("pk")
+        refreshed = 0
+        for snippet in snippets.iterator():
+            RelatedSnippet.objects.refresh(snippet)
+            refreshed += 1
+            if options["verbosity"] > 1 and not refreshed % 100:
+                self.stdout.write(f"Refreshed {refreshed} snippets (last id {snippet.pk})")
+        self.stdout.write(
+            self.style.SUCCESS(f"Refreshed the related snippets of {refreshed} snippets."),
+        )
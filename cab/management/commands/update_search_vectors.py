@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from cab.models import Snippet, snippet_search_vector
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored full-text search vector of every snippet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of snippets updated per statement (default: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        pks = Snippet.objects.order_by("pk").values_list("pk", flat=True)
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(pks.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            updated += Snippet.objects.filter(pk__range=(batch[0], last_pk)).update(
+                search_vector=snippet_search_vector(),
+            )
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Updated {updated} snippets (last id {last_pk})")
+        self.stdout.write(self.style.SUCCESS(f"Updated search vectors of {updated} snippets."))
@@ -0,0 +1,24 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("cab", "0006_alter_snippet_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snippet",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="snippet",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"],
+                name="cab_snippet_search_vector",
+            ),
+        ),
+    ]
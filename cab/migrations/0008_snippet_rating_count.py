@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_rating_count(apps, schema_editor):
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    RatedItem = apps.get_model("ratings", "RatedItem")
+    Snippet = apps.get_model("cab", "Snippet")
+
+    ctype = ContentType.objects.filter(app_label="cab", model="snippet").first()
+    if ctype is None:
+        return
+    counts = (
+        RatedItem.objects.filter(content_type=ctype, object_id=OuterRef("pk"))
+        .order_by()
+        .values("object_id")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    Snippet.objects.update(rating_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("ratings", "0003_similarity_fingerprint"),
+        ("cab", "0007_snippet_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snippet",
+            name="rating_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_rating_count, migrations.RunPython.noop),
+    ]
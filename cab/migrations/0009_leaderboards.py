@@ -0,0 +1,95 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_leaderboards(apps, schema_editor):
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    TaggedItem = apps.get_model("taggit", "TaggedItem")
+    Snippet = apps.get_model("cab", "Snippet")
+
+    def populate(model_name, key_name, items, group_field):
+        model = apps.get_model("cab", model_name)
+        counts = items.order_by().values_list(group_field).annotate(score=Count("pk"))
+        model.objects.bulk_create(
+            [model(**{key_name: key, "score": score}) for key, score in counts],
+            batch_size=1000,
+        )
+
+    populate("AuthorLeaderboard", "user_id", Snippet.objects.all(), "author_id")
+    populate("LanguageLeaderboard", "language_id", Snippet.objects.all(), "language_id")
+    ctype = ContentType.objects.filter(app_label="cab", model="snippet").first()
+    if ctype is not None:
+        tagged_snippets = TaggedItem.objects.filter(content_type=ctype)
+        populate("TagLeaderboard", "tag_id", tagged_snippets, "tag_id")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("taggit", "0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("cab", "0008_snippet_rating_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuthorLeaderboard",
+            fields=[
+                ("score", models.IntegerField(db_index=True)),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="snippet_leaderboard",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="LanguageLeaderboard",
+            fields=[
+                ("score", models.IntegerField(db_index=True)),
+                (
+                    "language",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="snippet_leaderboard",
+                        serialize=False,
+                        to="cab.language",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="TagLeaderboard",
+            fields=[
+                ("score", models.IntegerField(db_index=True)),
+                (
+                    "tag",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="snippet_leaderboard",
+                        serialize=False,
+                        to="taggit.tag",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.RunPython(populate_leaderboards, migrations.RunPython.noop),
+    ]
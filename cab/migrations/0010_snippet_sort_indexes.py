@@ -0,0 +1,98 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # build the indexes without blocking writes to the snippet table
+    atomic = False
+
+    dependencies = [
+        ("cab", "0009_leaderboards"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["-pub_date", "-id"],
+                name="cab_snippet_newest",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["-updated_date", "-pub_date", "-id"],
+                name="cab_snippet_updated",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["-rating_score", "-pub_date", "-id"],
+                name="cab_snippet_rated",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["-bookmark_count", "-pub_date", "-id"],
+                name="cab_snippet_bookmarked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["language", "-pub_date", "-id"],
+                name="cab_snippet_lang_newest",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["language", "-updated_date", "-pub_date", "-id"],
+                name="cab_snippet_lang_updated",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["language", "-rating_score", "-pub_date", "-id"],
+                name="cab_snippet_lang_rated",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["language", "-bookmark_count", "-pub_date", "-id"],
+                name="cab_snippet_lang_bookmarked",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["author", "-pub_date", "-id"],
+                name="cab_snippet_author_newest",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["author", "-updated_date", "-pub_date", "-id"],
+                name="cab_snippet_author_updated",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["author", "-rating_score", "-pub_date", "-id"],
+                name="cab_snippet_author_rated",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                fields=["author", "-bookmark_count", "-pub_date", "-id"],
+                name="cab_snippet_author_bookmarked",
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+# SnippetFlag.FLAG_SPAM
+FLAG_SPAM = 1
+
+
+def populate_is_spam(apps, schema_editor):
+    Snippet = apps.get_model("cab", "Snippet")
+    SnippetFlag = apps.get_model("cab", "SnippetFlag")
+
+    spam_flags = SnippetFlag.objects.filter(snippet=OuterRef("pk"), flag=FLAG_SPAM)
+    Snippet.objects.filter(Exists(spam_flags)).update(is_spam=True)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("cab", "0010_snippet_sort_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snippet",
+            name="is_spam",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(populate_is_spam, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # build the indexes without blocking writes to the snippet table
+    atomic = False
+
+    dependencies = [
+        ("cab", "0011_snippet_is_spam"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                condition=models.Q(("is_spam", False)),
+                fields=["-pub_date", "-id"],
+                name="cab_snippet_active_newest",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                condition=models.Q(("is_spam", False)),
+                fields=["-updated_date", "-pub_date", "-id"],
+                name="cab_snippet_active_updated",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                condition=models.Q(("is_spam", False)),
+                fields=["-rating_score", "-pub_date", "-id"],
+                name="cab_snippet_active_rated",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=models.Index(
+                condition=models.Q(("is_spam", False)),
+                fields=["-bookmark_count", "-pub_date", "-id"],
+                name="cab_snippet_active_bookmarked",
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+import django.db.models.deletion
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("cab", "0012_snippet_active_sort_indexes"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name="RelatedSnippet",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("score", models.FloatField()),
+                (
+                    "related",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="cab.snippet",
+                    ),
+                ),
+                (
+                    "snippet",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="related_entries",
+                        to="cab.snippet",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["snippet", "-score"], name="cab_related_snippet_score"),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("snippet", "related"),
+                        name="unique_related_snippet",
+                    ),
+                ],
+            },
+        ),
+    ]
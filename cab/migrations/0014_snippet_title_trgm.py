@@ -0,0 +1,23 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # build the index without blocking writes to the snippet table
+    atomic = False
+
+    dependencies = [
+        ("cab", "0013_relatedsnippet"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="snippet",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["title"],
+                name="cab_snippet_title_trgm",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+    ]
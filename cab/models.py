@@ -1,24 +1,49 @@
 from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Count
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField, TrigramSimilarity
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Window
+from django.db.models.functions import RowNumber
 from django.urls import reverse
 from django_comments.moderation import moderator
-from pygments import formatters, highlight, lexers
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItem
 
 from comments_spamfighter.moderation import SpamFighterModerator
-from ratings.models import Ratings
+from ratings.models import Ratings, SimilarItem
+from ratings.recommendations import rating_matrix
+from ratings.utils import load_user_ratings
 
-from .listeners import start_listening
-from .utils import sanitize_markdown
+from .listeners import deferred_leaderboards, start_listening
+from .utils import bump_snippet_cache_version, get_lexer, highlight_code, sanitize_markdown
 
 VERSIONS = getattr(settings, "CAB_VERSIONS", ())
 
+# how many related snippets are kept for every snippet
+RELATED_SNIPPETS = getattr(settings, "CAB_RELATED_SNIPPETS", 10)
+# how many candidates each kind of similarity contributes before scoring
+RELATED_CANDIDATES = 50
+RELATED_WEIGHTS = {
+    "tags": 1.0,
+    "title": 1.0,
+    "description": 0.5,
+    "ratings": 0.5,
+    "language": 0.1,
+}
+# how many snippets are recommended to a user
+RECOMMENDED_SNIPPETS = getattr(settings, "CAB_RECOMMENDED_SNIPPETS", 10)
+
 
 class LanguageManager(models.Manager):
     def top_languages(self):
-        return self.annotate(score=Count("snippet")).order_by("-score")
+        return (
+            self.filter(snippet_leaderboard__isnull=False)
+            .annotate(score=F("snippet_leaderboard__score"))
+            .order_by("-score", "name")
+        )
 
 
 class Language(models.Model):
@@ -40,29 +65,127 @@ class Language(models.Model):
         return reverse("cab_language_detail", kwargs={"slug": self.slug})
 
     def get_lexer(self):
-        return lexers.get_lexer_by_name(self.language_code)
+        return get_lexer(self.language_code)
 
 
 class SnippetManager(models.Manager):
     def top_authors(self):
-        return User.objects.annotate(score=Count("snippet")).order_by("-score", "username")
+        return (
+            User.objects.filter(snippet_leaderboard__isnull=False)
+            .annotate(score=F("snippet_leaderboard__score"))
+            .order_by("-score", "username")
+        )
 
     def top_tags(self):
-        return self.model.tags.most_common().order_by("-num_times", "name")
+        return (
+            Tag.objects.filter(snippet_leaderboard__isnull=False)
+            .annotate(num_times=F("snippet_leaderboard__score"))
+            .order_by("-num_times", "name")
+        )
 
     def top_rated(self):
-        # this is slow
+        # read in the order of the cab_snippet_rated index
         return self.all().order_by("-rating_score", "-pub_date")
 
     def most_bookmarked(self):
-        # this is slow
+        # read in the order of the cab_snippet_bookmarked index
         return self.all().order_by("-bookmark_count", "-pub_date")
 
     def matches_tag(self, tag):
         return self.filter(tags__in=[tag])
 
     def active_snippet(self):
-        return self.exclude(flags__flag=SnippetFlag.FLAG_SPAM)
+        return self.filter(is_spam=False)
+
+    def recommended_for(self, user, limit=RECOMMENDED_SNIPPETS):
+        """
+        The active snippets by others that the users who rate like ``user``
+        rated highest, best first and with their ``recommendation_score``.
+        They are ranked on the cached rating matrix, so only the snippets
+        themselves are queried.
+        """
+        ranking = rating_matrix(self.model).recommend(user.pk)
+        candidates = self.active_snippet().exclude(author=user).select_related("author", "language")
+        recommended = []
+        batch_size = max(limit * 2, 1)
+        for start in range(0, len(ranking), batch_size):
+            batch = ranking[start : start + batch_size]
+            snippets = candidates.in_bulk([snippet_id for _, snippet_id in batch])
+            for score, snippet_id in batch:
+                if snippet_id in snippets:
+                    snippets[snippet_id].recommendation_score = score
+                    recommended.append(snippets[snippet_id])
+            if len(recommended) >= limit:
+                break
+        return recommended[:limit]
+
+    def update_spam_status(self, snippet_ids):
+        """
+        Recomputes the denormalized ``is_spam`` flag of the given snippets
+        from their flags.
+        """
+        spam_flags = SnippetFlag.objects.filter(snippet=OuterRef("pk"), flag=SnippetFlag.FLAG_SPAM)
+        updated = self.filter(pk__in=snippet_ids).update(is_spam=Exists(spam_flags))
+        # no listener sees the update, so bump their cached fragments here,
+        # along with those of the snippets listing them as related
+        related = RelatedSnippet.objects.filter(related__in=snippet_ids).values_list(
+            "snippet_id",
+            flat=True,
+        )
+        for snippet_id in {*snippet_ids, *related}:
+            bump_snippet_cache_version(snippet_id, using=self.db)
+        return updated
+
+    def remove_and_ban(self, snippet_ids, batch_size=200, progress=None):
+        """
+        Deletes the given snippets and bans their authors, like
+        SnippetFlag.remove_and_ban() but in bulk: the authors are banned
+        with a single update and the snippets are deleted a batch at a time,
+        each in its own transaction. ``progress`` is called with the number
+        of snippets handled so far and their total after every batch.
+        """
+        snippet_ids = sorted(set(snippet_ids))
+        User.objects.filter(
+            pk__in=self.filter(pk__in=snippet_ids).values("author_id"),
+        ).update(is_active=False, password=make_password(None))
+
+        deleted = 0
+        with deferred_leaderboards():
+            for start in range(0, len(snippet_ids), batch_size):
+                batch = snippet_ids[start : start + batch_size]
+                with transaction.atomic(using=self.db):
+                    deleted += self.filter(pk__in=batch).delete()[1].get(self.model._meta.label, 0)
+                if progress is not None:
+                    progress(start + len(batch), len(snippet_ids))
+        return deleted
+
+    def change_rating(self, snippet_id, score_delta, count_delta=0):
+        """
+        Applies a rating change to the denormalized counters in place,
+        without loading or re-rendering the snippet.
+        """
+        return self.filter(pk=snippet_id).update(
+            rating_score=F("rating_score") + score_delta,
+            rating_count=F("rating_count") + count_delta,
+        )
+
+
+def snippet_search_vector():
+    """
+    The weighted document stored in ``Snippet.search_vector``. Related names
+    are pulled in with subqueries since ``update()`` can't follow joins.
+    """
+    author_username = Subquery(
+        User.objects.filter(pk=OuterRef("author_id")).values("username")[:1],
+    )
+    language_name = Subquery(
+        Language.objects.filter(pk=OuterRef("language_id")).values("name")[:1],
+    )
+    return (
+        SearchVector("title", weight="A")
+        + SearchVector("description", weight="B")
+        + SearchVector(author_username, language_name, "version", weight="C")
+    )
 
 
 class Snippet(models.Model):
@@ -78,32 +201,142 @@ class Snippet(models.Model):
     updated_date = models.DateTimeField(auto_now=True)
     bookmark_count = models.IntegerField(default=0)  # denormalized count
     rating_score = models.IntegerField(default=0)  # denormalized score
+    rating_count = models.IntegerField(default=0)  # denormalized count
+    is_spam = models.BooleanField(default=False, editable=False)  # denormalized spam flag
+    search_vector = SearchVectorField(null=True, editable=False)
 
     ratings = Ratings()
     tags = TaggableManager(blank=True)
 
     objects = SnippetManager()
 
+    # fields the stored HTML and the search document are derived from
+    RENDERED_FIELDS = frozenset(["code", "description", "language_id"])
+    SEARCH_FIELDS = frozenset(["title", "description", "version", "author_id", "language_id"])
+
     class Meta:
         ordering = ("-pub_date",)
+        indexes = [
+            GinIndex(fields=["search_vector"], name="cab_snippet_search_vector"),
+            # one per sorting tab of SnippetList, alone and within a language or
+            # author, in the order the list pages and seeks through them
+            models.Index(
+                fields=["-pub_date", "-id"],
+                name="cab_snippet_newest",
+            ),
+            models.Index(
+                fields=["-updated_date", "-pub_date", "-id"],
+                name="cab_snippet_updated",
+            ),
+            models.Index(
+                fields=["-rating_score", "-pub_date", "-id"],
+                name="cab_snippet_rated",
+            ),
+            models.Index(
+                fields=["-bookmark_count", "-pub_date", "-id"],
+                name="cab_snippet_bookmarked",
+            ),
+            # the same orderings over the snippets shown to the public
+            models.Index(
+                fields=["-pub_date", "-id"],
+                name="cab_snippet_active_newest",
+                condition=Q(is_spam=False),
+            ),
+            models.Index(
+                fields=["-updated_date", "-pub_date", "-id"],
+                name="cab_snippet_active_updated",
+                condition=Q(is_spam=False),
+            ),
+            models.Index(
+                fields=["-rating_score", "-pub_date", "-id"],
+                name="cab_snippet_active_rated",
+                condition=Q(is_spam=False),
+            ),
+            models.Index(
+                fields=["-bookmark_count", "-pub_date", "-id"],
+                name="cab_snippet_active_bookmarked",
+                condition=Q(is_spam=False),
+            ),
+            # finds the candidates for related snippets with the % operator
+            GinIndex(fields=["title"], name="cab_snippet_title_trgm", opclasses=["gin_trgm_ops"]),
+            models.Index(
+                fields=["language", "-pub_date", "-id"],
+                name="cab_snippet_lang_newest",
+            ),
+            models.Index(
+                fields=["language", "-updated_date", "-pub_date", "-id"],
+                name="cab_snippet_lang_updated",
+            ),
+            models.Index(
+                fields=["language", "-rating_score", "-pub_date", "-id"],
+                name="cab_snippet_lang_rated",
+            ),
+            models.Index(
+                fields=["language", "-bookmark_count", "-pub_date", "-id"],
+                name="cab_snippet_lang_bookmarked",
+            ),
+            models.Index(
+                fields=["author", "-pub_date", "-id"],
+                name="cab_snippet_author_newest",
+            ),
+            models.Index(
+                fields=["author", "-updated_date", "-pub_date", "-id"],
+                name="cab_snippet_author_updated",
+            ),
+            models.Index(
+                fields=["author", "-rating_score", "-pub_date", "-id"],
+                name="cab_snippet_author_rated",
+            ),
+            models.Index(
+                fields=["author", "-bookmark_count", "-pub_date", "-id"],
+                name="cab_snippet_author_bookmarked",
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance._tracked_values()
+        return instance
+
+    def _tracked_values(self):
+        # deferred fields are missing from __dict__ and count as changed
+        return {name: self.__dict__.get(name) for name in self.RENDERED_FIELDS | self.SEARCH_FIELDS}
+
+    def get_changed_fields(self):
+        """
+        Returns the names of the tracked fields which changed since the
+        snippet was loaded or last saved. Everything counts as changed on
+        snippets which were never saved.
+        """
+        loaded_values = getattr(self, "_loaded_values", None)
+        current_values = self._tracked_values()
+        if loaded_values is None:
+            return set(current_values)
+        return {name for name, value in current_values.items() if loaded_values[name] != value}
+
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        changed_fields = self.get_changed_fields() if update_fields is None else set()
+        if changed_fields & self.RENDERED_FIELDS:
+            self.render()
+        super().save(*args, **kwargs)
+        if changed_fields & self.SEARCH_FIELDS:
+            self.update_search_vector()
+        self._loaded_values = self._tracked_values()
+
+    def render(self):
         self.description_html = sanitize_markdown(self.description)
         self.highlighted_code = self.highlight()
-        super().save(*args, **kwargs)
 
     def get_absolute_url(self):
         return reverse("cab_snippet_detail", kwargs={"snippet_id": self.id})
 
     def highlight(self):
-        return highlight(
-            self.code,
-            self.language.get_lexer(),
-            formatters.HtmlFormatter(linenos=True),
-        )
+        return highlight_code(self.code, self.language.language_code)
 
     def get_tagstring(self):
         return ", ".join([t.name for t in self.tags.order_by("name").all()])
@@ -111,13 +344,22 @@ class Snippet(models.Model):
     def get_version(self):
         return dict(VERSIONS)[self.version]
 
+    def update_search_vector(self):
+        Snippet.objects.filter(pk=self.pk).update(search_vector=snippet_search_vector())
+        # or the next full save() would write the stale vector back
+        self.refresh_from_db(fields=["search_vector"])
+
     def update_rating(self):
         self.rating_score = self.ratings.cumulative_score() or 0
-        self.save()
+        self.rating_count = self.ratings.count()
+        Snippet.objects.filter(pk=self.pk).update(
+            rating_score=self.rating_score,
+            rating_count=self.rating_count,
+        )
 
     def update_bookmark_count(self):
         self.bookmark_count = self.bookmarks.count() or 0
-        self.save()
+        self.save(update_fields=["bookmark_count"])
 
     def mark_as_inappropiate(self):
         snippet_flag = SnippetFlag(
@@ -132,6 +374,23 @@ class Snippet(models.Model):
         snippet_flag.save()
 
 
+class SnippetFlagManager(models.Manager):
+    def flag_snippets(self, snippets, flag):
+        """
+        Flags every snippet of the given queryset in one go, on behalf of
+        its author like Snippet.mark_as_spam() does.
+        """
+        flags = [
+            self.model(snippet_id=snippet_id, user_id=author_id, flag=flag)
+            for snippet_id, author_id in snippets.values_list("pk", "author_id")
+        ]
+        flags = self.bulk_create(flags, batch_size=1000)
+        if flag == self.model.FLAG_SPAM:
+            # bulk_create() bypasses the listeners keeping is_spam current
+            Snippet.objects.update_spam_status([f.snippet_id for f in flags])
+        return flags
+
+
 class SnippetFlag(models.Model):
     FLAG_SPAM = 1
     FLAG_INAPPROPRIATE = 2
@@ -143,6 +402,8 @@ class SnippetFlag(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     flag = models.IntegerField(choices=FLAG_CHOICES)
 
+    objects = SnippetFlagManager()
+
     def __str__(self):
         return f"{self.snippet.title} flagged as {self.get_flag_display()} by {self.user.username}"
 
@@ -174,6 +435,273 @@ class Bookmark(models.Model):
         self.snippet.update_bookmark_count()
 
 
+def load_viewer_state(user, snippets):
+    """
+    Fetches whether ``user`` bookmarked, rated and flagged each of
+    ``snippets`` with a query each, for the ``is_bookmarked``,
+    ``rating_score`` and ``has_flagged`` filters to render a page of
+    snippets without querying per snippet.
+    """
+    if not user.is_authenticated:
+        return
+    snippets = list(snippets)
+    pks = [snippet.pk for snippet in snippets]
+    for attr, model in [("_bookmarked_snippets", Bookmark), ("_flagged_snippets", SnippetFlag)]:
+        state = getattr(user, attr, None)
+        if state is None:
+            state = {}
+            setattr(user, attr, state)
+        state.update(dict.fromkeys(pks, False))
+        state.update(
+            (pk, True)
+            for pk in model.objects.filter(user=user, snippet__in=pks).values_list(
+                "snippet_id",
+                flat=True,
+            )
+        )
+    load_user_ratings(user, snippets)
+
+
+class LeaderboardManager(models.Manager):
+    def refresh(self, keys=None):
+        """
+        Recounts the snippets behind the given keys, or rebuilds the whole
+        leaderboard when no keys are given. Keys without snippets are dropped.
+        """
+        counts = self.model.snippet_counts(keys)
+        entries = [self.model(pk=key, score=score) for key, score in counts.items()]
+        with transaction.atomic(using=self.db):
+            if keys is None:
+                self.all().delete()
+            else:
+                self.filter(pk__in=keys).exclude(pk__in=list(counts)).delete()
+            self.bulk_create(
+                entries,
+                update_conflicts=True,
+                unique_fields=[self.model._meta.pk.name],
+                update_fields=["score"],
+            )
+
+
+class LeaderboardEntry(models.Model):
+    """
+    A precomputed count behind one of the ``top_*`` listings, so they read
+    sorted rows instead of aggregating every snippet on each request.
+    """
+
+    score = models.IntegerField(db_index=True)
+
+    objects = LeaderboardManager()
+
+    # the model whose rows are counted, and the field of it entries are keyed on
+    counted_model = None
+    group_field = None
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def counted_items(cls):
+        return cls.counted_model._default_manager.all()
+
+    @classmethod
+    def snippet_counts(cls, keys=None):
+        items = cls.counted_items().order_by()
+        if keys is not None:
+            items = items.filter(**{f"{cls.group_field}__in": keys})
+        return dict(items.values_list(cls.group_field).annotate(score=Count("pk")))
+
+
+class AuthorLeaderboard(LeaderboardEntry):
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        related_name="snippet_leaderboard",
+        on_delete=models.CASCADE,
+    )
+
+    counted_model = Snippet
+    group_field = "author_id"
+
+
+class LanguageLeaderboard(LeaderboardEntry):
+    language = models.OneToOneField(
+        Language,
+        primary_key=True,
+        related_name="snippet_leaderboard",
+        on_delete=models.CASCADE,
+    )
+
+    counted_model = Snippet
+    group_field = "language_id"
+
+
+class TagLeaderboard(LeaderboardEntry):
+    tag = models.OneToOneField(
+        Tag,
+        primary_key=True,
+        related_name="snippet_leaderboard",
+        on_delete=models.CASCADE,
+    )
+
+    counted_model = TaggedItem
+    group_field = "tag_id"
+
+    @classmethod
+    def counted_items(cls):
+        return (
+            super().counted_items().filter(content_type=ContentType.objects.get_for_model(Snippet))
+        )
+
+
+class RelatedSnippetManager(models.Manager):
+    def for_snippet(self, snippet):
+        return (
+            self.filter(snippet=snippet, related__is_spam=False)
+            .select_related("related__author")
+            .order_by("-score", "related_id")
+        )
+
+    def score_candidates(self, snippet):
+        """
+        Scores the snippets which share tags with the given snippet, have a
+        similar title or were rated alike, by how many tags they share, the
+        trigram similarity of their titles and descriptions, their rating
+        similarity and whether they are in the same language.
+        """
+        tagged_snippets = TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Snippet),
+        ).order_by()
+        tag_ids = list(
+            tagged_snippets.filter(object_id=snippet.pk).values_list("tag_id", flat=True),
+        )
+        shared_tags = {}
+        if tag_ids:
+            shared_tags = dict(
+                tagged_snippets.filter(tag_id__in=tag_ids)
+                .exclude(object_id=snippet.pk)
+                .values_list("object_id")
+                .annotate(shared=Count("pk"))
+                .order_by("-shared")[:RELATED_CANDIDATES],
+            )
+        similar_titles = (
+            Snippet.objects.filter(title__trigram_similar=snippet.title)
+            .exclude(pk=snippet.pk)
+            .annotate(similarity=TrigramSimilarity("title", snippet.title))
+            .order_by("-similarity")
+            .values_list("pk", flat=True)[:RELATED_CANDIDATES]
+        )
+        similar_ratings = dict(
+            SimilarItem.objects.get_for_item(snippet)
+            .filter(similar_content_type=ContentType.objects.get_for_model(Snippet), score__gt=0)
+            .values_list("similar_object_id", "score")[:RELATED_CANDIDATES],
+        )
+
+        candidate_ids = set(shared_tags) | set(similar_titles) | set(similar_ratings)
+        candidate_ids.discard(snippet.pk)
+        if not candidate_ids:
+            return {}
+        tag_counts = dict(
+            tagged_snippets.filter(object_id__in=candidate_ids)
+            .values_list("object_id")
+            .annotate(count=Count("pk")),
+        )
+        candidates = (
+            Snippet.objects.active_snippet()
+            .filter(pk__in=candidate_ids)
+            .annotate(
+                title_similarity=TrigramSimilarity("title", snippet.title),
+                description_similarity=TrigramSimilarity("description", snippet.description),
+            )
+            .values_list("pk", "language_id", "title_similarity", "description_similarity")
+        )
+        scores = {}
+        for pk, language_id, title_similarity, description_similarity in candidates:
+            shared = shared_tags.get(pk, 0)
+            # the Jaccard index of both sets of tags
+            tag_overlap = shared / (len(tag_ids) + tag_counts.get(pk, 0) - shared) if shared else 0
+            scores[pk] = (
+                RELATED_WEIGHTS["tags"] * tag_overlap
+                + RELATED_WEIGHTS["title"] * title_similarity
+                + RELATED_WEIGHTS["description"] * description_similarity
+                + RELATED_WEIGHTS["ratings"] * similar_ratings.get(pk, 0)
+                + RELATED_WEIGHTS["language"] * (language_id == snippet.language_id)
+            )
+        return scores
+
+    def refresh(self, snippet):
+        """
+        Replaces the related snippets of the given snippet, and its place in
+        the lists of the snippets it's related to, which are then cut back to
+        their best ``RELATED_SNIPPETS`` entries again. The cached fragments
+        of every snippet whose list changed go stale.
+        """
+        scores = self.score_candidates(snippet)
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:RELATED_SNIPPETS]
+        with transaction.atomic(using=self.db):
+            listed_in = set(self.filter(related=snippet).values_list("snippet_id", flat=True))
+            self.filter(Q(snippet=snippet) | Q(related=snippet)).delete()
+            entries = [
+                self.model(snippet_id=snippet.pk, related_id=pk, score=score) for pk, score in best
+            ]
+            # the scores are symmetric, so the snippet may belong in their lists too
+            entries += [
+                self.model(snippet_id=pk, related_id=snippet.pk, score=score)
+                for pk, score in scores.items()
+            ]
+            # a concurrent refresh of a snippet related to this one may have
+            # inserted some of the same pairs since they were deleted
+            self.bulk_create(
+                entries,
+                update_conflicts=True,
+                unique_fields=["snippet", "related"],
+                update_fields=["score"],
+            )
+            self.trim(scores)
+            for snippet_id in {snippet.pk, *listed_in, *scores}:
+                bump_snippet_cache_version(snippet_id, using=self.db)
+
+    def trim(self, snippet_ids):
+        ranked = self.filter(snippet_id__in=snippet_ids).annotate(
+            rank=Window(
+                RowNumber(),
+                partition_by=F("snippet_id"),
+                order_by=[F("score").desc(), F("related_id").asc()],
+            ),
+        )
+        surplus = list(ranked.filter(rank__gt=RELATED_SNIPPETS).values_list("pk", flat=True))
+        self.filter(pk__in=surplus).delete()
+
+
+class RelatedSnippet(models.Model):
+    """
+    One of the precomputed "more like this" snippets of a snippet, so the
+    detail page reads them with a single indexed query.
+    """
+
+    snippet = models.ForeignKey(
+        Snippet,
+        related_name="related_entries",
+        on_delete=models.CASCADE,
+        db_index=False,  # covered by cab_related_snippet_score
+    )
+    related = models.ForeignKey(Snippet, related_name="+", on_delete=models.CASCADE)
+    score = models.FloatField()
+
+    objects = RelatedSnippetManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["snippet", "related"], name="unique_related_snippet"),
+        ]
+        indexes = [
+            models.Index(fields=["snippet", "-score"], name="cab_related_snippet_score"),
+        ]
+
+    def __str__(self):
+        return f"{self.related_id} related to {self.snippet_id}"
+
+
 class SnippetModerator(SpamFighterModerator):
     # Regular options by Django's contributed CommentModerator
     email_notification = True
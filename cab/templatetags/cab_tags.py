@@ -1,7 +1,7 @@
 from django import template
-from django.contrib.postgres.search import SearchVector
 
-from cab.models import Bookmark, Snippet, SnippetFlag
+from cab.models import Bookmark, RelatedSnippet, SnippetFlag
+from cab.utils import snippet_cache_version
 
 register = template.Library()
 
@@ -17,27 +17,33 @@ def is_bookmarked(snippet, user):
     """
     if not user.is_authenticated:
         return False
+    bookmarked = getattr(user, "_bookmarked_snippets", {})
+    if snippet.pk in bookmarked:
+        return bookmarked[snippet.pk]
     return Bookmark.objects.filter(snippet=snippet, user=user).exists()
 
 
+@register.filter
+def cache_version(snippet):
+    """
+    {% cache 86400 snippet_comments snippet.pk snippet|cache_version %}
+    """
+    return snippet_cache_version(snippet.pk)
+
+
 @register.filter
 def has_flagged(user, snippet):
     if not user.is_authenticated:
         return False
+    flagged = getattr(user, "_flagged_snippets", {})
+    if snippet.pk in flagged:
+        return flagged[snippet.pk]
     return SnippetFlag.objects.filter(snippet=snippet, user=user).exists()
 
 
 @register.filter
 def more_like_this(snippet, limit=None):
-    try:
-        sqs = Snippet.objects.annotate(
-            search=SearchVector(
-                "language__name",
-            ),
-        )
-        sqs = sqs.filter(language__name=snippet.language).exclude(pk=snippet.pk)
-        if limit is not None:
-            sqs = sqs[:limit]
-    except AttributeError:
-        sqs = []
-    return sqs
+    related = RelatedSnippet.objects.for_snippet(snippet)
+    if limit is not None:
+        related = related[:limit]
+    return [entry.related for entry in related]
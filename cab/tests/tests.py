@@ -1,14 +1,48 @@
+import datetime
+import json
+import tarfile
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+import django_comments
+import pygments
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
 from django.template import Context, Template
 from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 
 from cab.api.serializers import SnippetSerializer
-from cab.models import Bookmark, Language, Snippet
+from cab.benchmark import benchmark_cases, compare_results, run_benchmarks, seed_dataset
+from cab.export import exported_snippets, snippet_record
+from cab.feeds import LatestSnippetsFeed
+from cab.importer import read_records
+from cab.main import SnippetList
+from cab.models import (
+    AuthorLeaderboard,
+    Bookmark,
+    Language,
+    RelatedSnippet,
+    Snippet,
+    SnippetFlag,
+    TagLeaderboard,
+    load_viewer_state,
+)
 from cab.templatetags.markup import safe_markdown
+from cab.utils import get_lexer, highlight_code, snippet_cache_version
 from cab.views.languages import language_list
 from cab.views.popular import top_authors, top_tags
+from ratings.recommendations import rating_matrix_key
 
 
 # @skip("These tests don't test production code.")
@@ -129,6 +163,62 @@ class ManagerTestCase(BaseCabTestCase):
         self.assertEqual(top_tags[2].name, "haxor")
         self.assertEqual(top_tags[3].name, "hello")
 
+    def test_leaderboards_follow_changes(self):
+        def scores(queryset, attr="score"):
+            return {str(obj): getattr(obj, attr) for obj in queryset}
+
+        self.snippet3.author = self.user_b
+        self.snippet3.language = self.python
+        self.snippet3.save()
+        self.assertEqual(scores(Snippet.objects.top_authors()), {"a": 1, "b": 2})
+        self.assertEqual(scores(Language.objects.top_languages()), {"Python": 3})
+
+        self.snippet1.tags.remove("world")
+        self.snippet2.tags.clear()
+        self.assertEqual(
+            scores(Snippet.objects.top_tags(), "num_times"),
+            {"hello": 1, "haxor": 1},
+        )
+
+        self.snippet2.delete()
+        self.assertEqual(scores(Snippet.objects.top_authors()), {"a": 1, "b": 1})
+        self.assertEqual(scores(Language.objects.top_languages()), {"Python": 2})
+
+    def test_update_leaderboards_command(self):
+        AuthorLeaderboard.objects.all().delete()
+        TagLeaderboard.objects.filter(tag__name="world").update(score=0)
+        call_command("update_leaderboards", stdout=StringIO())
+        self.assertEqual(Snippet.objects.top_authors()[0].score, 2)
+        self.assertEqual(Snippet.objects.top_tags()[0].num_times, 2)
+
+    def test_related_snippets(self):
+        def related(snippet):
+            return [entry.related for entry in RelatedSnippet.objects.for_snippet(snippet)]
+
+        self.assertEqual(related(self.snippet1), [self.snippet2])
+        self.assertEqual(related(self.snippet2), [self.snippet1])
+        self.assertEqual(related(self.snippet3), [])
+
+        # the title and language break the tie of the shared tags, and the
+        # pages listing snippet3 now go stale too
+        version = snippet_cache_version(self.snippet1.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.snippet3.tags.add("world")
+        self.assertNotEqual(snippet_cache_version(self.snippet1.pk), version)
+        self.assertEqual(related(self.snippet1), [self.snippet2, self.snippet3])
+        self.assertCountEqual(related(self.snippet3), [self.snippet1, self.snippet2])
+
+        self.snippet2.mark_as_spam()
+        self.assertEqual(related(self.snippet1), [self.snippet3])
+        self.snippet3.delete()
+        self.assertEqual(related(self.snippet1), [])
+
+    def test_update_related_snippets_command(self):
+        RelatedSnippet.objects.all().delete()
+        call_command("update_related_snippets", stdout=StringIO())
+        related = RelatedSnippet.objects.for_snippet(self.snippet1)
+        self.assertEqual(list(related.values_list("related", flat=True)), [self.snippet2.pk])
+
     def test_top_rated(self):
         top_rated = Snippet.objects.top_rated()
         self.assertEqual(top_rated[0], self.snippet1)
@@ -156,6 +246,55 @@ class ModelTestCase(BaseCabTestCase):
             '&lt;script&gt;alert("hacked");&lt;/script&gt;',
         )
 
+    def test_flag_snippets(self):
+        version = snippet_cache_version(self.snippet1.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            flags = SnippetFlag.objects.flag_snippets(
+                Snippet.objects.filter(author=self.user_a),
+                SnippetFlag.FLAG_SPAM,
+            )
+        self.assertEqual(len(flags), 2)
+        self.assertNotEqual(snippet_cache_version(self.snippet1.pk), version)
+        self.assertCountEqual(
+            SnippetFlag.objects.values_list("snippet", "user", "flag"),
+            [
+                (self.snippet1.pk, self.user_a.pk, SnippetFlag.FLAG_SPAM),
+                (self.snippet3.pk, self.user_a.pk, SnippetFlag.FLAG_SPAM),
+            ],
+        )
+        self.assertQuerySetEqual(Snippet.objects.active_snippet(), [self.snippet2])
+
+    def test_spam_status(self):
+        self.snippet1.mark_as_inappropiate()
+        self.assertFalse(Snippet.objects.get(pk=self.snippet1.pk).is_spam)
+
+        self.snippet1.mark_as_spam()
+        self.snippet1.mark_as_spam()
+        self.assertCountEqual(Snippet.objects.active_snippet(), [self.snippet2, self.snippet3])
+
+        spam_flags = self.snippet1.flags.filter(flag=SnippetFlag.FLAG_SPAM)
+        spam_flags.first().delete()
+        self.assertTrue(Snippet.objects.get(pk=self.snippet1.pk).is_spam)
+        spam_flags.delete()
+        self.assertFalse(Snippet.objects.get(pk=self.snippet1.pk).is_spam)
+
+    def test_remove_and_ban(self):
+        progress = []
+        deleted = Snippet.objects.remove_and_ban(
+            [self.snippet1.pk, self.snippet2.pk, self.snippet2.pk],
+            batch_size=1,
+            progress=lambda done, total: progress.append((done, total)),
+        )
+        self.assertEqual(deleted, 2)
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+        self.assertQuerySetEqual(Snippet.objects.all(), [self.snippet3])
+
+        for user in User.objects.all():
+            self.assertFalse(user.is_active)
+            self.assertFalse(user.has_usable_password())
+        self.assertEqual(Language.objects.top_languages()[0].score, 1)
+        self.assertEqual([tag.name for tag in Snippet.objects.top_tags()], ["haxor"])
+
     def test_ratings_hooks(self):
         # setUp() will actually fire off most of these hooks
         self.assertEqual(self.snippet1.rating_score, 2)
@@ -178,6 +317,40 @@ class ModelTestCase(BaseCabTestCase):
         self.snippet3 = Snippet.objects.get(pk=self.snippet3.pk)
         self.assertEqual(self.snippet3.rating_score, -2)
 
+    def test_rating_counters(self):
+        self.assertEqual(self.snippet1.rating_count, 2)
+        self.assertEqual(self.snippet2.rating_count, 2)
+
+        # changing a vote moves the score but not the count, in one upsert
+        # and one update of the counters
+        with self.assertNumQueries(2):
+            self.snippet1.ratings.rate(self.user_a, -1)
+        snippet1 = Snippet.objects.get(pk=self.snippet1.pk)
+        self.assertEqual(snippet1.rating_score, 0)
+        self.assertEqual(snippet1.rating_count, 2)
+
+        # votes only touch the counters, not the rendered snippet
+        self.assertEqual(snippet1.updated_date, self.snippet1.updated_date)
+
+        with self.assertNumQueries(2):
+            self.snippet1.ratings.unrate(self.user_b)
+        snippet1 = Snippet.objects.get(pk=self.snippet1.pk)
+        self.assertEqual(snippet1.rating_score, -1)
+        self.assertEqual(snippet1.rating_count, 1)
+
+        # removing a rating that isn't there changes nothing
+        with self.assertNumQueries(1):
+            self.snippet1.ratings.unrate(self.user_b)
+        self.snippet2.ratings.rate(self.user_a, -1)
+        self.snippet2.ratings.rate(self.user_a, 1)
+        snippet2 = Snippet.objects.get(pk=self.snippet2.pk)
+        self.assertEqual(snippet2.rating_score, 0)
+        self.assertEqual(snippet2.rating_count, 2)
+
+        snippet1.update_rating()
+        self.assertEqual(snippet1.rating_score, -1)
+        self.assertEqual(snippet1.rating_count, 1)
+
     def test_bookmark_hooks(self):
         self.assertEqual(self.snippet1.bookmark_count, 2)
 
@@ -208,6 +381,83 @@ class ModelTestCase(BaseCabTestCase):
         self.snippet1.save()
         self.assertTrue("<strong>Booyakasha</strong>" in self.snippet1.description_html)
 
+    def test_save_renders_only_changed_content(self):
+        with mock.patch.object(Snippet, "highlight", autospec=True, return_value="") as highlight:
+            self.snippet1.title = "Howdy world"
+            self.snippet1.save()
+            self.snippet1.update_bookmark_count()
+            highlight.assert_not_called()
+
+            self.snippet1.code = 'print "Hello again"'
+            self.snippet1.save()
+            highlight.assert_called_once()
+
+            snippet = Snippet.objects.get(pk=self.snippet2.pk)
+            snippet.language = self.sql
+            snippet.save()
+            self.assertEqual(highlight.call_count, 2)
+
+        # the search document still follows the title, also after the later
+        # full saves of the same instance
+        self.assertTrue(Snippet.objects.filter(pk=self.snippet1.pk, search_vector="howdy"))
+        self.snippet1.save()
+        self.assertTrue(Snippet.objects.filter(pk=self.snippet1.pk, search_vector="howdy"))
+
+    def test_rerender_snippets_command(self):
+        Snippet.objects.update(description_html="", highlighted_code="")
+        version = snippet_cache_version(self.snippet1.pk)
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("rerender_snippets", languages=["python"], processes=1, stdout=out)
+        self.assertIn("Re-rendered 2 snippets, 2 changed.", out.getvalue())
+        # the cached fragments of the written snippets go stale
+        self.assertNotEqual(snippet_cache_version(self.snippet1.pk), version)
+
+        snippet1 = Snippet.objects.get(pk=self.snippet1.pk)
+        self.assertEqual(snippet1.description_html, self.snippet1.description_html)
+        self.assertEqual(snippet1.highlighted_code, self.snippet1.highlighted_code)
+        self.assertEqual(Snippet.objects.get(pk=self.snippet3.pk).highlighted_code, "")
+
+        # resuming skips everything up to the given id, unchanged rows aren't written
+        out = StringIO()
+        last_pk = max(self.snippet1.pk, self.snippet2.pk)
+        call_command("rerender_snippets", start_after=last_pk, processes=1, stdout=out)
+        self.assertIn("Re-rendered 1 snippets, 1 changed.", out.getvalue())
+        self.assertEqual(
+            Snippet.objects.get(pk=self.snippet3.pk).highlighted_code,
+            self.snippet3.highlighted_code,
+        )
+
+    def test_import_snippets_command(self):
+        records = [
+            {key: value for key, value in snippet_record(snippet).items() if key != "id"}
+            for snippet in exported_snippets()
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "snippets.ndjson"
+            path.write_text("\n".join(map(json.dumps, records)))
+            call_command("import_snippets", str(path), processes=1, stdout=StringIO())
+
+        imported = Snippet.objects.exclude(
+            pk__in=[self.snippet1.pk, self.snippet2.pk, self.snippet3.pk],
+        ).get(title=self.snippet1.title)
+        self.assertEqual(imported.highlighted_code, self.snippet1.highlighted_code)
+        self.assertEqual(imported.description_html, self.snippet1.description_html)
+        self.assertEqual(imported.pub_date, self.snippet1.pub_date)
+        self.assertEqual(imported.get_tagstring(), "hello, world")
+        self.assertEqual(Snippet.objects.top_tags()[0].num_times, 4)
+        self.assertTrue(Snippet.objects.filter(pk=imported.pk, search_vector="hello"))
+
+        call_command("import_snippets", synthetic=20, seed=1, processes=1, stdout=StringIO())
+        synthetic = Snippet.objects.filter(author__username__startswith="loadtest")
+        self.assertEqual(synthetic.count(), 20)
+
+    def test_read_records(self):
+        records = [{"title": "Hello, [world]"}, {"title": "Goodbye"}]
+        for text in (json.dumps(records, indent=4), "\n".join(map(json.dumps, records))):
+            with self.subTest(text=text):
+                self.assertEqual(list(read_records(StringIO(text), chunk_size=7)), records)
+
     def test_tag_string(self):
         # yes.  test a list comprehension
         self.assertEqual(self.snippet1.get_tagstring(), "hello, world")
@@ -326,6 +576,34 @@ class ViewTestCase(BaseCabTestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertCountEqual(resp.context["object_list"], [self.snippet1, self.snippet3])
 
+    def test_recommended_snippets(self):
+        recommended = reverse("cab_snippet_recommended")
+        self.assertEqual(recommended, "/snippets/recommended/")
+
+        # c rates like both a and b, who disagree on snippet3
+        user_c = User.objects.create_user("c", "c", "c")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.snippet1.ratings.rate(user_c, 1)
+            self.snippet2.ratings.rate(user_c, -1)
+        # the committed votes are read once the rebuild lock expired
+        ctype_id = ContentType.objects.get_for_model(Snippet).pk
+        cache.delete(rating_matrix_key(ctype_id, "lock"))
+        self.assertEqual(Snippet.objects.recommended_for(user_c), [self.snippet3])
+        self.assertEqual(Snippet.objects.recommended_for(user_c)[0].recommendation_score, 0)
+        # a rated everything already
+        self.assertEqual(Snippet.objects.recommended_for(self.user_a), [])
+
+        resp = self.ensure_login_required(recommended, "c", "c")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context["object_list"], [self.snippet3])
+
+        api_recommended = reverse("api_snippet_recommended")
+        resp = self.client.get(api_recommended)
+        self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.login(username="c", password="c")
+        resp = self.client.get(api_recommended)
+        self.assertEqual([snippet["title"] for snippet in resp.json()], [self.snippet3.title])
+
     def test_feeds(self):
         # I don't want to put much time into testing these since the response
         # is kind of fucked up.
@@ -363,6 +641,87 @@ class SnippetViewsTestCase(BaseCabTestCase):
             [self.snippet1, self.snippet2, self.snippet3],
         )
 
+    def test_index_query_count(self):
+        def count_queries(url):
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            return len(queries)
+
+        def next_page_url(url):
+            resp = self.client.get(url)
+            return f"{snippet_index}{resp.context['pagination'].next_link}"
+
+        snippet_index = reverse("cab_snippet_list")
+        expected = {
+            tab: count_queries(f"{snippet_index}?tab={tab}") for tab in SnippetList.sorting_tabs
+        }
+
+        for i in range(20):
+            snippet = Snippet.objects.create(
+                title=f"Snippet {i}",
+                language=self.sql if i % 2 else self.python,
+                author=self.user_b,
+                description="Filler",
+                code="SELECT 1;",
+            )
+            snippet.tags.add("filler", f"filler-{i}")
+
+        for tab, num_queries in expected.items():
+            with self.subTest(tab=tab):
+                self.assertEqual(count_queries(f"{snippet_index}?tab={tab}"), num_queries)
+                next_page = next_page_url(f"{snippet_index}?tab={tab}")
+                self.assertEqual(count_queries(next_page), num_queries)
+
+    def test_snippet_list_sorts_by_index(self):
+        with connection.cursor() as cursor:
+            # forbid sorting, so a plan can only order rows by walking an index
+            cursor.execute("SET LOCAL enable_sort = off")
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+        indexes = {
+            "newest": "newest",
+            "latest_updated": "updated",
+            "highest_rated": "rated",
+            "most_bookmarked": "bookmarked",
+        }
+        # the querysets of the snippet list and of the language and author pages
+        querysets = {
+            "active_": Snippet.objects.active_snippet(),
+            "lang_": Snippet.objects.filter(language=self.python),
+            "author_": Snippet.objects.filter(author=self.user_a),
+        }
+        for tab, index in indexes.items():
+            for prefix, queryset in querysets.items():
+                with self.subTest(tab=tab, index=f"{prefix}{index}"):
+                    request = RequestFactory().get("/", {"tab": tab})
+                    pagination = SnippetList(request, Snippet, queryset, 20).pagination
+                    plan = pagination.queryset.order_by(*pagination.ordering)[:21].explain()
+                    self.assertNotIn("Sort", plan)
+                    self.assertIn(f"using cab_snippet_{prefix}{index} ", plan)
+
+    def test_popular_lists_sort_by_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_sort = off")
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+        # these list every snippet, spam included, so the partial indexes don't apply
+        querysets = {
+            "rated": Snippet.objects.top_rated(),
+            "bookmarked": Snippet.objects.most_bookmarked(),
+            "newest": Snippet.objects.all(),
+        }
+        request = RequestFactory().get("/")
+        for index, queryset in querysets.items():
+            with self.subTest(index=index):
+                pagination = SnippetList(request, Snippet, queryset, 20).pagination
+                plan = pagination.queryset.order_by(*pagination.ordering)[:21].explain()
+                self.assertNotIn("Sort", plan)
+                self.assertIn(f"using cab_snippet_{index} ", plan)
+        plan = LatestSnippetsFeed().items().explain()
+        self.assertNotIn("Sort", plan)
+        self.assertIn("using cab_snippet_newest ", plan)
+
     def test_snippet_detail(self):
         snippet_detail = reverse("cab_snippet_detail", args=[self.snippet1.pk])
         self.assertEqual(snippet_detail, f"/snippets/{self.snippet1.pk}/")
@@ -379,6 +738,89 @@ class SnippetViewsTestCase(BaseCabTestCase):
         self.assertEqual(resp["content-type"], "text/x-python")
         self.assertEqual(resp.content, b'print "Hello, world"')
 
+    def test_snippet_code_conditional_get(self):
+        for name in ("cab_snippet_raw", "cab_snippet_download"):
+            with self.subTest(name=name):
+                url = reverse(name, args=[self.snippet1.pk])
+                resp = self.client.get(url)
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("public", resp["Cache-Control"])
+                etag, last_modified = resp["ETag"], resp["Last-Modified"]
+
+                with CaptureQueriesContext(connection) as queries:
+                    resp = self.client.get(url, headers={"if-none-match": etag})
+                self.assertEqual(resp.status_code, 304)
+                # only the updated date is read, around the request's savepoint
+                selects = [query["sql"] for query in queries if query["sql"].startswith("SELECT")]
+                self.assertEqual(len(selects), 1)
+                self.assertNotIn("COUNT", selects[0])
+                self.assertEqual(resp.content, b"")
+                resp = self.client.get(url, headers={"if-modified-since": last_modified})
+                self.assertEqual(resp.status_code, 304)
+
+        etag = self.client.get(reverse("cab_snippet_raw", args=[self.snippet1.pk]))["ETag"]
+        self.snippet1.code = 'print("Hello, world")'
+        self.snippet1.save()
+        resp = self.client.get(
+            reverse("cab_snippet_raw", args=[self.snippet1.pk]),
+            headers={"if-none-match": etag},
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, b'print("Hello, world")')
+
+    def test_snippet_detail_conditional_get(self):
+        url = reverse("cab_snippet_detail", args=[self.snippet1.pk])
+        resp = self.client.get(url)
+        self.assertIn("private", resp["Cache-Control"])
+        etag = resp["ETag"]
+        resp = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(resp.status_code, 304)
+
+        # ratings, bookmarks and the visitor all show on the page
+        self.snippet1.ratings.rate(self.user_a, -1)
+        resp = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(resp.status_code, 200)
+        etag = resp["ETag"]
+        Bookmark.objects.create(snippet=self.snippet1, user=self.user_a)
+        self.assertNotEqual(self.client.get(url)["ETag"], etag)
+        etag = self.client.get(url)["ETag"]
+        self.client.login(username="a", password="a")
+        resp = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_snippet_detail_fragments_follow_changes(self):
+        url = reverse("cab_snippet_detail", args=[self.snippet1.pk])
+        self.assertNotContains(self.client.get(url), "cached-tag")
+
+        version = snippet_cache_version(self.snippet1.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.snippet1.tags.add("cached-tag")
+            # the version only moves once the change is committed
+            self.assertEqual(snippet_cache_version(self.snippet1.pk), version)
+        self.assertNotEqual(snippet_cache_version(self.snippet1.pk), version)
+        self.assertContains(self.client.get(url), "cached-tag")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            django_comments.get_model().objects.create(
+                content_object=self.snippet1,
+                site_id=settings.SITE_ID,
+                user=self.user_b,
+                comment="Thanks for sharing",
+            )
+        self.assertContains(self.client.get(url), "Thanks for sharing")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.snippet1.ratings.rate(self.user_a, -1)
+        self.assertContains(self.client.get(url), "0 (after 2 ratings)")
+
+    def test_snippet_rate_again(self):
+        # the same score again leaves the cached page and the matrix alone
+        with self.captureOnCommitCallbacks() as callbacks:
+            rating = self.snippet1.ratings.rate(self.user_a, 1)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(rating.score, 1)
+        self.assertEqual(Snippet.objects.get(pk=self.snippet1.pk).rating_score, 2)
+
     def test_snippet_rate(self):
         self.snippet1.ratings.clear()
         self.snippet1 = Snippet.objects.get(pk=self.snippet1.pk)
@@ -453,7 +895,14 @@ class SnippetViewsTestCase(BaseCabTestCase):
             "code": 'print "Hi"',
             "tags": "hi, world",
         }
-        resp = self.client.post(snippet_edit, payload)
+        # once for the new title and tags together
+        with mock.patch.object(
+            RelatedSnippet.objects,
+            "refresh",
+            wraps=RelatedSnippet.objects.refresh,
+        ) as refresh:
+            resp = self.client.post(snippet_edit, payload)
+        refresh.assert_called_once()
 
         snippet1 = Snippet.objects.get(pk=self.snippet1.pk)
         self.assertEqual(snippet1.title, "Hi")
@@ -541,6 +990,51 @@ class TemplatetagTestCase(BaseCabTestCase):
         rendered = t.render(c)
         self.assertEqual(rendered, "N")
 
+    def test_viewer_state(self):
+        SnippetFlag.objects.create(
+            snippet=self.snippet2,
+            user=self.user_a,
+            flag=SnippetFlag.FLAG_SPAM,
+        )
+        t = Template(
+            "{% load cab_tags ratings_tags %}{% for snippet in snippets %}"
+            "{{ snippet|is_bookmarked:user|yesno:'B,-' }}"
+            "{{ user|has_flagged:snippet|yesno:'F,-' }}"
+            "{{ snippet|rating_score:user }}|{% endfor %}",
+        )
+        snippets = [self.snippet1, self.snippet2, self.snippet3]
+
+        with self.assertNumQueries(3):
+            load_viewer_state(self.user_a, snippets)
+        with self.assertNumQueries(0):
+            rendered = t.render(Context({"snippets": snippets, "user": self.user_a}))
+        self.assertEqual(rendered, "B-1.0|-F-1.0|B-1.0|")
+
+        # snippets that weren't loaded are still looked up
+        snippet4 = Snippet.objects.create(
+            title="Not loaded",
+            language=self.python,
+            author=self.user_b,
+            description="",
+            code="pass",
+        )
+        Bookmark.objects.create(snippet=snippet4, user=self.user_a)
+        with self.assertNumQueries(3):
+            rendered = t.render(Context({"snippets": [snippet4], "user": self.user_a}))
+        self.assertEqual(rendered, "B-None|")
+
+        self.client.login(username="a", password="a")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("cab_snippet_list"))
+        Snippet.objects.bulk_create(
+            [
+                Snippet(title=f"More {i}", language=self.python, author=self.user_b, code="pass")
+                for i in range(10)
+            ],
+        )
+        with self.assertNumQueries(len(queries)):
+            self.client.get(reverse("cab_snippet_list"))
+
     def test_core_tags(self):
         t = Template(
             """{% load core_tags %}"""
@@ -563,6 +1057,31 @@ class MarkupTests(SimpleTestCase):
         self.assertEqual(safe_markdown("<pre>foo</pre>"), "<pre>foo</pre>")
 
 
+class HighlightCacheTests(SimpleTestCase):
+    def setUp(self):
+        highlight_code.cache_clear()
+        cache.clear()
+
+    def test_highlight_is_cached(self):
+        with mock.patch("cab.utils.highlight", wraps=pygments.highlight) as render:
+            html = highlight_code('print "Hello"', "python")
+            self.assertIn('<div class="highlight">', html)
+            self.assertEqual(highlight_code('print "Hello"', "python"), html)
+            self.assertEqual(render.call_count, 1)
+
+            # another process would still find it in the shared cache
+            highlight_code.cache_clear()
+            self.assertEqual(highlight_code('print "Hello"', "python"), html)
+            self.assertEqual(render.call_count, 1)
+
+            highlight_code('print "Hello"', "python3")
+            highlight_code('print "Goodbye"', "python")
+            self.assertEqual(render.call_count, 3)
+
+    def test_lexer_is_reused(self):
+        self.assertIs(get_lexer("python"), get_lexer("python"))
+
+
 class SearchViewsTestCase(BaseCabTestCase):
     def test_index(self):
         search_index = reverse("cab_search")
@@ -581,6 +1100,34 @@ class SearchViewsTestCase(BaseCabTestCase):
         resp = self.client.get(search_index + "?q=doesnotexistforsure")
         self.assertCountEqual(resp.context["object_list"], [])
 
+    def test_search_vector_follows_edits(self):
+        search_index = reverse("cab_search")
+        self.snippet2.description = "A greeting in disguise"
+        self.snippet2.save()
+        resp = self.client.get(search_index + "?q=greeting")
+        self.assertCountEqual(resp.context["object_list"], [self.snippet1, self.snippet2])
+
+        # the language name is part of the document as well
+        resp = self.client.get(search_index + "?q=sql")
+        self.assertCountEqual(resp.context["object_list"], [self.snippet3])
+
+    def test_update_search_vectors_command(self):
+        Snippet.objects.update(search_vector=None)
+        search_index = reverse("cab_search")
+        resp = self.client.get(search_index + "?q=greeting")
+        self.assertCountEqual(resp.context["object_list"], [])
+
+        call_command("update_search_vectors", batch_size=2, stdout=StringIO())
+        resp = self.client.get(search_index + "?q=greeting")
+        self.assertCountEqual(resp.context["object_list"], [self.snippet1])
+
+    def test_autocomplete(self):
+        resp = self.client.get(reverse("snippet_autocomplete") + "?q=farewell")
+        self.assertEqual(
+            resp.json(),
+            [{"title": "Goodbye world", "author": "b", "url": self.snippet2.get_absolute_url()}],
+        )
+
 
 class ApiTestCase(TestCase):
     def setUp(self):
@@ -658,6 +1205,84 @@ class ApiTestCase(TestCase):
         self.assertEqual(response.data, serializer.data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_export_snippets(self):
+        self.snippet2.mark_as_spam()
+        response = self.client.get(reverse("api_snippet_export"))
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        records = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([record["id"] for record in records], [self.snippet1.pk, self.snippet3.pk])
+        self.assertEqual(records[0]["tags"], ["hello", "world"])
+        self.assertEqual(records[0]["language"], "python")
+        self.assertEqual(records[1]["code"], "DROP TABLE accounts;")
+
+        # incremental exports
+        later = timezone.now() + datetime.timedelta(hours=1)
+        Snippet.objects.filter(pk=self.snippet3.pk).update(updated_date=later)
+        response = self.client.get(
+            reverse("api_snippet_export"),
+            {"since": (later - datetime.timedelta(minutes=1)).isoformat()},
+        )
+        records = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([record["id"] for record in records], [self.snippet3.pk])
+        response = self.client.get(reverse("api_snippet_export"), {"since": "yesterday"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # the format suffix routes work too
+        response = self.client.get(reverse("api_snippet_export", kwargs={"format": "json"}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 2)
+
+        response = self.client.get(reverse("api_snippet_export_archive"))
+        with tarfile.open(fileobj=BytesIO(b"".join(response.streaming_content))) as tarball:
+            self.assertEqual(
+                tarball.getnames(),
+                [f"{self.snippet1.pk}.py", f"{self.snippet3.pk}.sql"],
+            )
+            code = tarball.extractfile(f"{self.snippet1.pk}.py").read()
+        self.assertEqual(code, b'print "Hello, world"')
+
+    def test_export_snippets_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "snippets.ndjson"
+            call_command("export_snippets", output=str(path), since="2000-01-01")
+            records = [json.loads(line) for line in path.read_text().splitlines()]
+        self.assertEqual(len(records), 3)
+
+
+class BenchmarkTestCase(TestCase):
+    def setUp(self):
+        Language.objects.create(
+            name="Python",
+            slug="python",
+            language_code="python",
+            mime_type="text/x-python",
+            file_extension="py",
+        )
+
+    def test_seed_and_measure(self):
+        dataset = seed_dataset(30, seed=1)
+        self.assertEqual(dataset["snippets"], 30)
+        self.assertGreater(dataset["ratings"], 0)
+        self.assertEqual(
+            Snippet.objects.aggregate(total=Sum("bookmark_count"))["total"],
+            dataset["bookmarks"],
+        )
+
+        cases = benchmark_cases()
+        self.assertIn("snippet_list:highest_rated", cases)
+        names = ["snippet_list:newest", "snippet_detail", "top_tags", "calculate_similar_items"]
+        results = run_benchmarks({name: cases[name] for name in names}, repeat=1)
+        self.assertEqual(list(results), names)
+        self.assertGreater(results["snippet_detail"]["cold_queries"], 0)
+
+        slower = {
+            name: dict(result, median_ms=result["median_ms"] * 2 + 1)
+            for name, result in results.items()
+        }
+        self.assertEqual(compare_results(results, slower), [])
+        self.assertEqual(len(compare_results(slower, results)), len(names))
+
 
 class HomePageHtmxTestCase(TestCase):
     def setUp(self):
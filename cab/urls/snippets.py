@@ -15,5 +15,6 @@ urlpatterns = [
     path("<int:snippet_id>/edit/", snippets.edit_snippet, name="cab_snippet_edit"),
     path("<int:snippet_id>/flag/", snippets.flag_snippet, name="cab_snippet_flag"),
     path("add/", snippets.edit_snippet, name="cab_snippet_add"),
+    path("recommended/", snippets.recommended_snippets, name="cab_snippet_recommended"),
     path("tag-hint/", snippets.tag_hint, name="cab_snippet_tag_hint"),
 ]
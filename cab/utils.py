@@ -1,12 +1,21 @@
 import datetime
+import hashlib
+from functools import cache as memoize
+from functools import lru_cache, partial
+from uuid import uuid4
 from zoneinfo import ZoneInfo
 
 import bleach
+import pygments
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.http import Http404, HttpResponse
 from django.template import loader
 from django.utils.safestring import mark_safe
 from markdown import markdown as markdown_func
+from pygments import formatters, highlight, lexers
 
 from base.pagination import Pagination
 
@@ -14,6 +23,8 @@ from .main import SnippetList
 
 # Constants
 MAX_MONTHS_AGO = 48
+HIGHLIGHT_FORMATTER_OPTIONS = {"linenos": True}
+HIGHLIGHT_CACHE_TIMEOUT = getattr(settings, "CAB_HIGHLIGHT_CACHE_TIMEOUT", 60 * 60 * 24 * 30)
 
 
 def object_list(  # noqa: PLR0913
@@ -187,3 +198,79 @@ def sanitize_markdown(value):
             ],
         ),
     )
+
+
+@memoize
+def get_lexer(language_code):
+    """
+    Returns the Pygments lexer for a language code. Lexers don't keep state
+    between runs, so one instance per process is enough.
+    """
+    return lexers.get_lexer_by_name(language_code)
+
+
+def highlight_cache_key(code, language_code):
+    options = ",".join(
+        f"{key}={value}" for key, value in sorted(HIGHLIGHT_FORMATTER_OPTIONS.items())
+    )
+    digest = hashlib.sha256(code.encode("utf-8")).hexdigest()
+    return f"cab:highlight:{pygments.__version__}:{language_code}:{options}:{digest}"
+
+
+@lru_cache(maxsize=256)
+def highlight_code(code, language_code):
+    """
+    Highlights code as HTML. Results are shared through the configured cache
+    under a key derived from the code's SHA-256, the lexer and the formatter
+    options, with a small per-process LRU in front of it.
+    """
+    key = highlight_cache_key(code, language_code)
+    html = cache.get(key)
+    if html is None:
+        html = highlight(
+            code,
+            get_lexer(language_code),
+            formatters.HtmlFormatter(**HIGHLIGHT_FORMATTER_OPTIONS),
+        )
+        cache.set(key, html, HIGHLIGHT_CACHE_TIMEOUT)
+    return html
+
+
+def render_snippet(description, code, language_code):
+    """
+    Returns the description HTML and highlighted code of a snippet. Stays
+    clear of the database and the cache, so it can run in worker processes.
+    """
+    highlighted_code = highlight(
+        code,
+        get_lexer(language_code),
+        formatters.HtmlFormatter(**HIGHLIGHT_FORMATTER_OPTIONS),
+    )
+    return str(sanitize_markdown(description)), highlighted_code
+
+
+def snippet_cache_version_key(snippet_id):
+    return f"cab:snippet-version:{snippet_id}"
+
+
+def snippet_cache_version(snippet_id):
+    """
+    Returns the current version of the snippet's cached page fragments,
+    which are stored under it and go stale whenever it is bumped.
+    """
+    key = snippet_cache_version_key(snippet_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def set_snippet_cache_version(snippet_id):
+    cache.set(snippet_cache_version_key(snippet_id), uuid4().hex, None)
+
+
+def bump_snippet_cache_version(snippet_id, using=None):
+    # only once committed, or a request could render the fragments from the
+    # old rows and cache them under the new version
+    transaction.on_commit(partial(set_snippet_cache_version, snippet_id), using=using)
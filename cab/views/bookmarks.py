@@ -9,7 +9,9 @@ from cab.utils import object_list
 def user_bookmarks(request):
     return object_list(
         request,
-        queryset=Bookmark.objects.filter(user__pk=request.user.id),
+        queryset=Bookmark.objects.filter(user__pk=request.user.id).select_related(
+            "snippet__language",
+        ),
         template_name="cab/user_bookmarks.html",
         paginate_by=20,
     )
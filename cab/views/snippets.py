@@ -1,22 +1,31 @@
 import json
 
+import django_comments
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.contrib.postgres.search import SearchVector
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchQuery, SearchRank
 from django.core.mail import mail_admins
-from django.db.models import Count, Q
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, TextField
+from django.db.models.functions import Cast
 from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from taggit.models import Tag
 
 from cab.forms import AdvancedSearchForm, SnippetFlagForm, SnippetForm
+from cab.listeners import deferred_related_snippets
 from cab.models import Language, Snippet, SnippetFlag
 from cab.utils import month_object_list, object_detail
 
 # Constants
 MIN_QUERY_LENGTH = 2
+# Seconds browsers and CDNs may reuse raw and downloaded code
+SNIPPET_CODE_MAX_AGE = getattr(settings, "CAB_SNIPPET_CODE_MAX_AGE", 300)
 
 
 def snippet_list(request, queryset=None, **kwargs):
@@ -26,15 +35,98 @@ def snippet_list(request, queryset=None, **kwargs):
     return month_object_list(request, queryset=queryset, paginate_by=20, **kwargs)
 
 
+def snippet_state(request, snippet_id):
+    """
+    Returns the few values the validators of the snippet's page are derived
+    from, or None if there is no such snippet. Fetched once per request.
+    """
+    if not hasattr(request, "_snippet_state"):
+        comments = (
+            django_comments.get_model()
+            .objects.filter(
+                content_type=ContentType.objects.get_for_model(Snippet),
+                object_pk=Cast(OuterRef("pk"), TextField()),
+                is_public=True,
+                is_removed=False,
+            )
+            .order_by()
+            .values("object_pk")
+        )
+        request._snippet_state = (
+            Snippet.objects.filter(pk=snippet_id)
+            .annotate(
+                comment_count=Subquery(comments.annotate(count=Count("pk")).values("count")),
+                last_comment=Subquery(comments.annotate(last=Max("pk")).values("last")),
+            )
+            .values(
+                "updated_date",
+                "rating_score",
+                "bookmark_count",
+                "comment_count",
+                "last_comment",
+            )
+            .first()
+        )
+    return request._snippet_state
+
+
+def snippet_code_state(request, snippet_id):
+    """
+    Returns the only value the validators of the snippet's code are derived
+    from, without the comment subqueries of ``snippet_state()``.
+    """
+    if not hasattr(request, "_snippet_code_state"):
+        request._snippet_code_state = (
+            Snippet.objects.filter(pk=snippet_id).values("updated_date").first()
+        )
+    return request._snippet_code_state
+
+
+def code_etag(snippet_id, state):
+    return f"{snippet_id}-{state['updated_date'].timestamp()}"
+
+
+def snippet_last_modified(request, snippet_id):
+    state = snippet_code_state(request, snippet_id)
+    return state and state["updated_date"]
+
+
+def snippet_code_etag(request, snippet_id):
+    state = snippet_code_state(request, snippet_id)
+    return state and code_etag(snippet_id, state)
+
+
+def snippet_page_etag(request, snippet_id):
+    state = snippet_state(request, snippet_id)
+    # pending messages are shown on the page, so it has to be rendered
+    if state is None or messages.get_messages(request):
+        return None
+    return "-".join(
+        str(value)
+        for value in (
+            code_etag(snippet_id, state),
+            state["rating_score"],
+            state["bookmark_count"],
+            state["comment_count"],
+            state["last_comment"],
+            request.user.pk,
+        )
+    )
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=snippet_page_etag)
 def snippet_detail(request, snippet_id):
     return object_detail(
         request,
-        queryset=Snippet.objects.all(),
+        queryset=Snippet.objects.select_related("author", "language"),
         object_id=snippet_id,
         extra_context={"flag_form": SnippetFlagForm()},
     )
 
 
+@cache_control(public=True, max_age=SNIPPET_CODE_MAX_AGE)
+@condition(etag_func=snippet_code_etag, last_modified_func=snippet_last_modified)
 def download_snippet(request, snippet_id):
     snippet = get_object_or_404(Snippet, pk=snippet_id)
     response = HttpResponse(snippet.code, content_type="text/plain")
@@ -44,6 +136,8 @@ def download_snippet(request, snippet_id):
     return response
 
 
+@cache_control(public=True, max_age=SNIPPET_CODE_MAX_AGE)
+@condition(etag_func=snippet_code_etag, last_modified_func=snippet_last_modified)
 def raw_snippet(request, snippet_id):
     snippet = get_object_or_404(Snippet, pk=snippet_id)
     response = HttpResponse(snippet.code, content_type="text/plain")
@@ -63,6 +157,15 @@ def rate_snippet(request, snippet_id):
     return redirect(snippet)
 
 
+@login_required
+def recommended_snippets(request):
+    return render(
+        request,
+        "cab/recommended_snippets.html",
+        {"object_list": Snippet.objects.recommended_for(request.user)},
+    )
+
+
 @login_required
 def edit_snippet(request, snippet_id=None, template_name="cab/edit_snippet.html"):
     if not request.user.is_active:
@@ -79,7 +182,10 @@ def edit_snippet(request, snippet_id=None, template_name="cab/edit_snippet.html"
     if request.method == "POST":
         form = SnippetForm(instance=snippet, data=request.POST)
         if form.is_valid():
-            snippet = form.save()
+            # saving the snippet and then its tags would refresh its related
+            # snippets up to three times
+            with deferred_related_snippets():
+                snippet = form.save()
             messages.info(request, "Your snippet has been saved")
             return redirect(snippet)
     else:
@@ -163,7 +269,12 @@ def autocomplete(request):
     q = request.GET.get("q", "")
     results = []
     if len(q) > MIN_QUERY_LENGTH:
-        result_set = Snippet.objects.annotate(search=SearchVector("title")).filter(search=q)[:10]
+        query = SearchQuery(q)
+        result_set = (
+            Snippet.objects.filter(search_vector=query)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank")[:10]
+        )
         for obj in result_set:
             url = obj.get_absolute_url()
             results.append({"title": obj.title, "author": obj.author.username, "url": url})
@@ -187,9 +298,7 @@ def tag_hint(request):
 
 def basic_search(request):
     q = request.GET.get("q")
-    snippet_qs = Snippet.objects.annotate(
-        search=SearchVector("title", "description", "author__username"),
-    )
+    snippet_qs = Snippet.objects.all()
     form = AdvancedSearchForm(request.GET)
 
     if form.is_valid():
@@ -204,18 +313,7 @@ def basic_search(request):
 
 
 def advanced_search(request):
-    snippet_qs = Snippet.objects.annotate(
-        search=SearchVector(
-            "title",
-            "description",
-            "language__name",
-            "version",
-            "pub_date",
-            "bookmark_count",
-            "rating_score",
-            "author__username",
-        ),
-    )
+    snippet_qs = Snippet.objects.all()
     form = AdvancedSearchForm(request.GET)
     if form.is_valid():
         snippet_qs = form.search(snippet_qs)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from comments_spamfighter.standin import SPAM_AUTHOR, AkismetStandinServer
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the Akismet API, e.g. for benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=8765,
+            help="Port to listen on (default: 8765).",
+        )
+        parser.add_argument(
+            "--delay",
+            type=float,
+            default=0,
+            help="Seconds of latency added to every answer (default: 0).",
+        )
+
+    def handle(self, *args, **options):
+        server = AkismetStandinServer(
+            ("127.0.0.1", options["port"]),
+            delay=options["delay"],
+            verbose=options["verbosity"] > 1,
+        )
+        self.stdout.write(
+            f"Answering Akismet requests at {server.url} (set AKISMET_API_URL to it). "
+            f"Comments by {SPAM_AUTHOR!r} are spam.",
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,79 @@
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+from .models import Keyword, keywords_version
+
+# Patterns which refer to their own groups can't share an alternation,
+# since the group numbers shift.
+BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def compile_regexes(patterns):
+    """
+    Compiles the given regular expressions into as few patterns as
+    possible. Invalid expressions are skipped, the admin refuses them.
+    """
+    separate, combinable = [], []
+    for pattern in patterns:
+        try:
+            regex = re.compile(pattern, re.MULTILINE)
+        except re.error:
+            continue
+        if regex.groupindex or BACKREFERENCE.search(pattern):
+            separate.append(regex)
+        else:
+            combinable.append(pattern)
+    if not combinable:
+        return separate
+    try:
+        combined = re.compile("|".join(f"(?:{pattern})" for pattern in combinable), re.MULTILINE)
+    except re.error:
+        # e.g. global inline flags, which are only allowed at the very start
+        return [re.compile(pattern, re.MULTILINE) for pattern in combinable] + separate
+    return [combined, *separate]
+
+
+class KeywordMatcher:
+    """
+    The active keywords compiled per comment field: the plain keywords into
+    a single alternation and the regular expressions into as few patterns
+    as they allow.
+    """
+
+    def __init__(self, keywords):
+        literals, patterns = defaultdict(set), defaultdict(list)
+        for keyword in keywords:
+            for field_name in keyword.fields.split(","):
+                if keyword.is_regex:
+                    patterns[field_name].append(keyword.keyword)
+                else:
+                    literals[field_name].add(keyword.keyword.lower())
+        self.literals = {
+            field_name: re.compile("|".join(re.escape(word) for word in sorted(words)))
+            for field_name, words in literals.items()
+        }
+        self.regexes = {
+            field_name: compile_regexes(field_patterns)
+            for field_name, field_patterns in patterns.items()
+        }
+        self.field_names = list(dict.fromkeys([*self.literals, *self.regexes]))
+
+    def matches(self, field_name, value):
+        literals = self.literals.get(field_name)
+        if literals is not None and literals.search(value.lower()):
+            return True
+        return any(regex.match(value) for regex in self.regexes.get(field_name, ()))
+
+
+@lru_cache(maxsize=1)
+def _build_keyword_matcher(version):
+    return KeywordMatcher(Keyword.objects.filter(active=True))
+
+
+def get_keyword_matcher():
+    """
+    Returns the matcher for the active keywords, rebuilding it only after
+    a keyword changed.
+    """
+    return _build_keyword_matcher(keywords_version())
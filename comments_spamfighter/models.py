@@ -1,7 +1,15 @@
+from uuid import uuid4
+
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import signals
 from django.utils.translation import gettext_lazy as _
 
+# Changes whenever a keyword is saved or deleted, so that every process
+# rebuilds its compiled keyword matcher.
+KEYWORDS_VERSION_KEY = "comments_spamfighter:keywords_version"
+
 
 class Keyword(models.Model):
     # Default field choices. These are good inital values for the default
@@ -31,3 +39,33 @@ class Keyword(models.Model):
 
     def __str__(self):
         return self.keyword
+
+
+def keywords_version():
+    version = cache.get(KEYWORDS_VERSION_KEY)
+    if version is None:
+        cache.add(KEYWORDS_VERSION_KEY, uuid4().hex, None)
+        version = cache.get(KEYWORDS_VERSION_KEY)
+    return version
+
+
+def set_keywords_version():
+    cache.set(KEYWORDS_VERSION_KEY, uuid4().hex, None)
+
+
+def bump_keywords_version(*args, using=None, **kwargs):
+    # only once committed, or other processes could rebuild their matcher
+    # from the old keywords and keep it under the new version
+    transaction.on_commit(set_keywords_version, using=using)
+
+
+signals.post_save.connect(
+    bump_keywords_version,
+    sender=Keyword,
+    dispatch_uid="comments_spamfighter.keywords.save_version",
+)
+signals.post_delete.connect(
+    bump_keywords_version,
+    sender=Keyword,
+    dispatch_uid="comments_spamfighter.keywords.delete_version",
+)
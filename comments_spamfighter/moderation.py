@@ -1,12 +1,10 @@
-import re
-
-from akismet import Akismet
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.exceptions import ImproperlyConfigured
 from django_comments.moderation import CommentModerator
 
-from .models import Keyword
+from .matcher import get_keyword_matcher
+from .spamcheck import cached_verdict, get_check_params, schedule_akismet_check
 
 
 class SpamFighterModerator(CommentModerator):
@@ -26,37 +24,30 @@ class SpamFighterModerator(CommentModerator):
 
     def _keyword_check(self, comment, content_object, request):
         """
-        Checks each keyword from the keyword table to the fields of the comment.
+        Checks the active keywords against the fields of the comment.
         Returns True if a keyword matches. Otherwise returns False.
         """
-        # Iterate over all keywords
-        for keyword in Keyword.objects.filter(active=True):
-            # Iterate over all fields
-            for field_name in keyword.fields.split(","):
-                # Check that the given field is in the comments class. If
-                # settings.DEBUG is False, fail silently.
-                field_value = getattr(comment, field_name, None)
-                if not field_value:
-                    if settings.DEBUG:
-                        raise ImproperlyConfigured(
-                            '"%s" is not a field within your comments class.',
-                        )
-                    continue
-
-                # A regular expression check against the field value.
-                if keyword.is_regex:
-                    if re.match(keyword.keyword, field_value, re.MULTILINE):
-                        return True
-
-                # A simple string check against the field value.
-                elif keyword.keyword.lower() in field_value.lower():
-                    return True
+        matcher = get_keyword_matcher()
+        for field_name in matcher.field_names:
+            # Check that the given field is in the comments class. If
+            # settings.DEBUG is False, fail silently.
+            field_value = getattr(comment, field_name, None)
+            if not field_value:
+                if settings.DEBUG:
+                    raise ImproperlyConfigured(
+                        '"%s" is not a field within your comments class.',
+                    )
+                continue
+
+            if matcher.matches(field_name, field_value):
+                return True
         return False
 
     def _akismet_check(self, comment, content_object, request):
         """
-        Connects to Akismet and returns True if Akismet marks this comment as
-        spam. Otherwise returns False.
+        Returns True if Akismet already marked the same comment from the same
+        address as spam and False if it didn't. Otherwise returns None and
+        the comment is checked in the background once it is saved.
         """
         # Check if the akismet api key is set, fail silently if
         # settings.DEBUG is False and return False (not moderated)
@@ -66,15 +57,12 @@ class SpamFighterModerator(CommentModerator):
                 "You must set AKISMET_SECRET_API_KEY with your api key in your settings file.",
             )
 
-        akismet_api = Akismet(
-            akismet_api_key,
-            blog=f"{request.scheme}://{Site.objects.get_current().domain}/",
-        )
-        return akismet_api.check(
-            comment.ip_address,
-            request.META["HTTP_USER_AGENT"],
-            comment_content=comment.comment,
-        )
+        blog = f"{request.scheme}://{Site.objects.get_current().domain}/"
+        params = get_check_params(comment, request, blog)
+        verdict = cached_verdict(params)
+        if verdict is None:
+            comment._akismet_check_params = params
+        return verdict
 
     def allow(self, comment, content_object, request):
         """
@@ -130,8 +118,26 @@ class SpamFighterModerator(CommentModerator):
 
         # Akismet check
         # Return True if akismet marks this comment as spam and we want to moderate it.
-        return (
-            self.akismet_check
-            and self.akismet_check_moderate
-            and self._akismet_check(comment, content_object, request)
-        )
+        if self.akismet_check and self.akismet_check_moderate:
+            spam = self._akismet_check(comment, content_object, request)
+            if spam is not None:
+                return spam
+
+        # Hold the comment back until its pending Akismet check is done,
+        # which publishes it if nothing else did.
+        if hasattr(comment, "_akismet_check_params"):
+            comment._akismet_publish = True
+            return True
+        return False
+
+    def email(self, comment, content_object, request):
+        # the only moderation hook which runs after the comment is saved
+        params = getattr(comment, "_akismet_check_params", None)
+        if params is not None:
+            schedule_akismet_check(
+                comment.pk,
+                params,
+                publish=getattr(comment, "_akismet_publish", False),
+                delete_spam=not self.akismet_check_moderate,
+            )
+        super().email(comment, content_object, request)
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+
+import django_comments
+import requests
+from akismet import Akismet, SpamStatus
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Number of checks running at the same time.
+AKISMET_WORKERS = getattr(settings, "AKISMET_WORKERS", 4)
+
+VERDICT_CACHE_PREFIX = "comments_spamfighter:akismet"
+
+
+@cache
+def get_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=AKISMET_WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@cache
+def get_executor():
+    return ThreadPoolExecutor(max_workers=AKISMET_WORKERS, thread_name_prefix="akismet")
+
+
+class PooledAkismet(Akismet):
+    """
+    An Akismet client which reuses the connections of a shared session and
+    can be pointed at another endpoint, e.g. a local stand-in server, with
+    the ``AKISMET_API_URL`` setting.
+    """
+
+    def _request(self, url, parameters, headers=None):
+        return get_session().post(
+            url,
+            data=parameters,
+            headers=headers or self.get_headers(),
+            timeout=self.timeout,
+        )
+
+    def get_url(self, url):
+        api_url = getattr(settings, "AKISMET_API_URL", None)
+        if api_url:
+            endpoint = url.rsplit("/", 1)[-1]
+            return f"{api_url.rstrip('/')}/{endpoint}"
+        return super().get_url(url)
+
+
+def get_check_params(comment, request, blog):
+    """
+    Collects what Akismet needs to know about a comment while the request
+    is still around.
+    """
+    return {
+        "blog": blog,
+        "user_ip": comment.ip_address,
+        "user_agent": request.META.get("HTTP_USER_AGENT", ""),
+        "comment_author": comment.user_name,
+        "comment_author_email": comment.user_email,
+        "comment_author_url": comment.user_url,
+        "comment_content": comment.comment,
+    }
+
+
+def verdict_cache_key(params):
+    content = "\0".join(
+        params[name] or "" for name in ("comment_content", "comment_author", "comment_author_email")
+    )
+    digest = hashlib.sha256(content.encode()).hexdigest()
+    return f"{VERDICT_CACHE_PREFIX}:{params['user_ip']}:{digest}"
+
+
+def cached_verdict(params):
+    """
+    Returns True for spam and False for ham if Akismet already judged the
+    same comment from the same address, None otherwise.
+    """
+    return django_cache.get(verdict_cache_key(params))
+
+
+def check_spam(params):
+    """
+    Asks Akismet whether the comment is spam and remembers the answer.
+    Anything but a clear "ham" counts as spam.
+    """
+    verdict = cached_verdict(params)
+    if verdict is not None:
+        return verdict
+    params = dict(params)
+    akismet_api = PooledAkismet(
+        settings.AKISMET_SECRET_API_KEY,
+        blog=params.pop("blog"),
+        timeout=getattr(settings, "AKISMET_TIMEOUT", 10),
+    )
+    verdict = akismet_api.check(**params) != SpamStatus.Ham
+    # identical comments from the same address get the same answer
+    timeout = getattr(settings, "AKISMET_VERDICT_TIMEOUT", 60 * 60 * 24)
+    django_cache.set(verdict_cache_key(params), verdict, timeout)
+    return verdict
+
+
+def apply_akismet_check(comment_id, params, publish, delete_spam):
+    """
+    Runs the Akismet check of a held back comment. Ham is published if
+    nothing else held the comment back; spam is deleted or stays in the
+    moderation queue. When Akismet can't be reached the comment stays
+    moderated.
+    """
+    try:
+        spam = check_spam(params)
+    except Exception:
+        logger.exception("Akismet check of comment %s failed", comment_id)
+        return
+    comment = django_comments.get_model().objects.filter(pk=comment_id).first()
+    if comment is None:
+        return
+    if spam and delete_spam:
+        comment.delete()
+    elif not spam and publish:
+        # saved rather than updated, so that listeners learn about it
+        comment.is_public = True
+        comment.save(update_fields=["is_public"])
+
+
+def _run_akismet_check(*args):
+    try:
+        apply_akismet_check(*args)
+    finally:
+        # worker threads don't go through the request cycle which would
+        # otherwise clean up their connections
+        connections.close_all()
+
+
+def schedule_akismet_check(comment_id, params, publish, delete_spam):
+    """
+    Runs the check in the background once the comment is committed, so
+    neither the request nor its transaction waits for Akismet.
+    """
+    transaction.on_commit(
+        lambda: get_executor().submit(
+            _run_akismet_check,
+            comment_id,
+            params,
+            publish,
+            delete_spam,
+        ),
+    )
@@ -0,0 +1,81 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Akismet's documented way of asking for a spam verdict.
+SPAM_AUTHOR = "viagra-test-123"
+SPAM_AUTHOR_EMAIL = "akismet-guaranteed-spam@example.com"
+
+
+class AkismetStandinHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = {
+            key: values[-1] for key, values in parse_qs(self.rfile.read(length).decode()).items()
+        }
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        endpoint = self.path.rstrip("/").rsplit("/", 1)[-1]
+        if endpoint == "comment-check":
+            self.server.checks.append(data)
+            spam = (
+                data.get("comment_author") == SPAM_AUTHOR
+                or data.get("comment_author_email") == SPAM_AUTHOR_EMAIL
+            )
+            body = b"true" if spam else b"false"
+        elif endpoint in ("submit-spam", "submit-ham"):
+            body = b"Thanks for making the web a better place."
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class AkismetStandinServer(ThreadingHTTPServer):
+    """
+    A local HTTP server which answers like the Akismet API, for tests and
+    benchmarks. Point ``AKISMET_API_URL`` at its ``url``. Comments by
+    ``SPAM_AUTHOR`` or ``SPAM_AUTHOR_EMAIL`` are spam, everything else is
+    ham. ``delay`` adds seconds of latency to every answer.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), delay=0, verbose=False):
+        super().__init__(address, AkismetStandinHandler)
+        self.delay = delay
+        self.verbose = verbose
+        self.checks = []
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/1.1/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,120 @@
+import django_comments
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+
+from comments_spamfighter.models import Keyword, keywords_version
+from comments_spamfighter.moderation import SpamFighterModerator
+from comments_spamfighter.spamcheck import apply_akismet_check, check_spam, get_check_params
+from comments_spamfighter.standin import SPAM_AUTHOR, AkismetStandinServer
+
+
+class AkismetTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = AkismetStandinServer()
+        cls.server.start()
+        cls.addClassCleanup(cls.server.stop)
+        cls.enterClassContext(
+            override_settings(AKISMET_SECRET_API_KEY="standin", AKISMET_API_URL=cls.server.url),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.server.checks.clear()
+        self.request = RequestFactory().post("/comments/post/", HTTP_USER_AGENT="Tests")
+        self.site = Site.objects.get_current()
+
+    def create_comment(self, user_name="Alice", **kwargs):
+        return django_comments.get_model().objects.create(
+            content_object=self.site,
+            site=self.site,
+            user_name=user_name,
+            user_email="alice@example.com",
+            comment="Nice snippet!",
+            ip_address="127.0.0.1",
+            **kwargs,
+        )
+
+    def test_check_spam(self):
+        ham = self.create_comment()
+        spam = self.create_comment(user_name=SPAM_AUTHOR)
+        ham_params = get_check_params(ham, self.request, "http://testserver/")
+        spam_params = get_check_params(spam, self.request, "http://testserver/")
+
+        self.assertFalse(check_spam(ham_params))
+        self.assertTrue(check_spam(spam_params))
+        self.assertEqual(len(self.server.checks), 2)
+        self.assertEqual(self.server.checks[0]["user_agent"], "Tests")
+
+        # verdicts are remembered
+        self.assertFalse(check_spam(ham_params))
+        self.assertTrue(check_spam(spam_params))
+        self.assertEqual(len(self.server.checks), 2)
+
+    def test_apply_akismet_check(self):
+        comments = django_comments.get_model().objects
+        for user_name, publish, delete_spam, expected in [
+            ("Alice", True, False, True),
+            ("Alice", False, False, False),
+            (SPAM_AUTHOR, True, False, False),
+            (SPAM_AUTHOR, True, True, None),
+        ]:
+            with self.subTest(user_name=user_name, publish=publish, delete_spam=delete_spam):
+                comment = self.create_comment(user_name=user_name, is_public=False)
+                params = get_check_params(comment, self.request, "http://testserver/")
+                apply_akismet_check(comment.pk, params, publish, delete_spam)
+                is_public = comments.filter(pk=comment.pk).values_list("is_public", flat=True)
+                self.assertEqual(is_public.first(), expected)
+
+    def test_moderation_holds_comment_for_check(self):
+        moderator = SpamFighterModerator(django_comments.get_model())
+        moderator.akismet_check = True
+        moderator.email_notification = False
+
+        comment = django_comments.get_model()(
+            content_object=self.site,
+            site=self.site,
+            user_name="Alice",
+            comment="Nice snippet!",
+            ip_address="127.0.0.1",
+        )
+        self.assertTrue(moderator.allow(comment, self.site, self.request))
+        self.assertTrue(moderator.moderate(comment, self.site, self.request))
+        comment.save()
+        with self.captureOnCommitCallbacks() as callbacks:
+            moderator.email(comment, self.site, self.request)
+        self.assertEqual(len(callbacks), 1)
+        # nothing was sent while the comment was posted
+        self.assertEqual(self.server.checks, [])
+
+        # a known verdict is applied right away
+        params = get_check_params(comment, self.request, f"http://{self.site.domain}/")
+        check_spam(params)
+        comment = django_comments.get_model()(
+            content_object=self.site,
+            site=self.site,
+            user_name="Alice",
+            comment="Nice snippet!",
+            ip_address="127.0.0.1",
+        )
+        self.assertFalse(moderator.moderate(comment, self.site, self.request))
+
+
+class KeywordTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_keywords_version_moves_on_commit(self):
+        version = keywords_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            keyword = Keyword.objects.create(keyword="viagra", fields="comment")
+            self.assertEqual(keywords_version(), version)
+        self.assertNotEqual(keywords_version(), version)
+
+        version = keywords_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            keyword.delete()
+            self.assertEqual(keywords_version(), version)
+        self.assertNotEqual(keywords_version(), version)
@@ -54,6 +54,7 @@ INSTALLED_APPS = [
     "django_comments",
     "django.contrib.contenttypes",
     "django.contrib.flatpages",
+    "django.contrib.postgres",
     "django.contrib.messages",
     "django.contrib.sessions",
     "django.contrib.staticfiles",
@@ -77,6 +78,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = (
+    "base.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     # 'django.middleware.cache.UpdateCacheMiddleware',
@@ -216,3 +218,32 @@ REST_FRAMEWORK = {
 }
 
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+
+# Most queries a view may run per request, by URL name. Going over budget
+# is logged, or raises with QUERY_BUDGET_ACTION = "raise".
+QUERY_BUDGETS = {
+    "cab_snippet_list": 20,
+    "cab_snippet_detail": 30,
+    "cab_snippet_recommended": 15,
+    "cab_snippet_matches_tag": 20,
+    "cab_author_snippets": 20,
+    "cab_language_detail": 20,
+    "cab_search": 20,
+    "snippet_autocomplete": 10,
+    "cab_top_authors": 10,
+    "cab_top_tags": 10,
+    "cab_top_languages": 10,
+    "cab_feed_latest": 15,
+    "cab_feed_author": 15,
+    "cab_feed_language": 15,
+    "cab_feed_tag": 15,
+    "api_snippet_list": 15,
+    "api_snippet_detail": 15,
+    "api_snippet_recommended": 15,
+}
+QUERY_BUDGET_ACTION = "log"
+
+# Whether every response reports its queries, SQL, template and cache time
+# in a Server-Timing header. Staff always get it on responses that shared
+# caches don't store.
+SERVER_TIMING = False
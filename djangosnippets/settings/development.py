@@ -2,6 +2,8 @@ from djangosnippets.settings.base import *  # noqa: F403
 
 DEBUG = True
 
+SERVER_TIMING = True
+
 SECRET_KEY = "abcdefghijklmnopqrstuvwxyz0123456789"
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
@@ -7,6 +7,7 @@ SITE_ID = 1
 ROOT_URLCONF = "cab.tests.urls"
 
 MIDDLEWARE = (
+    "base.instrumentation.InstrumentationMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
@@ -15,6 +16,9 @@ MIDDLEWARE = (
     "allauth.account.middleware.AccountMiddleware",
 )
 
+# views going over their query budget fail the tests
+QUERY_BUDGET_ACTION = "raise"
+
 
 INSTALLED_APPS = [
     "django.contrib.admin",
@@ -23,6 +27,7 @@ INSTALLED_APPS = [
     "django_comments",
     "django.contrib.contenttypes",
     "django.contrib.sessions",
+    "django.contrib.postgres",
     "django.contrib.sites",
     "django.contrib.staticfiles",
     "django_components",
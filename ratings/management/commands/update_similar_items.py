@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from ratings.models import RatedItem
+from ratings.utils import calculate_similar_items, euclidean_score, pearson_score
+
+SIMILARITIES = {
+    "pearson": pearson_score,
+    "euclidean": euclidean_score,
+}
+
+
+class Command(BaseCommand):
+    help = "Recalculate the similar items of every rated object."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--num",
+            type=int,
+            default=10,
+            help="Number of similar items stored per object (default: 10).",
+        )
+        parser.add_argument(
+            "--similarity",
+            choices=sorted(SIMILARITIES),
+            default="pearson",
+            help="Similarity score to rank items by (default: pearson).",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only recalculate objects whose ratings changed since the last run.",
+        )
+
+    def handle(self, *args, **options):
+        calculate_similar_items(
+            RatedItem.objects.all(),
+            num=options["num"],
+            similarity=SIMILARITIES[options["similarity"]],
+            incremental=options["incremental"],
+        )
+        self.stdout.write(self.style.SUCCESS("Similar items updated."))
@@ -0,0 +1,67 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+SIMILAR_ITEM_FIELDS = ("content_type", "object_id", "similar_content_type", "similar_object_id")
+
+
+def remove_duplicate_similar_items(apps, schema_editor):
+    SimilarItem = apps.get_model("ratings", "SimilarItem")
+    duplicates = (
+        SimilarItem.objects.values(*SIMILAR_ITEM_FIELDS)
+        .annotate(keep=Max("pk"), count=Count("pk"))
+        .filter(count__gt=1)
+    )
+    for row in duplicates:
+        keep = row.pop("keep")
+        del row["count"]
+        SimilarItem.objects.filter(**row).exclude(pk=keep).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("ratings", "0002_alter_rateditem_user"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_similar_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="similaritem",
+            constraint=models.UniqueConstraint(
+                fields=SIMILAR_ITEM_FIELDS,
+                name="unique_similar_item",
+            ),
+        ),
+        migrations.CreateModel(
+            name="SimilarityFingerprint",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("object_id", models.IntegerField()),
+                ("fingerprint", models.CharField(max_length=40)),
+                (
+                    "content_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="contenttypes.contenttype",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("content_type", "object_id"),
+                        name="unique_similarity_fingerprint",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+
+RATED_ITEM_FIELDS = ("user", "content_type", "object_id")
+COUNTER_FIELDS = {"rating_score", "rating_count"}
+
+
+def recount_ratings(apps, affected):
+    """
+    Recomputes the denormalized rating counters of the given objects, by
+    content type, on the models which keep them.
+    """
+    ContentType = apps.get_model("contenttypes", "ContentType")
+    RatedItem = apps.get_model("ratings", "RatedItem")
+    for content_type in ContentType.objects.filter(pk__in=affected):
+        try:
+            model = apps.get_model(content_type.app_label, content_type.model)
+        except LookupError:
+            continue
+        if not COUNTER_FIELDS.issubset(field.name for field in model._meta.get_fields()):
+            continue
+        ratings = (
+            RatedItem.objects.filter(content_type=content_type, object_id=OuterRef("pk"))
+            .order_by()
+            .values("object_id")
+        )
+        score = Subquery(ratings.annotate(total=Sum("score")).values("total"))
+        count = Subquery(ratings.annotate(total=Count("pk")).values("total"))
+        model.objects.filter(pk__in=affected[content_type.pk]).update(
+            rating_score=Cast(Coalesce(score, Value(0.0)), models.IntegerField()),
+            rating_count=Coalesce(count, Value(0)),
+        )
+
+
+def remove_duplicate_ratings(apps, schema_editor):
+    # keeps the latest of the ratings racing requests stored twice
+    RatedItem = apps.get_model("ratings", "RatedItem")
+    duplicates = (
+        RatedItem.objects.values(*RATED_ITEM_FIELDS)
+        .annotate(keep=Max("pk"), count=Count("pk"))
+        .filter(count__gt=1)
+    )
+    affected = defaultdict(set)
+    for row in duplicates:
+        keep = row.pop("keep")
+        del row["count"]
+        RatedItem.objects.filter(**row).exclude(pk=keep).delete()
+        affected[row["content_type"]].add(row["object_id"])
+    # the counters still include the removed ratings, and are only ever
+    # adjusted by the difference a rating makes from now on
+    recount_ratings(apps, affected)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ratings", "0003_similarity_fingerprint"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_ratings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="rateditem",
+            index=models.Index(fields=["content_type", "object_id"], name="ratings_rated_item"),
+        ),
+        migrations.AddConstraint(
+            model_name="rateditem",
+            constraint=models.UniqueConstraint(
+                fields=RATED_ITEM_FIELDS,
+                name="unique_rated_item",
+            ),
+        ),
+        migrations.RemoveField(
+            model_name="rateditem",
+            name="hashed",
+        ),
+    ]
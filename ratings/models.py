@@ -1,5 +1,3 @@
-import hashlib
-
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
@@ -7,13 +5,19 @@ from django.db import models
 from django.db.models.query import QuerySet
 from generic_aggregation import generic_annotate
 
-from .utils import is_gfk, recommended_items
+from .signals import rating_changed
+from .utils import delete_rating, is_gfk, recommended_items, upsert_rating
 
 
 class RatedItemBase(models.Model):
+    """
+    The rating of an object by a user. Concrete models should make
+    ``user`` together with their ``item_fields()`` unique, so a user can't
+    end up with two ratings of the same object.
+    """
+
     score = models.FloatField(default=0, db_index=True)
     user = models.ForeignKey(User, related_name="%(class)ss", on_delete=models.CASCADE)
-    hashed = models.CharField(max_length=40, editable=False, db_index=True)
 
     class Meta:
         abstract = True
@@ -21,15 +25,32 @@ class RatedItemBase(models.Model):
     def __str__(self):
         return f"{self.content_object} rated {self.score} by {self.user}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_score = instance.__dict__.get("score")
+        return instance
+
     def save(self, *args, **kwargs):
-        self.hashed = self.generate_hash()
         super().save(*args, **kwargs)
+        self._loaded_score = self.score
 
-    def generate_hash(self):
-        content_field = self._meta.get_field("content_object")
-        related_object = getattr(self, content_field.name)
-        uniq = f"{related_object._meta}.{related_object.pk}"
-        return hashlib.sha1(uniq.encode("ascii")).hexdigest()
+    def get_score_change(self):
+        """
+        Returns how much the score differs from the one last loaded from or
+        saved to the database, or None if that isn't known.
+        """
+        loaded_score = getattr(self, "_loaded_score", None)
+        if loaded_score is None:
+            return None
+        return self.score - loaded_score
+
+    @classmethod
+    def item_fields(cls):
+        """
+        The fields which tell the rated objects apart.
+        """
+        return ["content_object"]
 
     @classmethod
     def lookup_kwargs(cls, instance):
@@ -49,6 +70,21 @@ class RatedItem(RatedItemBase):
     )
     content_object = GenericForeignKey()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["content_type", "object_id"], name="ratings_rated_item"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "content_type", "object_id"],
+                name="unique_rated_item",
+            ),
+        ]
+
+    @classmethod
+    def item_fields(cls):
+        return ["content_type", "object_id"]
+
     @classmethod
     def lookup_kwargs(cls, instance):
         return {
@@ -194,14 +230,31 @@ class _RatingsDescriptor(models.Manager):
             clear.alters_data = True
 
             def rate(self, user, score):
-                rating, created = self.get_or_create(user=user)
-                if created or score != rating.score:
-                    rating.score = score
-                    rating.save()
+                pk, previous_score = upsert_rating(rel_model, instance, user, score)
+                rating = rel_model(pk=pk, user=user, score=score, **self.core_filters)
+                rating._loaded_score = score
+                if previous_score != score:
+                    rating_changed.send(
+                        sender=rel_model,
+                        rating=rating,
+                        score_delta=score if previous_score is None else score - previous_score,
+                        count_delta=int(previous_score is None),
+                    )
                 return rating
 
             def unrate(self, user):
-                return self.filter(user=user, **rel_model.lookup_kwargs(instance)).delete()
+                deleted = delete_rating(rel_model, instance, user)
+                if deleted is None:
+                    return 0, {}
+                pk, score = deleted
+                rating = rel_model(pk=pk, user=user, score=score, **self.core_filters)
+                rating_changed.send(
+                    sender=rel_model,
+                    rating=rating,
+                    score_delta=-score,
+                    count_delta=-1,
+                )
+                return 1, {rel_model._meta.label: 1}
 
             def perform_aggregation(self, aggregator):
                 score = self.all().aggregate(agg=aggregator("score"))
@@ -232,10 +285,10 @@ class _RatingsDescriptor(models.Manager):
 
         return manager
 
-    def update_similar_items(self):
+    def update_similar_items(self, incremental=False):
         from ratings.utils import calculate_similar_items
 
-        calculate_similar_items(self.all())
+        calculate_similar_items(self.all(), incremental=incremental)
 
     def similar_items(self, item):
         return SimilarItem.objects.get_for_item(item)
@@ -275,5 +328,35 @@ class SimilarItem(models.Model):
 
     objects = SimilarItemManager()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["content_type", "object_id", "similar_content_type", "similar_object_id"],
+                name="unique_similar_item",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.similar_object} ({self.score})"
+
+
+class SimilarityFingerprint(models.Model):
+    """
+    Digest of an item's ratings as of the last similar items calculation,
+    used to find the items an incremental run has to recalculate.
+    """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.IntegerField()
+    fingerprint = models.CharField(max_length=40)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["content_type", "object_id"],
+                name="unique_similarity_fingerprint",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.content_type_id}.{self.object_id}: {self.fingerprint}"
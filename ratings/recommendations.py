@@ -0,0 +1,188 @@
+import heapq
+from array import array
+from collections import defaultdict
+from functools import partial
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+
+from .utils import load_rating_matrix, pearson_score
+
+MATRIX_CACHE_PREFIX = "ratings:matrix"
+MATRIX_CACHE_TIMEOUT = getattr(settings, "RATINGS_MATRIX_CACHE_TIMEOUT", 60 * 60 * 24)
+# Seconds between rebuilds of a matrix whose ratings changed.
+MATRIX_REBUILD_INTERVAL = getattr(settings, "RATINGS_MATRIX_REBUILD_INTERVAL", 60)
+
+# the matrices this process last used, as {content_type_id: (version, matrix)}
+_matrices = {}
+
+
+def _compress(rows):
+    """
+    Packs rows of ``[(index, value), ...]`` into the ``(indptr, indices,
+    data)`` arrays of compressed sparse rows.
+    """
+    indptr, indices, data = array("q", [0]), array("q"), array("d")
+    for row in rows:
+        for index, value in row:
+            indices.append(index)
+            data.append(value)
+        indptr.append(len(indices))
+    return indptr, indices, data
+
+
+class RatingMatrix:
+    """
+    The ratings of one model as a sparse user x item matrix in compressed
+    sparse rows, along with its transpose, so that both the ratings of a
+    user and the users who rated an item are a slice of an array. Users and
+    items are rows and columns in the order of their ids.
+    """
+
+    def __init__(self, item_matrix):
+        """
+        Takes the ``{item_id: {user_id: score}}`` ratings of one model, as
+        returned per content type by ``load_rating_matrix()``.
+        """
+        self.item_ids = sorted(item_matrix)
+        by_user = defaultdict(list)
+        for column, item_id in enumerate(self.item_ids):
+            for user_id, score in item_matrix[item_id].items():
+                by_user[user_id].append((column, score))
+        self.user_ids = sorted(by_user)
+        self.users = {user_id: row for row, user_id in enumerate(self.user_ids)}
+        self.rows = _compress(by_user[user_id] for user_id in self.user_ids)
+        self.columns = _compress(
+            sorted((self.users[user_id], score) for user_id, score in item_matrix[item_id].items())
+            for item_id in self.item_ids
+        )
+
+    @staticmethod
+    def _slice(compressed, index):
+        indptr, indices, data = compressed
+        start, end = indptr[index], indptr[index + 1]
+        return zip(indices[start:end], data[start:end], strict=True)
+
+    def _similar_rows(self, row, similarity):
+        # the co-rating sums with every user who rated one of the same items
+        sums = defaultdict(lambda: [0.0, 0.0, 0.0, 0.0, 0.0, 0])
+        for column, score in self._slice(self.rows, row):
+            for other, other_score in self._slice(self.columns, column):
+                if other == row:
+                    continue
+                acc = sums[other]
+                acc[0] += score
+                acc[1] += other_score
+                acc[2] += score * score
+                acc[3] += other_score * other_score
+                acc[4] += score * other_score
+                acc[5] += 1
+        return [(similarity(*acc), other) for other, acc in sums.items()]
+
+    def similar_users(self, user_id, num=None, similarity=pearson_score):
+        """
+        Returns ``[(score, user_id), ...]`` of the users who rated one of
+        the items ``user_id`` rated, most similar first.
+        """
+        row = self.users.get(user_id)
+        if row is None:
+            return []
+        matches = [
+            (score, self.user_ids[other]) for score, other in self._similar_rows(row, similarity)
+        ]
+        if num is None:
+            return sorted(matches, reverse=True)
+        return heapq.nlargest(num, matches)
+
+    def recommend(self, user_id, num=None, similarity=pearson_score):
+        """
+        Returns ``[(score, item_id), ...]`` of the items ``user_id`` hasn't
+        rated, best first, scored by the ratings of the users who rate
+        alike weighted by how alike, as ``recommendations()`` does.
+        """
+        row = self.users.get(user_id)
+        if row is None:
+            return []
+        rated = {column for column, _ in self._slice(self.rows, row)}
+        totals = defaultdict(float)
+        sim_sums = defaultdict(float)
+        for sim, other in self._similar_rows(row, similarity):
+            if sim <= 0:
+                continue
+            for column, score in self._slice(self.rows, other):
+                if column not in rated:
+                    totals[column] += score * sim
+                    sim_sums[column] += sim
+        rankings = [
+            (total / sim_sums[column], self.item_ids[column]) for column, total in totals.items()
+        ]
+        if num is None:
+            return sorted(rankings, reverse=True)
+        return heapq.nlargest(num, rankings)
+
+
+def rating_matrix_key(ctype_id, suffix):
+    return f"{MATRIX_CACHE_PREFIX}:{ctype_id}:{suffix}"
+
+
+def _set_rating_matrix_stale(ctype_id):
+    cache.set(rating_matrix_key(ctype_id, "stale"), True, None)
+
+
+def mark_rating_matrix_stale(ctype_id, using=None):
+    """
+    Has the next ``rating_matrix()`` call after the rebuild interval read
+    the ratings again, once the change is committed. Meanwhile the current
+    matrix is still served.
+    """
+    transaction.on_commit(partial(_set_rating_matrix_stale, ctype_id), using=using)
+
+
+def _build_rating_matrix(model, ctype_id):
+    # cleared first, so changes made while the ratings are read mark it again
+    cache.delete(rating_matrix_key(ctype_id, "stale"))
+    ratings = getattr(model, model._ratings_field).all()
+    matrix = RatingMatrix(load_rating_matrix(ratings).get(ctype_id, {}))
+    version = uuid4().hex
+    cache.set(rating_matrix_key(ctype_id, version), matrix, MATRIX_CACHE_TIMEOUT)
+    cache.set(rating_matrix_key(ctype_id, "version"), version, None)
+    _matrices[ctype_id] = (version, matrix)
+    return matrix
+
+
+def rating_matrix(model):
+    """
+    Returns the ``RatingMatrix`` of the ratings of ``model``. It is read
+    with a single query and cached under a version, which processes keep
+    their own copy of. Once ``mark_rating_matrix_stale()`` was called, one
+    process rebuilds it, at most every ``MATRIX_REBUILD_INTERVAL`` seconds,
+    while the others keep serving the last one. Until a matrix is cached at
+    all, e.g. after it was evicted, the others get an empty one.
+    """
+    ctype_id = ContentType.objects.get_for_model(model).pk
+    version_key = rating_matrix_key(ctype_id, "version")
+    stale_key = rating_matrix_key(ctype_id, "stale")
+    state = cache.get_many([version_key, stale_key])
+    version = state.get(version_key)
+    matrix = None
+    if version is not None:
+        version_matrix = _matrices.get(ctype_id)
+        if version_matrix is not None and version_matrix[0] == version:
+            matrix = version_matrix[1]
+        else:
+            matrix = cache.get(rating_matrix_key(ctype_id, version))
+            if matrix is not None:
+                _matrices[ctype_id] = (version, matrix)
+    # the lock outlives the rebuild, which spaces the rebuilds out
+    lock_key = rating_matrix_key(ctype_id, "lock")
+    if matrix is None:
+        if cache.add(lock_key, True, MATRIX_REBUILD_INTERVAL):
+            return _build_rating_matrix(model, ctype_id)
+        # another process builds it and there is nothing to serve meanwhile
+        return RatingMatrix({})
+    if state.get(stale_key) and cache.add(lock_key, True, MATRIX_REBUILD_INTERVAL):
+        return _build_rating_matrix(model, ctype_id)
+    return matrix
@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent by the rate() and unrate() of a ratings manager, which write with a
+# single statement instead of saving or deleting the rating. Receives the
+# ``rating`` and how much the sum and the number of the ratings of the rated
+# object changed, as ``score_delta`` and ``count_delta``. Not sent when a
+# user gives the same score again, which changes nothing.
+rating_changed = Signal()
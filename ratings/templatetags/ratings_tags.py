@@ -8,11 +8,16 @@ register = template.Library()
 @register.filter
 def rating_score(obj, user):
     """
-    Returns the score a user has given an object
+    Returns the score a user has given an object, from the ones fetched by
+    ``load_user_ratings`` if it was among them
     """
     if not user.is_authenticated or not hasattr(obj, "_ratings_field"):
         return False
 
+    scores = getattr(user, "_rating_scores", {}).get(obj._meta.concrete_model, {})
+    if obj.pk in scores:
+        return scores[obj.pk]
+
     ratings_descriptor = getattr(obj, obj._ratings_field)
     try:
         rating = ratings_descriptor.get(user=user).score
@@ -2,6 +2,8 @@ import unittest
 
 from django.contrib.auth.models import AnonymousUser, User
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.template import Context, Template
 from django.test import TestCase
 from django.test.utils import override_settings
@@ -10,7 +12,8 @@ from django.urls import reverse
 from base.tests.models import Beverage, BeverageRating, Food
 from ratings import utils as ratings_utils
 from ratings import views as ratings_views
-from ratings.models import RatedItem
+from ratings.models import RatedItem, SimilarItem
+from ratings.recommendations import mark_rating_matrix_stale, rating_matrix, rating_matrix_key
 from ratings.utils import (
     calculate_similar_items,
     recommendations,
@@ -173,6 +176,15 @@ class RatingsTestCase(TestCase):
         self.assertEqual(rating1.pk, rating1_alt.pk)
         self.assertEqual(rating1_alt.score, 1000000)
 
+    def test_one_rating_per_user(self):
+        self.item1.ratings.rate(self.john, 1)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.item1.ratings.create(user=self.john, score=-1)
+
+        self.item2.ratings.create(user=self.john, score=-1)
+        self.assertEqual(self.item1.ratings.get(user=self.john).score, 1)
+
     def test_scoring(self):
         self.item1.ratings.rate(self.john, 1)
         self.item1.ratings.rate(self.jane, -1)
@@ -690,6 +702,59 @@ class RecommendationsTestCase(TestCase):
             self.assertEqual(res[1], exp[1])
             self.assertAlmostEqual(res[0], exp[0])
 
+    def test_rating_matrix(self):
+        cache.clear()
+        matrix = rating_matrix(Food)
+
+        expected = recommendations(RatedItem.objects.all(), self.users, self.user_g)
+        results = matrix.recommend(self.user_g.pk)
+        self.assertEqual([pk for _, pk in results], [food.pk for _, food in expected])
+        for (score, _), (expected_score, _) in zip(results, expected, strict=True):
+            self.assertAlmostEqual(score, expected_score)
+        self.assertEqual(matrix.recommend(self.user_g.pk, 1), results[:1])
+
+        expected = top_matches(RatedItem.objects.all(), self.users, self.user_g, 3)
+        results = matrix.similar_users(self.user_g.pk, 3)
+        self.assertEqual([pk for _, pk in results], [user.pk for _, user in expected])
+
+        # it's reused until it's marked stale and the lock expired
+        with self.assertNumQueries(0):
+            self.assertIs(rating_matrix(Food), matrix)
+        ctype_id = ContentType.objects.get_for_model(Food).pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.food_a.ratings.rate(self.user_g, 5.0)
+            mark_rating_matrix_stale(ctype_id)
+        with self.assertNumQueries(0):
+            self.assertIs(rating_matrix(Food), matrix)
+        cache.delete(rating_matrix_key(ctype_id, "lock"))
+        matrix = rating_matrix(Food)
+        results = matrix.recommend(self.user_g.pk)
+        self.assertEqual([pk for _, pk in results], [self.food_f.pk, self.food_c.pk])
+
+        # later changes wait for the rebuild interval, serving the last one
+        with self.captureOnCommitCallbacks(execute=True):
+            self.food_f.ratings.rate(self.user_g, 1.0)
+            mark_rating_matrix_stale(ctype_id)
+        with self.assertNumQueries(0):
+            self.assertIs(rating_matrix(Food), matrix)
+        cache.delete(rating_matrix_key(ctype_id, "lock"))
+        results = rating_matrix(Food).recommend(self.user_g.pk)
+        self.assertEqual([pk for _, pk in results], [self.food_c.pk])
+
+    def test_rating_matrix_evicted(self):
+        cache.clear()
+        ctype_id = ContentType.objects.get_for_model(Food).pk
+        lock_key = rating_matrix_key(ctype_id, "lock")
+
+        # another process is building it, so there is nothing to serve yet
+        cache.add(lock_key, True)
+        with self.assertNumQueries(0):
+            self.assertEqual(rating_matrix(Food).recommend(self.user_g.pk), [])
+        cache.delete(lock_key)
+        results = rating_matrix(Food).recommend(self.user_g.pk)
+        expected = [self.food_f.pk, self.food_a.pk, self.food_c.pk]
+        self.assertEqual([pk for _, pk in results], expected)
+
     def test_item_recommendation(self):
         results = top_matches(RatedItem.objects.all(), self.foods, self.food_d)
         expected = [
@@ -742,6 +807,34 @@ class RecommendationsTestCase(TestCase):
         self.assertEqual(str(r2[0])[:5], "2.084")
         self.assertEqual(r2[1], self.food_e)
 
+    def test_incremental_similar_items(self):
+        def stored_matches():
+            return sorted(
+                SimilarItem.objects.values_list("object_id", "similar_object_id", "score"),
+            )
+
+        calculate_similar_items(RatedItem.objects.all(), 3)
+        self.assertEqual(SimilarItem.objects.count(), 18)
+
+        # nothing changed, so nothing is recalculated
+        ContentType.objects.clear_cache()
+        with self.assertNumQueries(4):
+            calculate_similar_items(RatedItem.objects.all(), 3, incremental=True)
+
+        self.food_a.ratings.rate(self.user_g, 5.0)
+        self.food_e.ratings.unrate(self.user_a)
+        calculate_similar_items(RatedItem.objects.all(), 3, incremental=True)
+        incremental = stored_matches()
+
+        calculate_similar_items(RatedItem.objects.all(), 3)
+        self.assertEqual(incremental, stored_matches())
+
+        # items without ratings lose their similar items
+        self.food_f.ratings.clear()
+        calculate_similar_items(RatedItem.objects.all(), 3, incremental=True)
+        self.assertFalse(SimilarItem.objects.filter(object_id=self.food_f.pk).exists())
+        self.assertFalse(SimilarItem.objects.filter(similar_object_id=self.food_f.pk).exists())
+
     def test_similar_item_model_unicode(self):
         self.food_b.name = "яблоко"
         self.food_b.save()
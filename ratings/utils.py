@@ -1,16 +1,56 @@
+import hashlib
+import heapq
+from collections import defaultdict
+from itertools import combinations
 from math import sqrt
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import FullResultSet
-from django.db import connection
+from django.db import OperationalError, connection
+from django.db.models import Exists, OuterRef
+
+# how often a rating is retried while concurrent ratings keep getting in first
+UPSERT_ATTEMPTS = 5
 
 
 def is_gfk(content_field):
     return isinstance(content_field, GenericForeignKey)
 
 
+def load_user_ratings(user, objects):
+    """
+    Fetches the scores ``user`` has given ``objects`` with one query per
+    model and keeps them on the user, where the ``rating_score`` filter
+    looks them up instead of querying once per object. ``request.user`` is
+    loaded per request, which scopes them to the request.
+    """
+    if not user.is_authenticated:
+        return
+    by_model = defaultdict(set)
+    for obj in objects:
+        if hasattr(obj, "_ratings_field"):
+            by_model[obj._meta.concrete_model].add(obj.pk)
+
+    scores = getattr(user, "_rating_scores", None)
+    if scores is None:
+        scores = user._rating_scores = {}
+    for model, pks in by_model.items():
+        rating_model = getattr(model, model._ratings_field).rating_model
+        content_field = rating_model._meta.get_field("content_object")
+        lookup = content_field.fk_field if is_gfk(content_field) else content_field.attname
+        model_scores = scores.setdefault(model, {})
+        model_scores.update(dict.fromkeys(pks))
+        model_scores.update(
+            rating_model._default_manager.filter(
+                user=user,
+                **rating_model.base_kwargs(model),
+                **{f"{lookup}__in": pks},
+            ).values_list(lookup, "score"),
+        )
+
+
 def query_has_where(query):
     try:
         where, _ = query.get_compiler(using="default").compile(query.where)
@@ -23,19 +63,104 @@ def query_as_sql(query):
     return query.get_compiler(connection=connection).as_sql()
 
 
-def sim_euclidean_distance(ratings_queryset, factor_a, factor_b):
-    rating_model = ratings_queryset.model
+def item_columns(rating_model):
+    return [rating_model._meta.get_field(name).column for name in rating_model.item_fields()]
+
 
+def lookup_columns(rating_model, instance):
+    """
+    Returns the ``{column: value}`` of the ratings of ``instance``, as given
+    by the ``lookup_kwargs()`` of ``rating_model``.
+    """
+    return {
+        rating_model._meta.get_field(name).column: getattr(value, "pk", value)
+        for name, value in rating_model.lookup_kwargs(instance).items()
+    }
+
+
+def co_rating_conditions(rating_model, factor_a, factor_b):
+    """
+    Returns the join and the filter conditions of the self-join of the
+    ratings table matching up the ratings of two users, on the objects they
+    both rated, or of two objects, on the users who rated both. Both only
+    compare integer columns.
+    """
     if isinstance(factor_a, User):
-        filter_field = "user_id"
-        match_on = "hashed"
-        lookup_a = factor_a.pk
-        lookup_b = factor_b.pk
+        match_on = item_columns(rating_model)
+        lookups = [("user_id", factor_a.pk, factor_b.pk)]
     else:
-        filter_field = "hashed"
-        match_on = "user_id"
-        lookup_a = rating_model(content_object=factor_a).generate_hash()
-        lookup_b = rating_model(content_object=factor_b).generate_hash()
+        match_on = ["user_id"]
+        columns_b = lookup_columns(rating_model, factor_b)
+        lookups = [
+            (column, value, columns_b[column])
+            for column, value in lookup_columns(rating_model, factor_a).items()
+        ]
+    join = " AND ".join(f"r1.{column} = r2.{column}" for column in match_on)
+    filters = " AND ".join(
+        f"r1.{column} = {int(value_a)} AND r2.{column} = {int(value_b)}"
+        for column, value_a, value_b in lookups
+    )
+    return join, filters
+
+
+def upsert_rating(rating_model, instance, user, score):
+    """
+    Stores the score ``user`` gives ``instance`` in a single statement and
+    returns the id of the rating and its previous score, or None if it was
+    just created.
+
+    The previous score is read from the snapshot PostgreSQL runs the whole
+    statement on, and the row is only updated if it still holds it. When a
+    concurrent rating by the same user got in between, nothing is returned
+    and the statement is retried, up to ``UPSERT_ATTEMPTS`` times. Inserted
+    rows have an ``xmax`` of 0 and no previous score, even if the snapshot
+    still saw one a concurrent unrate has since deleted.
+    """
+    quote = connection.ops.quote_name
+    table = quote(rating_model._meta.db_table)
+    lookups = lookup_columns(rating_model, instance)
+    columns = ["user_id", *lookups]
+    values = [user.pk, *lookups.values()]
+    pk = quote(rating_model._meta.pk.column)
+    conflict = ", ".join(quote(column) for column in columns)
+    where = " AND ".join(f"{quote(column)} = %s" for column in columns)
+    sql = f"""
+    WITH old AS (SELECT score FROM {table} WHERE {where})
+    INSERT INTO {table} AS rating (score, {conflict})
+    VALUES (%s, {", ".join(["%s"] * len(columns))})
+    ON CONFLICT ({conflict}) DO UPDATE SET score = EXCLUDED.score
+    WHERE rating.score = (SELECT score FROM old)
+    RETURNING {pk}, CASE WHEN xmax = 0 THEN NULL ELSE (SELECT score FROM old) END
+    """
+    with connection.cursor() as cursor:
+        for _ in range(UPSERT_ATTEMPTS):
+            cursor.execute(sql, [*values, score, *values])
+            row = cursor.fetchone()
+            if row is not None:
+                return row
+    msg = f"Rating {instance} by {user} kept changing, gave up after {UPSERT_ATTEMPTS} attempts."
+    raise OperationalError(msg)
+
+
+def delete_rating(rating_model, instance, user):
+    """
+    Removes the rating ``user`` gave ``instance`` in a single statement and
+    returns its id and score, or None if there was none.
+    """
+    quote = connection.ops.quote_name
+    table = quote(rating_model._meta.db_table)
+    pk = quote(rating_model._meta.pk.column)
+    lookups = lookup_columns(rating_model, instance)
+    where = " AND ".join(f"{quote(column)} = %s" for column in ["user_id", *lookups])
+    sql = f"DELETE FROM {table} WHERE {where} RETURNING {pk}, score"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user.pk, *lookups.values()])
+        return cursor.fetchone()
+
+
+def sim_euclidean_distance(ratings_queryset, factor_a, factor_b):
+    rating_model = ratings_queryset.model
+    match_on, filters = co_rating_conditions(rating_model, factor_a, factor_b)
 
     sql = """
     SELECT r1.score - r2.score AS diff
@@ -43,10 +168,9 @@ def sim_euclidean_distance(ratings_queryset, factor_a, factor_b):
         %(ratings_table)s AS r1
     INNER JOIN
         %(ratings_table)s AS r2
-    ON r1.%(match_on)s = r2.%(match_on)s
+    ON %(match_on)s
     WHERE
-        r1.%(filter_field)s = '%(lookup_a)s' AND
-        r2.%(filter_field)s = '%(lookup_b)s'
+        %(filters)s
         %(queryset_filter)s
     """
 
@@ -60,10 +184,8 @@ def sim_euclidean_distance(ratings_queryset, factor_a, factor_b):
 
     params = {
         "ratings_table": rating_model._meta.db_table,
-        "filter_field": filter_field,
         "match_on": match_on,
-        "lookup_a": lookup_a,
-        "lookup_b": lookup_b,
+        "filters": filters,
         "queryset_filter": queryset_filter,
     }
 
@@ -80,19 +202,32 @@ def sim_euclidean_distance(ratings_queryset, factor_a, factor_b):
     return 1 / (1 + sum_of_squares)
 
 
+def euclidean_score(sum1, sum2, sum1_sq, sum2_sq, psum, sample_size):  # noqa: PLR0913
+    """
+    Euclidean similarity computed from the co-rating sums of two factors.
+    """
+    return 1 / (1 + sum1_sq + sum2_sq - 2 * psum)
+
+
+def pearson_score(sum1, sum2, sum1_sq, sum2_sq, psum, sample_size):  # noqa: PLR0913
+    """
+    Pearson correlation computed from the co-rating sums of two factors.
+    """
+    if sample_size == 0:
+        return 0
+
+    num = psum - (sum1 * sum2 / sample_size)
+    den = sqrt((sum1_sq - pow(sum1, 2) / sample_size) * (sum2_sq - pow(sum2, 2) / sample_size))
+
+    if den == 0:
+        return 0
+
+    return num / den
+
+
 def sim_pearson_correlation(ratings_queryset, factor_a, factor_b):
     rating_model = ratings_queryset.model
-
-    if isinstance(factor_a, User):
-        filter_field = "user_id"
-        match_on = "hashed"
-        lookup_a = factor_a.pk
-        lookup_b = factor_b.pk
-    else:
-        filter_field = "hashed"
-        match_on = "user_id"
-        lookup_a = rating_model(content_object=factor_a).generate_hash()
-        lookup_b = rating_model(content_object=factor_b).generate_hash()
+    match_on, filters = co_rating_conditions(rating_model, factor_a, factor_b)
 
     sql = """
     SELECT
@@ -106,10 +241,9 @@ def sim_pearson_correlation(ratings_queryset, factor_a, factor_b):
         %(ratings_table)s AS r1
     INNER JOIN
         %(ratings_table)s AS r2
-    ON r1.%(match_on)s = r2.%(match_on)s
+    ON %(match_on)s
     WHERE
-        r1.%(filter_field)s = '%(lookup_a)s' AND
-        r2.%(filter_field)s = '%(lookup_b)s'
+        %(filters)s
         %(queryset_filter)s
     """
 
@@ -123,10 +257,8 @@ def sim_pearson_correlation(ratings_queryset, factor_a, factor_b):
 
     params = {
         "ratings_table": rating_model._meta.db_table,
-        "filter_field": filter_field,
         "match_on": match_on,
-        "lookup_a": lookup_a,
-        "lookup_b": lookup_b,
+        "filters": filters,
         "queryset_filter": queryset_filter,
     }
 
@@ -140,16 +272,10 @@ def sim_pearson_correlation(ratings_queryset, factor_a, factor_b):
 
     sum1, sum2, sum1_sq, sum2_sq, psum, sample_size = result
 
-    if sum1 is None or sum2 is None or sample_size == 0:
+    if sum1 is None or sum2 is None:
         return 0
 
-    num = psum - (sum1 * sum2 / sample_size)
-    den = sqrt((sum1_sq - pow(sum1, 2) / sample_size) * (sum2_sq - pow(sum2, 2) / sample_size))
-
-    if den == 0:
-        return 0
-
-    return num / den
+    return pearson_score(sum1, sum2, sum1_sq, sum2_sq, psum, sample_size)
 
 
 def top_matches(ratings_queryset, items, item, n=5, similarity=sim_pearson_correlation):
@@ -162,7 +288,10 @@ def top_matches(ratings_queryset, items, item, n=5, similarity=sim_pearson_corre
 
 
 def recommendations(ratings_queryset, people, person, similarity=sim_pearson_correlation):
-    already_rated = ratings_queryset.filter(user=person).values_list("hashed")
+    already_rated = ratings_queryset.filter(
+        user=person,
+        **{name: OuterRef(name) for name in ratings_queryset.model.item_fields()},
+    )
 
     totals = {}
     sim_sums = {}
@@ -176,7 +305,7 @@ def recommendations(ratings_queryset, people, person, similarity=sim_pearson_cor
         if sim <= 0:
             continue
 
-        items = ratings_queryset.filter(user=other).exclude(hashed__in=already_rated)
+        items = ratings_queryset.filter(user=other).exclude(Exists(already_rated))
 
         # now, score the items person hasn't rated yet
         for item in items:
@@ -193,70 +322,227 @@ def recommendations(ratings_queryset, people, person, similarity=sim_pearson_cor
     return rankings
 
 
-def calculate_similar_items(ratings_queryset, num=10):
-    # get distinct items from the ratings queryset - this can be optimized
+def load_rating_matrix(ratings_queryset):
+    """
+    Reads the ratings in a single query and returns them as a sparse matrix
+    of ``{content_type_id: {object_id: {user_id: score}}}``.
+    """
     field = ratings_queryset.model._meta.get_field("content_object")
+    matrix = defaultdict(lambda: defaultdict(dict))
 
     if is_gfk(field):
-        rated_ctypes = ratings_queryset.values_list("content_type", flat=True).distinct()
-        ctypes = ContentType.objects.filter(pk__in=rated_ctypes)
-        for ctype in ctypes:
-            ratings_subset = ratings_queryset.filter(content_type=ctype)
-            rating_ids = ratings_subset.values_list("object_id")
-            model_class = ctype.model_class()
-            queryset = model_class._default_manager.filter(pk__in=rating_ids)
-            _store_top_matches(ratings_queryset, queryset, num, True)
+        rows = ratings_queryset.values_list("content_type", "object_id", "user", "score")
+        for ctype_id, object_id, user_id, score in rows.iterator():
+            matrix[ctype_id][object_id][user_id] = score
     else:
-        rated_model = field.rel.to
-        rating_ids = ratings_queryset.values_list("content_object__pk")
-        queryset = rated_model._default_manager.filter(pk__in=rating_ids)
-        _store_top_matches(ratings_queryset, queryset, num, False)
+        ctype = ContentType.objects.get_for_model(field.related_model)
+        rows = ratings_queryset.values_list("content_object", "user", "score")
+        for object_id, user_id, score in rows.iterator():
+            matrix[ctype.pk][object_id][user_id] = score
 
+    return matrix
 
-def _store_top_matches(ratings_queryset, rated_queryset, num, is_gfk):
-    from ratings.models import SimilarItem
 
-    ctype = ContentType.objects.get_for_model(rated_queryset.model)
-    rated_queryset.values_list("pk")  # fill cache
-
-    for item in rated_queryset.iterator():
-        matches = top_matches(ratings_queryset, rated_queryset, item, num)
-        for score, match in matches:
-            si, created = SimilarItem.objects.get_or_create(
-                content_type=ctype,
-                object_id=item.pk,
-                similar_content_type=ContentType.objects.get_for_model(match),
-                similar_object_id=match.pk,
-            )
-            if created or si.score != score:
-                si.score = score
-                si.save()
+def ratings_fingerprint(item_ratings):
+    """
+    A digest of the ``{user_id: score}`` ratings of a single item, used to
+    tell which items changed since similarities were last calculated.
+    """
+    payload = ",".join(f"{user_id}:{score!r}" for user_id, score in sorted(item_ratings.items()))
+    return hashlib.sha1(payload.encode("ascii")).hexdigest()
 
 
-def recommended_items(ratings_queryset, user):
-    from ratings.models import SimilarItem
+def co_rating_sums(item_matrix, items=None):
+    """
+    Accumulates, for every pair of items rated by at least one common user,
+    the sums needed by the similarity scores. Pairs are keyed ``(a, b)`` with
+    ``a < b``. When ``items`` is given only pairs touching those items are
+    accumulated.
+    """
+    by_user = defaultdict(list)
+    for item, item_ratings in item_matrix.items():
+        for user_id, score in item_ratings.items():
+            by_user[user_id].append((item, score))
+
+    sums = defaultdict(lambda: [0.0, 0.0, 0.0, 0.0, 0.0, 0])
+    for user_ratings in by_user.values():
+        user_ratings.sort()
+        for (item_a, score_a), (item_b, score_b) in combinations(user_ratings, 2):
+            if items is not None and item_a not in items and item_b not in items:
+                continue
+            acc = sums[item_a, item_b]
+            acc[0] += score_a
+            acc[1] += score_b
+            acc[2] += score_a * score_a
+            acc[3] += score_b * score_b
+            acc[4] += score_a * score_b
+            acc[5] += 1
+    return sums
+
+
+def top_similar(item_matrix, num=10, similarity=pearson_score, items=None):
+    """
+    Returns ``{item: [(score, other_item), ...]}`` holding the ``num`` most
+    similar items for every item (or every item in ``items``), best first.
+    """
+    neighbours = defaultdict(list)
+    for (item_a, item_b), acc in co_rating_sums(item_matrix, items).items():
+        score = similarity(*acc)
+        if items is None or item_a in items:
+            neighbours[item_a].append((score, item_b))
+        if items is None or item_b in items:
+            neighbours[item_b].append((score, item_a))
+    return {item: heapq.nlargest(num, matches) for item, matches in neighbours.items()}
 
-    scores = {}
-    total_sim = {}
 
-    for item in ratings_queryset.filter(user=user):
-        similar_items = SimilarItem.objects.get_for_item(item.content_object)
-        for similar_item in similar_items:
-            actual = similar_item.similar_object
-            lookup_kwargs = ratings_queryset.model.lookup_kwargs(actual)
-            lookup_kwargs["user"] = user
+def calculate_similar_items(ratings_queryset, num=10, similarity=pearson_score, incremental=False):
+    """
+    Stores the ``num`` most similar items of every rated item as
+    ``SimilarItem`` rows.
 
-            if ratings_queryset.filter(**lookup_kwargs):
+    The ratings are read once and every pairwise similarity is computed in
+    memory. In ``incremental`` mode only the items whose ratings changed since
+    the last run, along with the items they are or were matched with, are
+    recalculated.
+    """
+    from ratings.models import SimilarItem, SimilarityFingerprint
+
+    for ctype_id, rated in load_rating_matrix(ratings_queryset).items():
+        # ratings may outlive the objects they point to
+        model_class = ContentType.objects.get_for_id(ctype_id).model_class()
+        existing = set(model_class._default_manager.values_list("pk", flat=True))
+        item_matrix = {item: r for item, r in rated.items() if item in existing}
+
+        fingerprints = {item: ratings_fingerprint(r) for item, r in item_matrix.items()}
+        stored = dict(
+            SimilarityFingerprint.objects.filter(content_type=ctype_id).values_list(
+                "object_id",
+                "fingerprint",
+            ),
+        )
+        removed = set(stored) - set(fingerprints)
+
+        if incremental:
+            changed = {item for item, fp in fingerprints.items() if stored.get(item) != fp}
+            if not changed and not removed:
                 continue
+            affected = set(changed)
+            affected.update(
+                SimilarItem.objects.filter(
+                    similar_content_type=ctype_id,
+                    similar_object_id__in=changed | removed,
+                ).values_list("object_id", flat=True),
+            )
+            changed_raters = {user_id for item in changed for user_id in item_matrix[item]}
+            affected.update(
+                item
+                for item, item_ratings in item_matrix.items()
+                if not changed_raters.isdisjoint(item_ratings)
+            )
+            affected -= removed
+            matches = top_similar(item_matrix, num, similarity, affected)
+        else:
+            changed = affected = set(fingerprints)
+            matches = top_similar(item_matrix, num, similarity)
+
+        _store_similar_items(ctype_id, affected | removed, matches)
+        SimilarItem.objects.filter(
+            similar_content_type=ctype_id,
+            similar_object_id__in=removed,
+        ).delete()
+
+        SimilarityFingerprint.objects.filter(content_type=ctype_id, object_id__in=removed).delete()
+        SimilarityFingerprint.objects.bulk_create(
+            [
+                SimilarityFingerprint(
+                    content_type_id=ctype_id,
+                    object_id=item,
+                    fingerprint=fingerprints[item],
+                )
+                for item in changed
+            ],
+            update_conflicts=True,
+            unique_fields=["content_type", "object_id"],
+            update_fields=["fingerprint"],
+            batch_size=1000,
+        )
+
+
+def _store_similar_items(ctype_id, items, matches, batch_size=1000):
+    """
+    Upserts the matches of ``items`` and removes their rows for matches which
+    are no longer in the top list.
+    """
+    from ratings.models import SimilarItem
 
-            scores.setdefault(actual, 0)
-            scores[actual] += similar_item.score * item.score
+    items = sorted(items)
+    for start in range(0, len(items), batch_size):
+        batch = items[start : start + batch_size]
+        kept = SimilarItem.objects.bulk_create(
+            [
+                SimilarItem(
+                    content_type_id=ctype_id,
+                    object_id=item,
+                    similar_content_type_id=ctype_id,
+                    similar_object_id=other,
+                    score=score,
+                )
+                for item in batch
+                for score, other in matches.get(item, [])
+            ],
+            update_conflicts=True,
+            unique_fields=[
+                "content_type",
+                "object_id",
+                "similar_content_type",
+                "similar_object_id",
+            ],
+            update_fields=["score"],
+        )
+        SimilarItem.objects.filter(content_type=ctype_id, object_id__in=batch).exclude(
+            pk__in=[similar_item.pk for similar_item in kept],
+        ).delete()
 
-            total_sim.setdefault(actual, 0)
-            total_sim[actual] += similar_item.score
 
-    rankings = [(score / total_sim[item], item) for item, score in scores.items()]
+def recommended_items(ratings_queryset, user):
+    """
+    Ranks the items similar to the ones ``user`` rated, by the stored
+    similarities weighted by those ratings, leaving out what they rated
+    already. The ratings, the similar items and the recommended objects are
+    read with a query each, per model.
+    """
+    from ratings.models import SimilarItem
 
-    rankings.sort()
-    rankings.reverse()
+    rated = load_rating_matrix(ratings_queryset.filter(user=user))
+    seen = {(ctype_id, item) for ctype_id, items in rated.items() for item in items}
+
+    scores = defaultdict(float)
+    total_sim = defaultdict(float)
+    for ctype_id, items in rated.items():
+        similar_items = SimilarItem.objects.filter(
+            content_type=ctype_id,
+            object_id__in=list(items),
+        ).values_list("object_id", "similar_content_type", "similar_object_id", "score")
+        for object_id, similar_ctype_id, similar_object_id, score in similar_items:
+            key = (similar_ctype_id, similar_object_id)
+            if key in seen:
+                continue
+            scores[key] += score * items[object_id][user.pk]
+            total_sim[key] += score
+
+    by_ctype = defaultdict(list)
+    for ctype_id, object_id in scores:
+        by_ctype[ctype_id].append(object_id)
+    objects = {}
+    for ctype_id, object_ids in by_ctype.items():
+        model_class = ContentType.objects.get_for_id(ctype_id).model_class()
+        for pk, obj in model_class._default_manager.in_bulk(object_ids).items():
+            objects[ctype_id, pk] = obj
+
+    rankings = [
+        (score / total_sim[key], objects[key])
+        for key, score in scores.items()
+        if key in objects and total_sim[key]
+    ]
+    rankings.sort(key=lambda ranking: ranking[0], reverse=True)
     return rankings